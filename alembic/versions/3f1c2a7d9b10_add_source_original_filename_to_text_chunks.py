@@ -0,0 +1,38 @@
+"""add source_original_filename to text_chunks
+
+Revision ID: 3f1c2a7d9b10
+Revises: c0a8e1f2b3d4
+Create Date: 2025-11-22 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a7d9b10'
+down_revision: Union[str, Sequence[str], None] = 'c0a8e1f2b3d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # IF NOT EXISTS：该列已手动添加过的库重复执行无副作用
+    op.execute(
+        "ALTER TABLE text_chunks "
+        "ADD COLUMN IF NOT EXISTS source_original_filename varchar(255) NOT NULL DEFAULT ''"
+    )
+    # 已有文本块从所属源文档回填文件名
+    op.execute(
+        "UPDATE text_chunks AS t SET source_original_filename = s.original_filename "
+        "FROM source_documents AS s "
+        "WHERE t.source_document_id = s.id AND t.source_original_filename = ''"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("text_chunks", "source_original_filename")
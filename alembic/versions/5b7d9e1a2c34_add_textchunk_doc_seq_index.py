@@ -0,0 +1,35 @@
+"""add composite index on text_chunks (source_document_id, sequence_in_document)
+
+Revision ID: 5b7d9e1a2c34
+Revises: 3f1c2a7d9b10
+Create Date: 2025-11-22 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7d9e1a2c34'
+down_revision: Union[str, Sequence[str], None] = '3f1c2a7d9b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 先建复合索引再删单列索引，任何时刻按文档的查询都有索引可用
+    op.create_index(
+        'ix_textchunk_doc_seq', 'text_chunks', ['source_document_id', 'sequence_in_document'], unique=False,
+        if_not_exists=True,
+    )
+    # 复合索引的最左列 source_document_id 已覆盖单独按文档的查询
+    op.drop_index(op.f('ix_text_chunks_source_document_id'), table_name='text_chunks', if_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_index(op.f('ix_text_chunks_source_document_id'), 'text_chunks', ['source_document_id'], unique=False)
+    op.drop_index('ix_textchunk_doc_seq', table_name='text_chunks')
@@ -0,0 +1,57 @@
+"""use jsonb for text_chunks.metadata_json and int[] for messages.retrieved_chunk_ids
+
+Revision ID: 8e2f4a6b1d57
+Revises: 5b7d9e1a2c34
+Create Date: 2025-11-22 11:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e2f4a6b1d57'
+down_revision: Union[str, Sequence[str], None] = '5b7d9e1a2c34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # json -> jsonb 可直接转换
+    op.alter_column(
+        'text_chunks', 'metadata_json',
+        type_=postgresql.JSONB(), existing_type=sa.JSON(), existing_nullable=True,
+        postgresql_using='metadata_json::jsonb',
+    )
+
+    # json 数组 -> integer[]：ALTER COLUMN ... USING 中不允许子查询，借助临时列逐行转换
+    op.add_column('messages', sa.Column('retrieved_chunk_ids_arr', postgresql.ARRAY(sa.Integer()), nullable=True))
+    op.execute(
+        "UPDATE messages SET retrieved_chunk_ids_arr = "
+        "ARRAY(SELECT value::integer FROM json_array_elements_text(retrieved_chunk_ids)) "
+        "WHERE json_typeof(retrieved_chunk_ids) = 'array'"  # JSON null 与 SQL NULL 都保持为 NULL
+    )
+    op.drop_column('messages', 'retrieved_chunk_ids')
+    op.alter_column('messages', 'retrieved_chunk_ids_arr', new_column_name='retrieved_chunk_ids')
+    op.create_index(
+        'ix_msg_retrieved_chunks_gin', 'messages', ['retrieved_chunk_ids'], unique=False, postgresql_using='gin',
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_msg_retrieved_chunks_gin', table_name='messages', postgresql_using='gin')
+    op.alter_column(
+        'messages', 'retrieved_chunk_ids',
+        type_=sa.JSON(), existing_type=postgresql.ARRAY(sa.Integer()), existing_nullable=True,
+        postgresql_using='to_json(retrieved_chunk_ids)',
+    )
+    op.alter_column(
+        'text_chunks', 'metadata_json',
+        type_=sa.JSON(), existing_type=postgresql.JSONB(), existing_nullable=True,
+        postgresql_using='metadata_json::json',
+    )
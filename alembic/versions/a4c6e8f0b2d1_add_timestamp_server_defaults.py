@@ -0,0 +1,44 @@
+"""add now() server defaults for created_at/updated_at
+
+Revision ID: a4c6e8f0b2d1
+Revises: 8e2f4a6b1d57
+Create Date: 2025-11-22 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c6e8f0b2d1'
+down_revision: Union[str, Sequence[str], None] = '8e2f4a6b1d57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_TABLES = ('source_documents', 'text_chunks', 'messages')
+_COLUMNS = ('created_at', 'updated_at')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # DateTimeMixin 改为依赖数据库侧 now()，INSERT 不再由 Python 端填值
+    for table in _TABLES:
+        for column in _COLUMNS:
+            op.alter_column(
+                table, column,
+                server_default=sa.text('now()'),
+                existing_type=sa.DateTime(timezone=True), existing_nullable=False,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in _TABLES:
+        for column in _COLUMNS:
+            op.alter_column(
+                table, column,
+                server_default=None,
+                existing_type=sa.DateTime(timezone=True), existing_nullable=False,
+            )
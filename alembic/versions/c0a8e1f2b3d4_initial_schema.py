@@ -0,0 +1,90 @@
+"""initial schema
+
+Revision ID: c0a8e1f2b3d4
+Revises: 
+Create Date: 2025-11-01 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c0a8e1f2b3d4'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _timestamp_columns() -> list[sa.Column]:
+    """DateTimeMixin 的时间戳列 (基线版本中由应用写入，没有数据库默认值)。"""
+    return [
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    ]
+
+
+def _timestamp_indexes(table_name: str) -> None:
+    op.create_index(op.f(f'ix_{table_name}_created_at'), table_name, ['created_at'], unique=False)
+    op.create_index(op.f(f'ix_{table_name}_updated_at'), table_name, ['updated_at'], unique=False)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 基线：项目最初的表结构 (source_documents / text_chunks / messages)，之后的结构变更各自作为后续版本
+    op.create_table(
+        'source_documents',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('object_name', sa.String(length=512), nullable=False),
+        sa.Column('bucket_name', sa.String(length=100), nullable=False),
+        sa.Column('original_filename', sa.String(length=255), nullable=False),
+        sa.Column('content_type', sa.String(length=100), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('error_message', sa.String(), nullable=True),
+        sa.Column('number_of_chunks', sa.Integer(), nullable=True),
+        *_timestamp_columns(),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_source_documents_object_name'), 'source_documents', ['object_name'], unique=True)
+    op.create_index(op.f('ix_source_documents_status'), 'source_documents', ['status'], unique=False)
+    _timestamp_indexes('source_documents')
+
+    op.create_table(
+        'text_chunks',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('source_document_id', sa.Integer(), nullable=False),
+        sa.Column('chunk_text', sa.Text(), nullable=False),
+        sa.Column('sequence_in_document', sa.Integer(), nullable=False),
+        sa.Column('metadata_json', sa.JSON(), nullable=True),
+        *_timestamp_columns(),
+        sa.ForeignKeyConstraint(['source_document_id'], ['source_documents.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_text_chunks_source_document_id'), 'text_chunks', ['source_document_id'], unique=False)
+    _timestamp_indexes('text_chunks')
+
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('response_to_id', sa.Integer(), nullable=True),
+        sa.Column('author', sa.Enum('USER', 'BOT', name='messageauthor'), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('retrieved_chunk_ids', sa.JSON(), nullable=True),
+        *_timestamp_columns(),
+        sa.ForeignKeyConstraint(['response_to_id'], ['messages.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index(op.f('ix_messages_response_to_id'), 'messages', ['response_to_id'], unique=False)
+    _timestamp_indexes('messages')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('messages')
+    op.drop_table('text_chunks')
+    op.drop_table('source_documents')
+    sa.Enum(name='messageauthor').drop(op.get_bind(), checkfirst=True)
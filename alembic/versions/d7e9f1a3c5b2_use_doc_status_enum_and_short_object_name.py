@@ -0,0 +1,78 @@
+"""use native doc_status enum and varchar(128) object_name on source_documents
+
+Revision ID: d7e9f1a3c5b2
+Revises: a4c6e8f0b2d1
+Create Date: 2025-11-22 12:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7e9f1a3c5b2'
+down_revision: Union[str, Sequence[str], None] = 'a4c6e8f0b2d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_DOC_STATUS_VALUES = ('uploaded', 'processing', 'ready', 'error')
+doc_status = postgresql.ENUM(*_DOC_STATUS_VALUES, name='doc_status', create_type=False)
+
+
+def _check_existing_rows() -> None:
+    """转换前校验已有数据：状态值必须属于枚举，object_name 不能超过 128 字符，否则中止迁移"""
+    bind = op.get_bind()
+    bad_status = bind.execute(
+        sa.text(
+            "SELECT count(*) FROM source_documents "
+            "WHERE status IS NULL OR lower(status) NOT IN :values"
+        ).bindparams(sa.bindparam('values', expanding=True)),
+        {'values': list(_DOC_STATUS_VALUES)},
+    ).scalar_one()
+    if bad_status:
+        raise RuntimeError(
+            f"source_documents 中有 {bad_status} 行的 status 不在 {_DOC_STATUS_VALUES} 中，请先修正数据再迁移"
+        )
+
+    too_long = bind.execute(
+        sa.text("SELECT count(*) FROM source_documents WHERE length(object_name) > 128")
+    ).scalar_one()
+    if too_long:
+        raise RuntimeError(
+            f"source_documents 中有 {too_long} 行的 object_name 超过 128 字符，请先修正数据再迁移"
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _check_existing_rows()
+
+    doc_status.create(op.get_bind(), checkfirst=True)
+    # 先去掉可能存在的字符串默认值，否则无法转换列类型
+    op.alter_column('source_documents', 'status', server_default=None, existing_type=sa.String(length=50))
+    op.alter_column(
+        'source_documents', 'status',
+        type_=doc_status, existing_type=sa.String(length=50), existing_nullable=False,
+        postgresql_using='lower(status)::doc_status',
+    )
+    op.alter_column(
+        'source_documents', 'object_name',
+        type_=sa.String(length=128), existing_type=sa.String(length=512), existing_nullable=False,
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.alter_column(
+        'source_documents', 'object_name',
+        type_=sa.String(length=512), existing_type=sa.String(length=128), existing_nullable=False,
+    )
+    op.alter_column(
+        'source_documents', 'status',
+        type_=sa.String(length=50), existing_type=doc_status, existing_nullable=False,
+        postgresql_using='status::text',
+    )
+    doc_status.drop(op.get_bind(), checkfirst=True)
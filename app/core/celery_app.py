@@ -114,6 +114,8 @@ Celery与RabbitMQ结合使用，提供可靠的异步任务处理能力。
 # # uv run celery -A app.core.celery_app worker --loglevel=info --pool=threads -Q celery,document_queue,query_processing,text_chunking --autoscale=4,2
 
 from celery import Celery
+from celery.signals import worker_init
+from loguru import logger
 from app.core.config import settings
 
 
@@ -161,7 +163,34 @@ celery_app.conf.update(
     # 移除可能导致问题的autoscale相关配置
     worker_prefetch_multiplier=1,
     task_acks_late=True,
+    # 默认使用 threads 池：模型在 Worker 进程内加载一次、由所有线程共享；
+    # prefork 池会在 fork 前初始化 CUDA，子进程中无法再使用 CUDA
+    worker_pool="threads",
 )
 
 
-# uv run celery -A app.core.celery_app worker --loglevel=info --pool=threads -Q celery,document_queue --autoscale=4,2
\ No newline at end of file
+@worker_init.connect
+def preload_models_on_worker_init(sender=None, **kwargs):
+    """
+    Worker 启动时预加载 Embedding/Reranker 模型。
+    使用 threads 池时所有线程共享本进程的模型，只需在主进程加载一次；Worker 不做 LLM 生成，跳过 LLM。
+    worker_init 在主进程中执行，命令行显式指定了其他池 (如 prefork) 时跳过预加载，
+    避免在 fork 前初始化 CUDA，模型改为在子进程中首次使用时加载。
+    """
+    if not settings.PRELOAD_MODELS_ON_STARTUP:
+        return
+    pool_cls = getattr(sender, "pool_cls", None) or celery_app.conf.worker_pool
+    pool_name = pool_cls if isinstance(pool_cls, str) else pool_cls.__module__
+    if "thread" not in pool_name:
+        logger.warning(f"Celery Worker 未使用 threads 池 ({pool_name})，跳过主进程中的模型预加载。")
+        return
+    from app.core.model_preload import preload_models  # 延迟导入，避免 celery 配置模块依赖 torch
+    preload_models(include_llm=False)
+
+
+# 启动方式：按负载类型拆成两个 Worker，均使用 threads 池 (任务内部是 asyncio + 共享的 GPU 模型，eventlet/gevent 的
+# monkey patch 与 asyncio 事件循环和 torch 都不兼容，故不采用)。
+# 文档处理 (解析 + 批量向量化，计算密集)：低并发，避免多个线程同时争抢 GPU 显存
+# uv run celery -A app.core.celery_app worker --loglevel=info --pool=threads -Q celery,document_queue -c 2 -n doc@%h
+# 查询处理 (大部分时间在等待 PostgreSQL / ChromaDB / Redis)：高并发，一个进程内多线程共享模型和每线程的数据库连接池
+# uv run celery -A app.core.celery_app worker --loglevel=info --pool=threads -Q query_queue -c 16 -n query@%h
\ No newline at end of file
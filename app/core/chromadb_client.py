@@ -9,33 +9,62 @@
 from app.core.config import settings
 from loguru import logger
 import chromadb  # 导入 ChromaDB 客户端库
+from chromadb.config import Settings as ChromaSettings
+import threading
 
  # 创建 ChromaDB 客户端日志记录器
 chroma_client = None # ChromaDB 客户端实例
+_chroma_client_lock = threading.Lock()  # 防止多个线程同时首次创建客户端
+_chroma_collection = None  # 集合句柄，进程内只获取一次
+
+
+def _create_chroma_client():
+    """创建 ChromaDB HTTP 客户端单例，调用方需持有 _chroma_client_lock。"""
+    global chroma_client
+    try:
+        # 如果 Celery worker 与 ChromaDB Docker 容器在同一个 Docker 网络中，
+        # 可以直接使用容器名和容器端口，例如 http://chromadb:8000
+        # 如果 Celery worker 运行在宿主机，则使用宿主机IP/localhost 和映射的端口 5500
+        # settings.CHROMA_HTTP_ENDPOINT = "http://localhost:5500"
+
+        # 客户端内部的 httpx 连接池按配置保持长连接，查询之间复用 TCP 连接；同时关闭匿名遥测上报
+        chroma_client = chromadb.HttpClient(
+            settings.CHROMA_HTTP_ENDPOINT,
+            settings=ChromaSettings(
+                anonymized_telemetry=False,
+                chroma_http_keepalive_secs=settings.CHROMA_HTTP_KEEPALIVE_SECS,
+                chroma_http_max_connections=settings.CHROMA_HTTP_MAX_CONNECTIONS,
+                chroma_http_max_keepalive_connections=settings.CHROMA_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        ) # 创建 ChromaDB 客户端实例
+        logger.info(f"ChromaDB 客户端已连接到: {settings.CHROMA_HTTP_ENDPOINT}") # 记录 ChromaDB 客户端连接信息
+    except Exception as e:
+        logger.error(
+            f"连接 ChromaDB 失败 ({settings.CHROMA_HTTP_ENDPOINT}): {e}", # 记录连接失败信息
+            exc_info=True, # 记录异常信息
+        )
+        raise RuntimeError("无法连接到 ChromaDB") from e # 抛出运行时错误
 
 
 def get_chroma_collection():
     """
-    获取 ChromaDB 客户端实例。
-    如果实例不存在，则创建一个新实例。
+    获取 ChromaDB 集合句柄 (进程级单例)。
+    首次调用时创建客户端并获取或创建集合，之后直接返回缓存的句柄，
+    每次检索不再额外发起一次 get_or_create_collection 的 HTTP 往返。
     """
-    global chroma_client
-    if chroma_client is None:
-        try:
-            # 如果 Celery worker 与 ChromaDB Docker 容器在同一个 Docker 网络中，
-            # 可以直接使用容器名和容器端口，例如 http://chromadb:8000
-            # 如果 Celery worker 运行在宿主机，则使用宿主机IP/localhost 和映射的端口 5500
-            # settings.CHROMA_HTTP_ENDPOINT = "http://localhost:5500"
-
-            chroma_client = chromadb.HttpClient(settings.CHROMA_HTTP_ENDPOINT) # 创建 ChromaDB 客户端实例
-            logger.info(f"ChromaDB 客户端已连接到: {settings.CHROMA_HTTP_ENDPOINT}") # 记录 ChromaDB 客户端连接信息
-        except Exception as e:
-            logger.error(
-                f"连接 ChromaDB 失败 ({settings.CHROMA_HTTP_ENDPOINT}): {e}", # 记录连接失败信息
-                exc_info=True, # 记录异常信息
-            )
-            raise RuntimeError("无法连接到 ChromaDB") from e # 抛出运行时错误
+    global _chroma_collection
+    if _chroma_collection is not None:
+        return _chroma_collection
+    with _chroma_client_lock:
+        if _chroma_collection is None:
+            _chroma_collection = _get_or_create_collection()
+    return _chroma_collection
+
 
+def _get_or_create_collection():
+    """创建客户端 (如尚未创建) 并获取或创建集合，调用方需持有 _chroma_client_lock。"""
+    if chroma_client is None:
+        _create_chroma_client()
     try:
         # settings.CHROMA_COLLECTION_NAME 是你在配置文件中定义的集合名称，例如 "rag_collection"
         # 你也可以为 bce-embedding 模型指定 embedding_function，但由于我们手动生成，可以不指定
@@ -6,6 +6,7 @@
 @Date ：2025/10/29 17:36
 @DOC: 
 """
+import os
 from functools import lru_cache
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -25,6 +26,14 @@ class BaseConfig(BaseSettings):
     POSTGRES_DB: str = "mememind"
     POSTGRES_USER: str = "postgres"
     POSTGRES_PASSWORD: str = "12345678"
+    DB_POOL_SIZE: int = 20  # FastAPI 进程连接池常驻连接数
+    DB_MAX_OVERFLOW: int = 10  # 连接池允许临时超出 pool_size 的连接数
+    DB_POOL_TIMEOUT: int = 30  # 从连接池获取连接的超时时间 (秒)
+    DB_POOL_RECYCLE: int = 3600  # 连接最长存活时间 (秒)，超时后重建，避免被服务端或中间设备断开
+    CELERY_DB_POOL_SIZE: int = 2  # Celery 每个 Worker 线程的连接池常驻连接数
+    AUTO_CREATE_TABLES: bool = False  # 启动时是否自动执行 alembic upgrade head，生产环境请用 scripts/migrate.py 单独迁移
+    DB_USE_PGBOUNCER: bool = False  # 是否经由 PgBouncer (事务池模式) 连接，开启后禁用 asyncpg 预编译语句缓存
+    DB_COPY_THRESHOLD: int = 1000  # 单次批量写入的文本块数达到该值时改用 COPY 导入，0 表示总是使用多行 INSERT
 
     # RabbitMQ 配置
     RABBITMQ_HOST: str = "localhost:5672"
@@ -44,9 +53,28 @@ class BaseConfig(BaseSettings):
     # ChromaDB 配置
     CHROMA_HTTP_ENDPOINT: str = "http://localhost:5500"  # ChromaDB HTTP 访问地址
     CHROMA_COLLECTION_NAME: str = "mememind_rag_collection"  # ChromaDB 集合名称
+    CHROMA_HTTP_KEEPALIVE_SECS: float = 60.0  # 空闲 keep-alive 连接的保留时间，避免每次查询重新握手
+    CHROMA_HTTP_MAX_CONNECTIONS: int = 64  # ChromaDB HTTP 连接池的最大连接数
+    CHROMA_HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 32  # 连接池中保持的最大空闲连接数
 
     # Embedding 模型相关
     EMBEDDING_INSTRUCTION_FOR_RETRIEVAL: str = "为这个句子生成表示以用于检索相关文章" # 为这个句子生成表示以用于检索相关文章，嵌入模型指令，用于检索相关文章
+    # Embedding 推理后端: transformers (PyTorch) / onnx (ONNX Runtime，需要安装 onnxruntime 或 onnxruntime-gpu)
+    EMBEDDING_BACKEND: str = "transformers"
+    # ONNX 模型路径，导出命令: optimum-cli export onnx --model app/embeddings/Qwen/Qwen3-Embedding-0.6B --task feature-extraction <输出目录>
+    EMBEDDING_ONNX_PATH: str = "app/embeddings/Qwen/Qwen3-Embedding-0.6B-onnx/model.onnx"
+    EMBEDDING_DEVICE: str = "auto"  # Embedding 模型设备: auto (依次尝试 cuda:0 / mps / cpu) 或显式指定如 cuda:0、cpu
+    EMBED_USE_COMPILE: bool = False  # CUDA 上是否用 torch.compile(reduce-overhead) 编译 Embedding 模型，输入按固定桶长度填充
+    EMBED_BATCH_SIZE: int = 64  # 查询向量化微批处理器单个批次最多合并的查询条数
+    EMBED_BATCH_WAIT_MS: float = 5.0  # 第一条查询到达后最多等待的时间 (毫秒)，超时即使未满也立即发车
+    EMBEDDING_CACHE_ENABLED: bool = True  # 是否启用向量缓存 (进程内 LRU + Redis)
+    EMBEDDING_CACHE_LOCAL_SIZE: int = 4096  # 进程内 LRU 缓存的最大条数
+    EMBEDDING_CACHE_REDIS_DB: int = 3  # 向量缓存使用的 Redis 库编号 (Celery 使用 2)
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # Redis 中向量缓存的过期时间 (秒)
+    RETRIEVAL_CACHE_ENABLED: bool = True  # 是否缓存检索+精排结果 (进程内，按查询文本和 top_k)
+    RETRIEVAL_CACHE_SIZE: int = 1024  # 检索结果缓存的最大条数
+    RETRIEVAL_CACHE_TTL_SECONDS: int = 300  # 检索结果缓存的过期时间 (秒)，也是其他进程中文档变化最长的可见延迟
+    RETRIEVAL_CACHE_SIMILARITY: float = 0.97  # 查询向量余弦相似度不低于该值时复用缓存结果，0 表示只做精确匹配
     EMBEDDING_DIMENSIONS: int = 1024  # 嵌入维度, Qwen 0.6B为1024 Qwen 4B为2560
     CHUNK_SIZE: int = 1024 # 文本分块大小，用于处理长文本 (增大以减少总块数)
     CHUNK_OVERLAP: int = 100 # 文本分块重叠大小，用于保持上下文连贯性 (相应增加重叠)
@@ -55,9 +83,40 @@ class BaseConfig(BaseSettings):
     INITIAL_RETRIEVAL_TOP_K: int = 50  # 第一阶段向量召回的数量
     FINAL_CONTEXT_TOP_N: int = 5  # Rerank 后最终选取的数量
     RERANKER_INSTRUCTION: str = "给定一个网页搜索查询，检索回答该查询的相关段落" # Rerank 模型指令，用于重新排序检索到的段落
+    RERANKER_DEVICE: str = "auto"  # Reranker 设备: auto (多 GPU 时用 cuda:1，单 GPU 用 cuda:0，否则 cpu) 或显式指定
+    RERANKER_QUANT: str = "none"  # Reranker 在 CUDA 上的权重量化: none / int8 / int4 (需要安装 bitsandbytes)
+    RERANKER_CPU_DTYPE: str = "float32"  # Reranker 在 CPU 上的权重精度: float32 / bfloat16 (仅在支持 AVX512-BF16 或 AMX 的 CPU 上开启)
+    RERANKER_USE_COMPILE: bool = False  # CUDA 上是否用 torch.compile(reduce-overhead) 编译 Reranker，首次调用会有编译开销
+    RERANKER_STREAM_POOL_SIZE: int = 4  # Reranker 在 GPU 上的 CUDA 流池大小，即可同时在 GPU 上执行的重排序请求数
+    RERANKER_BATCH_SIZE: int = 16  # Reranker 每次前向的文档数 (微批次)，限制峰值显存
+    RERANKER_PAD_MULTIPLE: int = 64  # Reranker 输入长度填充到该值的整数倍 (分桶)，0 表示只填充到批内最长
+    GPU_POOL_SIZE: int = 4  # 模型推理 (嵌入、精排) 专用线程池大小，不超过 RERANKER_STREAM_POOL_SIZE 时每个线程都能借到独立的 CUDA 流
+    CHROMA_POOL_SIZE: int = 4  # ChromaDB 查询专用线程池大小
+
+    # 启动时预加载并预热模型 (FastAPI lifespan / Celery worker_init)，关闭后改为首次请求时按需加载
+    PRELOAD_MODELS_ON_STARTUP: bool = True
+    # 是否挂载 /gradio 界面，仅提供 API 的生产部署可关闭以省去 Gradio 的导入时间和内存
+    ENABLE_GRADIO_UI: bool = True
+    # 多个模型并行加载到同一 GPU 时的显存分配器配置 (写入 PYTORCH_CUDA_ALLOC_CONF)：限制大块拆分以减少碎片，空字符串表示保持默认
+    CUDA_ALLOC_CONF: str = "max_split_size_mb:256"
+    CUDA_MEMORY_FRACTION: float = 0.9  # 本进程在每张 GPU 上最多可用的显存比例，0 表示不限制
 
     # LLM 相关配置
     LLM_MODEL_PATH: str = "app/llm_models/Qwen2.5-1.5B-Instruct" # LLM 模型路径
+    LLM_QUANTIZATION: str = "none"  # LLM 权重量化方式: none / int8_weight_only (需要安装 torchao)
+    # LLM 推理后端: transformers (进程内加载) / llama_cpp (进程内加载 GGUF 量化模型) / openai (OpenAI 兼容的推理服务，如 vLLM、TGI、Ollama)
+    LLM_BACKEND: str = "transformers"
+    # GGUF 模型路径，LLM_BACKEND=llama_cpp 时生效，下载: modelscope download --model Qwen/Qwen2.5-1.5B-Instruct-GGUF qwen2.5-1.5b-instruct-q4_k_m.gguf
+    LLM_GGUF_PATH: str = "app/llm_models/Qwen/Qwen2.5-1.5B-Instruct-GGUF/qwen2.5-1.5b-instruct-q4_k_m.gguf"
+    LLM_N_CTX: int = 4096  # llama.cpp 上下文长度 (prompt + 生成)
+    LLM_N_BATCH: int = 512  # llama.cpp prompt 预填充的批大小
+    LLM_N_THREADS: int = 0  # llama.cpp 计算线程数，0 表示使用 CPU 核数的一半 (物理核)
+    LLM_PROMPT_CACHE_BYTES: int = 512 * 1024 * 1024  # llama.cpp 前缀状态缓存 (LlamaRAMCache) 容量，0 表示关闭
+    LLM_N_GPU_LAYERS: int = 0  # 卸载到 GPU/Metal 的层数，-1 表示全部卸载 (Apple Silicon 推荐 -1)
+    # OpenAI 兼容服务地址，LLM_BACKEND=openai 时生效；服务端做连续批处理，如 llama-server --parallel 8 --cont-batching 或 vLLM
+    LLM_API_BASE: str = "http://localhost:8001/v1"
+    LLM_API_KEY: str = "EMPTY"  # OpenAI 兼容服务的 API Key，本地 vLLM 默认不校验
+    LLM_API_MODEL: str = "Qwen/Qwen2.5-1.5B-Instruct"  # 推理服务中注册的模型名称
 
 
     # Resend 配置
@@ -73,3 +132,8 @@ def get_settings():
     return BaseConfig()
 
 settings = get_settings()
+
+# CUDA 缓存分配器在首次使用 CUDA 时读取 PYTORCH_CUDA_ALLOC_CONF，配置模块先于所有模型模块导入，在此写入环境变量；
+# 部署环境中已显式设置时以环境为准
+if settings.CUDA_ALLOC_CONF:
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", settings.CUDA_ALLOC_CONF)
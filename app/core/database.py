@@ -9,8 +9,12 @@
 该模块负责配置PostgreSQL数据库连接，创建数据库引擎，
 并提供数据库会话管理功能。使用异步SQLAlchemy进行数据库操作。
 """
+import asyncio
+import threading
 from typing import AsyncGenerator, Optional
 
+import orjson
+from loguru import logger
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
 
@@ -23,6 +27,8 @@ from app.models.models import Base
 engine: Optional[AsyncEngine] = None
 SessionLocal: Optional[async_sessionmaker[AsyncSession]] = None
 
+# Celery Worker 线程级状态：每个线程持有一个长期事件循环和绑定在该循环上的引擎
+_celery_thread_state = threading.local()
 
 
 # 构建PostgreSQL异步数据库URL
@@ -32,6 +38,23 @@ POSTGRES_DATABASE_URL = (
     f"@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}"
 )
 
+
+def _asyncpg_connect_args() -> dict:
+    """
+    asyncpg 连接参数。
+    关闭 JIT：本项目的查询都是短小的 OLTP 语句，JIT 编译开销大于收益；
+    通过 PgBouncer (事务池模式) 连接时必须关闭 asyncpg 的预编译语句缓存，否则语句会落到别的后端连接上。
+    """
+    connect_args: dict = {"server_settings": {"jit": "off"}}
+    if settings.DB_USE_PGBOUNCER:
+        connect_args["statement_cache_size"] = 0
+    return connect_args
+
+
+def _orjson_serializer(value) -> str:
+    """JSON/JSONB 列的序列化函数：orjson 比标准库 json 快数倍，驱动需要 str，因此解码一次。"""
+    return orjson.dumps(value).decode()
+
 # --- 2. FastAPI 生命周期管理函数 ---
 # 这两个函数是【专门】给 FastAPI 在 main.py 的 lifespan 中调用的。
 
@@ -43,10 +66,14 @@ def initialize_database_for_fastapi():
     global engine,SessionLocal
     engine = create_async_engine(
         POSTGRES_DATABASE_URL,
-        pool_size=20,
-        max_overflow=10,
-        pool_timeout=30,
-        pool_recycle=3600,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=True,  # 取用连接前先探活，避免拿到被服务端或防火墙断开的连接
+        connect_args=_asyncpg_connect_args(),
+        json_serializer=_orjson_serializer,
+        json_deserializer=orjson.loads,
         echo=False,
     )
 
@@ -57,7 +84,7 @@ def initialize_database_for_fastapi():
         expire_on_commit=False,
         bind=engine,
     )
-    print("数据库引擎和会话工厂已为 FastAPI 创建。")
+    logger.info("数据库引擎和会话工厂已为 FastAPI 创建。")
 
 # --- 数据库会话依赖注入函数 ---
 async def close_database_for_fastapi():
@@ -67,7 +94,7 @@ async def close_database_for_fastapi():
     global engine
     if engine:
         await engine.dispose()
-        print("FastAPI 的数据库引擎连接池已关闭。")
+        logger.info("FastAPI 的数据库引擎连接池已关闭。")
 
 # --- 3. FastAPI 依赖注入函数 (您的 get_db) ---
 # 这个函数的核心逻辑和函数名【完全保持不变】。
@@ -81,24 +108,59 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         raise Exception("数据库未初始化。请检查 FastAPI 的 lifespan 配置。")
 
     async with SessionLocal() as session:
-        yield session
+        try:
+            yield session
+        except Exception:
+            # 出错时显式回滚，保证连接以干净的状态归还连接池
+            await session.rollback()
+            raise
 
 # --- 4. Celery 专属的工厂函数 ---
-# 这个是【新增的】函数，【专门】给您的 Celery 任务使用。
-def create_engine_and_session_for_celery():
+# Worker 使用 --pool=threads，asyncpg 连接与事件循环绑定，所以按线程复用"事件循环 + 引擎"，
+# 而不是每个任务都新建事件循环和引擎 (每次都要重新建立 TCP 连接和认证)。
+def get_celery_event_loop() -> asyncio.AbstractEventLoop:
     """
-    为单个 Celery 任务创建一次性的、独立的数据库引擎和会话工厂。
-    它创建的是局部变量，与上面的全局 engine 和 SessionLocal 无关。
+    获取当前 Worker 线程的长期事件循环，不存在或已关闭时新建。
+    任务中不要关闭这个循环，线程内后续任务会继续复用它以及绑定在上面的连接池。
     """
-    # 注意：这里创建的是局部变量 celery_engine, CelerySessionLocal
-    celery_engine = create_async_engine(POSTGRES_DATABASE_URL, echo=False)
-    CelerySessionLocal = async_sessionmaker(class_=AsyncSession, expire_on_commit=False, bind=celery_engine)
-
-    # 返回这两个新创建的、临时的实例
-    return celery_engine, CelerySessionLocal
+    loop = getattr(_celery_thread_state, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = asyncio.new_event_loop()
+        _celery_thread_state.loop = loop
+        # 旧引擎的连接属于已关闭的事件循环，不能再复用
+        _celery_thread_state.engine = None
+        _celery_thread_state.session_factory = None
+    asyncio.set_event_loop(loop)
+    return loop
+
+
+def get_celery_engine_and_session() -> tuple[AsyncEngine, async_sessionmaker[AsyncSession]]:
+    """
+    获取当前 Worker 线程的数据库引擎和会话工厂，首次调用时创建。
+    必须在 get_celery_event_loop() 返回的事件循环中使用。
+    """
+    if getattr(_celery_thread_state, "engine", None) is None:
+        celery_engine = create_async_engine(
+            POSTGRES_DATABASE_URL,
+            pool_size=settings.CELERY_DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+            connect_args=_asyncpg_connect_args(),
+            json_serializer=_orjson_serializer,
+            json_deserializer=orjson.loads,
+            echo=False,
+        )
+        _celery_thread_state.engine = celery_engine
+        _celery_thread_state.session_factory = async_sessionmaker(
+            class_=AsyncSession, expire_on_commit=False, bind=celery_engine
+        )
+    return _celery_thread_state.engine, _celery_thread_state.session_factory
 
 # --- 5. 数据库表创建工具 (保持不变) ---
-# 建议通过 Alembic 管理数据库迁移，但如果需要，这个函数仍然可用。
+# 建议通过 Alembic 管理数据库迁移 (alembic upgrade head 可从空库建出完整表结构)，但如果需要，这个函数仍然可用。
+# 用它建出的库已是最新结构，之后改用 Alembic 前需先执行 alembic stamp head。
 async def create_db_and_tables():
     """
     创建数据库和所有表结构
@@ -115,4 +177,4 @@ async def create_db_and_tables():
         raise Exception("无法创建表，因为数据库引擎未初始化。")
 
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
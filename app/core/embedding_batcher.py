@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+"""
+@File ：embedding_batcher.py
+@IDE ：PyCharm
+@Author ：zhanzhicai
+@Date ：2025/11/20 10:12
+@DOC: 查询向量化的微批处理器，把并发到达的单条查询合并成一次前向计算
+"""
+import asyncio
+import threading
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.core.embedding_cache import embedding_cache
+
+# 单个批次最多合并的查询条数
+EMBED_BATCH_MAX_SIZE = settings.EMBED_BATCH_SIZE
+# 长度分桶宽度 (字符数)：同一桶内的文本一起前向，控制填充浪费
+EMBED_BATCH_BUCKET_WIDTH = 64
+# 第一条请求到达后最多等待的时间 (毫秒)，超时即使未满也立即发车
+EMBED_BATCH_MAX_WAIT_MS = settings.EMBED_BATCH_WAIT_MS
+
+
+class EmbeddingBatcher:
+    """
+    异步微批处理器。
+
+    每个调用方通过 submit 提交一条文本并拿到一个 Future，后台任务在 max_wait_ms 窗口内
+    收集最多 max_batch_size 条请求，按长度分桶后每桶调用一次 embedding_cache.get_or_compute，再把结果分发回各个 Future。
+    分词和 GPU kernel 启动的固定开销由整批请求分摊。
+    """
+
+    def __init__(self, task_description: str, is_query: bool,
+                 max_batch_size: int = EMBED_BATCH_MAX_SIZE, max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS):
+        self.task_description = task_description
+        self.is_query = is_query
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        # 每个事件循环各自一个 (队列, 后台任务)：asyncio 对象不能跨循环使用，
+        # FastAPI 主循环与 Celery 任务中新建的循环可能同时在不同线程里提交请求
+        self._workers: dict[asyncio.AbstractEventLoop, tuple[asyncio.Queue, asyncio.Task]] = {}
+        self._workers_lock = threading.Lock()
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        """返回当前事件循环的请求队列，必要时在该循环上创建后台任务；顺带清理已关闭循环留下的条目。"""
+        loop = asyncio.get_running_loop()
+        with self._workers_lock:
+            for closed_loop in [l for l in self._workers if l.is_closed()]:
+                del self._workers[closed_loop]
+            entry = self._workers.get(loop)
+            if entry is None or entry[1].done():
+                queue = asyncio.Queue()
+                entry = (queue, loop.create_task(self._run(queue)))
+                self._workers[loop] = entry
+        return entry[0]
+
+    async def submit(self, text: str) -> np.ndarray:
+        """
+        提交一条文本并等待它所在批次完成。
+        :param text: 需要向量化的文本
+        :return: 该文本的归一化向量 (float32 ndarray)
+        """
+        # 进程内缓存命中时直接返回，不必等待批处理窗口
+        cached = embedding_cache.get_local(text, self.task_description, self.is_query)
+        if cached is not None:
+            return cached
+
+        queue = self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((text, future))
+        return await future
+
+    async def _collect_batch(self, queue: asyncio.Queue) -> list[tuple[str, asyncio.Future]]:
+        """阻塞等待第一条请求，然后在等待窗口内尽量凑满一个批次。"""
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = await self._collect_batch(queue)
+            logger.debug(f"Embedding 微批处理: 合并 {len(batch)} 条请求")
+            for bucket in self._split_by_length(batch):
+                await self._embed_bucket(bucket)
+
+    @staticmethod
+    def _split_by_length(batch: list[tuple[str, asyncio.Future]]) -> list[list[tuple[str, asyncio.Future]]]:
+        """
+        按文本长度排序并以 ceil(len / EMBED_BATCH_BUCKET_WIDTH) 分桶。
+        一次前向会填充到批内最长序列，长短差异大的文本混在一起会浪费大量填充计算；
+        字符数作为 token 数的近似，避免为分桶额外分词一次。
+        """
+        buckets: dict[int, list[tuple[str, asyncio.Future]]] = {}
+        for item in sorted(batch, key=lambda item: len(item[0])):
+            buckets.setdefault(-(-len(item[0]) // EMBED_BATCH_BUCKET_WIDTH), []).append(item)
+        return list(buckets.values())
+
+    async def _embed_bucket(self, bucket: list[tuple[str, asyncio.Future]]) -> None:
+        texts = [text for text, _ in bucket]
+        try:
+            # 先查缓存，只有未命中的文本在线程中分词和前向，不阻塞事件循环
+            embeddings = await embedding_cache.get_or_compute(
+                texts, task_description=self.task_description, is_query=self.is_query
+            )
+        except Exception as e:
+            for _, future in bucket:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(bucket, embeddings):
+            # 调用方已取消的 Future 直接跳过
+            if not future.done():
+                future.set_result(embedding)
+
+
+# 检索查询使用的全局批处理器
+query_embedding_batcher = EmbeddingBatcher(
+    task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL, is_query=True
+)
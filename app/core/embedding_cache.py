@@ -0,0 +1,136 @@
+# -*- coding: UTF-8 -*-
+"""
+@File ：embedding_cache.py
+@IDE ：PyCharm
+@Author ：zhanzhicai
+@Date ：2025/11/21 09:45
+@DOC: 向量缓存：进程内 LRU + Redis 两级缓存，命中的文本不再进入模型
+"""
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import redis.asyncio as redis
+from loguru import logger
+
+from app.core.config import settings
+from app.core.embedding_qwen import EMBEDDING_MODEL_NAME, aget_embeddings
+
+# Redis 中缓存键的前缀
+EMBEDDING_CACHE_KEY_PREFIX = b"emb:"
+
+
+def _cache_key(text: str, task_description: str, is_query: bool) -> bytes:
+    """
+    缓存键 = BLAKE2b-128(模型名 ∥ 指令 ∥ 文本)。
+    文档不加指令，所以文档的键不包含指令；查询与文档的键也相互区分。
+    """
+    instruction = task_description if is_query else ""
+    digest = hashlib.blake2b(
+        f"{EMBEDDING_MODEL_NAME}\0{int(is_query)}\0{instruction}\0{text}".encode("utf-8"), digest_size=16
+    ).digest()
+    return EMBEDDING_CACHE_KEY_PREFIX + digest
+
+
+class EmbeddingCache:
+    """
+    两级向量缓存。
+
+    第一级为进程内 LRU (OrderedDict)，第二级为 Redis (float32 原始字节，带 TTL)。
+    get_or_compute 只把两级都未命中的文本交给模型计算，再回填两级缓存并按原顺序返回。
+    Redis 不可用时只记录警告并退化为仅进程内缓存。
+    """
+
+    def __init__(self, local_size: int, ttl_seconds: int):
+        self.local_size = local_size
+        self.ttl_seconds = ttl_seconds
+        self._local: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._local_lock = threading.Lock()  # Celery threads 池下多个线程共享同一进程缓存
+        # 每个事件循环一个客户端 (Celery 每个 Worker 线程有自己的事件循环)
+        self._redis_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.Redis] = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _get_redis(self) -> redis.Redis:
+        """redis.asyncio 的连接与事件循环绑定，按当前事件循环获取 (或创建) 客户端。"""
+        loop = asyncio.get_running_loop()
+        client = self._redis_clients.get(loop)
+        if client is None:
+            client = redis.Redis.from_url(f"redis://{settings.REDIS_HOST}/{settings.EMBEDDING_CACHE_REDIS_DB}")
+            self._redis_clients[loop] = client
+        return client
+
+    def get_local(self, text: str, task_description: str, is_query: bool) -> np.ndarray | None:
+        """只查进程内缓存，不访问 Redis。"""
+        return self._local_get(_cache_key(text, task_description, is_query))
+
+    def _local_get(self, key: bytes) -> np.ndarray | None:
+        with self._local_lock:
+            embedding = self._local.get(key)
+            if embedding is not None:
+                self._local.move_to_end(key)
+            return embedding
+
+    def _local_put(self, key: bytes, embedding: np.ndarray) -> None:
+        with self._local_lock:
+            self._local[key] = embedding
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    async def _redis_mget(self, keys: list[bytes]) -> list[bytes | None]:
+        try:
+            return await self._get_redis().mget(keys)
+        except Exception as e:
+            logger.warning(f"读取 Redis 向量缓存失败，跳过二级缓存: {e}")
+            return [None] * len(keys)
+
+    async def _redis_mset(self, items: list[tuple[bytes, np.ndarray]]) -> None:
+        try:
+            async with self._get_redis().pipeline(transaction=False) as pipe:
+                for key, embedding in items:
+                    pipe.set(key, embedding.astype(np.float32).tobytes(), ex=self.ttl_seconds)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"写入 Redis 向量缓存失败: {e}")
+
+    async def get_or_compute(self, texts: list[str], task_description: str, is_query: bool) -> np.ndarray:
+        """
+        获取文本向量，优先读缓存，只对未命中的文本调用模型。
+        :return: 形状 (B, H) 的 float32 ndarray，顺序与 texts 一致
+        """
+        if not settings.EMBEDDING_CACHE_ENABLED:
+            return await aget_embeddings(texts, task_description=task_description, is_query=is_query)
+
+        keys = [_cache_key(text, task_description, is_query) for text in texts]
+        results: list[np.ndarray | None] = [self._local_get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        if missing:
+            cached_values = await self._redis_mget([keys[i] for i in missing])
+            for i, value in zip(missing, cached_values):
+                if value is not None:
+                    results[i] = np.frombuffer(value, dtype=np.float32)
+                    self._local_put(keys[i], results[i])
+            missing = [i for i in missing if results[i] is None]
+
+        if missing:
+            computed = await aget_embeddings(
+                [texts[i] for i in missing], task_description=task_description, is_query=is_query
+            )
+            for i, embedding in zip(missing, computed):
+                results[i] = embedding
+                self._local_put(keys[i], embedding)
+            await self._redis_mset([(keys[i], results[i]) for i in missing])
+
+        logger.debug(f"向量缓存: {len(texts) - len(missing)}/{len(texts)} 命中")
+        return np.stack(results)
+
+
+# 全局向量缓存实例
+embedding_cache = EmbeddingCache(
+    local_size=settings.EMBEDDING_CACHE_LOCAL_SIZE, ttl_seconds=settings.EMBEDDING_CACHE_TTL_SECONDS
+)
@@ -6,14 +6,24 @@
 @Date ：2025/11/5 10:30
 @DOC: 嵌入模型模块
 """
+import asyncio
+import os
+import threading
+from functools import lru_cache, partial
 from pathlib import Path
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 from torch import Tensor
 from loguru import logger
 from transformers import AutoTokenizer, AutoModel
 
+from app.core.config import settings
+from app.core.executors import GPU_POOL
+
+# 不在代码中强制 TOKENIZERS_PARALLELISM：Celery 若以 prefork 池启动，fork 前已启用的分词器并行会导致子进程死锁，
+# 交给部署环境按进程模型设置 (threads 池 / FastAPI 可设为 true，prefork 池应设为 false)
 
 # --- 1. 修改模型名称和路径 ---
 # 新模型的 Hugging Face 名称
@@ -21,10 +31,17 @@ EMBEDDING_MODEL_NAME = "Qwen/Qwen3-Embedding-0.6B"
 # EMBEDDING_MODEL_PATH = "app/embeddings/Qwen/Qwen3-Embedding-0.6B"
 
 # 建议为新模型创建一个新的本地路径 - 使用绝对路径
-import os
 EMBEDDING_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "app", "embeddings", "Qwen", "Qwen3-Embedding-0.6B")
 # 新模型的最大长度
 QWEN_MAX_LENGTH = 8192
+# 启用 torch.compile 时输入长度的填充桶，编译图和 CUDA Graph 只需覆盖这几种长度
+EMBED_COMPILE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+# 启用 torch.compile 时批大小的填充桶：2 的幂直到 EMBED_BATCH_SIZE，更大的批次按最大桶切分
+EMBED_COMPILE_BATCH_BUCKETS = tuple(sorted(
+    {min(1 << i, settings.EMBED_BATCH_SIZE) for i in range(settings.EMBED_BATCH_SIZE.bit_length() + 1)}
+))
+# 分词器填充侧：Qwen 推荐左填充，此时每条序列的最后一个有效 token 都在最后一个位置
+TOKENIZER_PADDING_SIDE = "left"
 
 """ 下载新模型命令
     uv run huggingface-cli download Qwen/Qwen3-Embedding-0.6B /
@@ -35,15 +52,24 @@ QWEN_MAX_LENGTH = 8192
 tokenizer =None # 分词器
 embedding_model_global = None  # 使用 embedding_model_global 以区分局部变量
 device = None # 设备
+embedding_compiled = False  # 模型是否已经过 torch.compile 编译
+# 加载锁：Celery threads 池下多个线程可能同时首次调用，避免重复加载模型导致显存/内存翻倍
+_embedding_load_lock = threading.Lock()
+# 编译模式下串行调用编译后的模块：reduce-overhead 的 CUDA Graph 输出缓冲区会在下一次重放时被覆盖，
+# GPU_POOL / Celery threads 池中的多个线程并发重放会互相改写对方的输出
+_embedding_compiled_lock = threading.Lock()
 
 # --- 2. 添加新模型所需的 last_token_pool 函数 ---
 # 这个函数来自 Qwen 官方示例，用于从模型的输出中正确地提取句向量
-def last_token_pool(last_hidden_states: Tensor, attention_mask: Tensor) -> Tensor:
+def last_token_pool(
+        last_hidden_states: Tensor, attention_mask: Tensor, padding_side: str = TOKENIZER_PADDING_SIDE
+) -> Tensor:
     """
     根据 attention_mask 从 last_hidden_states 中获取最后一个有效 token 的向量。
+    分词器固定为左填充时直接取最后一个位置，不再对 attention_mask 做归约判断
+    (那次判断需要把结果同步回 CPU，在 CUDA 上会强制等待流)。
     """
-    left_padding = attention_mask[:, -1].sum() == attention_mask.shape[0] # 判断是否是左填充
-    if left_padding:
+    if padding_side == "left":
         return last_hidden_states[:, -1]
     else:
         sequence_lengths = attention_mask.sum(dim=1) - 1 # 计算每个序列的有效长度
@@ -58,74 +84,220 @@ def last_token_pool(last_hidden_states: Tensor, attention_mask: Tensor) -> Tenso
 
 
 
+def _select_embedding_device() -> torch.device:
+    """按 settings.EMBEDDING_DEVICE 选择设备，auto 时依次尝试 CUDA (0 号卡)、MPS、CPU。"""
+    if settings.EMBEDDING_DEVICE != "auto":
+        return torch.device(settings.EMBEDDING_DEVICE)
+    if torch.cuda.is_available():
+        return torch.device("cuda:0")
+    if torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def _load_embedding_model_on_cuda(model_path: Path, cuda_device: torch.device) -> AutoModel:
+    """
+    在 CUDA 上以半精度加载 Embedding 模型，优先使用 Flash Attention 2，失败时使用 SDPA。
+    Ampere 及以上使用 bfloat16；不支持 bfloat16 的老显卡 (如 Turing/Volta) 使用 float16。
+    """
+    dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    # 为获得最佳性能，Qwen 推荐在支持的 GPU 上使用 flash_attention_2 和 bfloat16
+    try:
+        model = AutoModel.from_pretrained(
+            model_path,
+            attn_implementation="flash_attention_2",
+            torch_dtype=dtype,
+            device_map={"": cuda_device},
+        )
+        logger.info(f"已启用 Flash Attention 2 和 {dtype} 加速。")
+        return model
+    except torch.cuda.OutOfMemoryError:
+        raise
+    except Exception as e:
+        logger.warning(f"加载 Flash Attention 2 失败: {e}，将使用 SDPA 模式 ({dtype})。")
+        return AutoModel.from_pretrained(
+            model_path, attn_implementation="sdpa", torch_dtype=dtype,
+            device_map={"": cuda_device},
+        )
+
+
+def _load_onnx_session():
+    """创建 ONNX Runtime 推理会话，有 CUDA 执行器时优先使用 GPU。"""
+    import onnxruntime as ort  # 可选依赖，只在 EMBEDDING_BACKEND=onnx 时需要
+
+    onnx_path = Path(settings.EMBEDDING_ONNX_PATH)
+    if not onnx_path.exists():
+        raise FileNotFoundError(f"Embedding ONNX 模型不存在: {onnx_path}")
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL  # 启用全部图融合优化
+    providers = ["CPUExecutionProvider"]
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+    session = ort.InferenceSession(str(onnx_path), sess_options=session_options, providers=providers)
+    logger.info(f"Embedding 模型使用 ONNX Runtime: {onnx_path} ({session.get_providers()[0]})")
+    return session
+
+
 def _load_embedding_model():
     """延迟加载 Embedding 模型和 Tokenizer，并移至可用设备。"""
     global tokenizer, embedding_model_global, device   # 全局变量：分词器、嵌入模型、设备
-    if tokenizer is None or embedding_model_global is None:
-        logger.info(f"首次加载 Embedding 模型: {EMBEDDING_MODEL_NAME}...")
-        try:
-            # 如果在线下载模型，用下面这两条
-            # tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
-            # embedding_model_global = AutoModel.from_pretrained(EMBEDDING_MODEL_NAME)
-            # 如果本地加载模型，用下面这两条
-
-            # 检查路径是否存在
-            model_path = Path(EMBEDDING_MODEL_PATH)
-            if not model_path.exists():
-                logger.error(f"Embedding 模型路径不存在: {model_path}")
-                raise FileNotFoundError(f"Embedding 模型路径不存在: {model_path}")
-            logger.info(f"从本地加载 Embedding 模型: {model_path}...")
-
-            # --- 3. 修改 Tokenizer 和模型加载方式 ---
-            # Qwen 模型推荐使用 'left' 作为填充侧，这对于 last_token_pool至关重要
-            # 从本地路径加载
-            tokenizer = AutoTokenizer.from_pretrained(model_path,padding_side="left")
-            # 判断是否有可用 GPU
-            if torch.cuda.is_available():
-                device = torch.device("cuda")
-                logger.info("检测到 CUDA，Embedding 模型将使用 GPU。")
-                # 为获得最佳性能，Qwen 推荐在支持的 GPU 上使用 flash_attention_2 和 bfloat16
-                try:
+    global embedding_compiled
+    # 双重检查：已加载时无需加锁直接返回
+    if embedding_model_global is not None:
+        return
+    with _embedding_load_lock:
+        if embedding_model_global is None:
+            logger.info(f"首次加载 Embedding 模型: {EMBEDDING_MODEL_NAME}...")
+            try:
+                # 如果在线下载模型，用下面这两条
+                # tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME)
+                # embedding_model_global = AutoModel.from_pretrained(EMBEDDING_MODEL_NAME)
+                # 如果本地加载模型，用下面这两条
+
+                # 检查路径是否存在
+                model_path = Path(EMBEDDING_MODEL_PATH)
+                if not model_path.exists():
+                    logger.error(f"Embedding 模型路径不存在: {model_path}")
+                    raise FileNotFoundError(f"Embedding 模型路径不存在: {model_path}")
+                logger.info(f"从本地加载 Embedding 模型: {model_path}...")
+
+                # --- 3. 修改 Tokenizer 和模型加载方式 ---
+                # Qwen 模型推荐使用 'left' 作为填充侧，这对于 last_token_pool至关重要
+                # 从本地路径加载
+                tokenizer = AutoTokenizer.from_pretrained(model_path, padding_side=TOKENIZER_PADDING_SIDE)
+                assert tokenizer.padding_side == TOKENIZER_PADDING_SIDE, "last_token_pool 依赖分词器的填充侧配置"
+                if settings.EMBEDDING_BACKEND == "onnx":
+                    # ONNX Runtime 自行管理执行设备，分词结果保持在 CPU 上直接以 numpy 输入
+                    device = torch.device("cpu")
+                    embedding_model_global = _load_onnx_session()
+                    return
+                # 按配置 (或自动检测) 选择设备
+                # 通过 device_map 让权重直接加载到目标设备，省去先落到 CPU 再整体 .to(device) 的拷贝
+                device = _select_embedding_device()
+                if device.type == "cuda":
+                    logger.info(f"Embedding 模型将使用 GPU: {device}。")
+                    # 不预先按显存容量判断能否放下，直接尝试加载，以 OOM 作为信号回退到 CPU
+                    try:
+                        embedding_model_global = _load_embedding_model_on_cuda(model_path, device)
+                    except torch.cuda.OutOfMemoryError as e:
+                        logger.warning(f"GPU 显存不足，Embedding 模型回退到 CPU: {e}")
+                        torch.cuda.empty_cache()
+                        device = torch.device("cpu")
+
+                if device.type == "mps":
+                    logger.info("检测到 MPS (Apple Silicon GPU)，Embedding 模型将使用 MPS。")
+                    # Apple Silicon 不支持 Flash Attention，BFloat16 也缺少硬件加速，使用 float16 减半权重带宽
+                    # PyTorch 自带的 SDPA 融合注意力在 MPS 上可用，避免 eager 模式物化完整的注意力矩阵
                     embedding_model_global = AutoModel.from_pretrained(
-                        model_path,
-                        attn_implementation="flash_attention_2",
-                        torch_dtype=torch.bfloat16,
-                    ).to(device)
-                    logger.info("已启用 Flash Attention 2 和 bfloat16 加速。")
-                except Exception as e:
-                    logger.warning(f"加载 Flash Attention 2 失败: {e}，将使用标准模式。")
+                        model_path, attn_implementation="sdpa", torch_dtype=torch.float16,
+                        device_map={"": device},
+                    )
+                elif device.type == "cpu":
+                    logger.info("Embedding 模型将使用 CPU。")
+                    # CPU 上半精度没有收益，显式使用 float32；SDPA 在 CPU 上同样有融合实现
                     embedding_model_global = AutoModel.from_pretrained(
-                        model_path, torch_dtype=torch.bfloat16
-                    ).to(device)
-            elif torch.backends.mps.is_available():
-                device = torch.device("mps")
-                logger.info("检测到 MPS (Apple Silicon GPU)，Embedding 模型将使用 MPS。")
-                # Apple Silicon 不支持 Flash Attention 和 BFloat16，使用 float32
-                embedding_model_global = AutoModel.from_pretrained(
-                    model_path, torch_dtype=torch.float32
-                ).to(device)
-            else:
-                device = torch.device("cpu")
-                logger.info("未检测到 CUDA 或 MPS，Embedding 模型将使用 CPU。")
-                embedding_model_global = AutoModel.from_pretrained(model_path).to(
-                    device
+                        model_path, attn_implementation="sdpa", torch_dtype=torch.float32,
+                        device_map={"": device},
+                    )
+
+                embedding_model_global.eval() # 切换至评估模式,# 设置为评估模式，关闭 dropout 等训练特有层
+                if settings.EMBED_USE_COMPILE and device.type == "cuda":
+                    # 前向是固定的小图，eager 模式下以 Python 调度和 kernel 启动开销为主；
+                    # reduce-overhead 会为每个桶长度捕获 CUDA Graph
+                    embedding_model_global = torch.compile(embedding_model_global, mode="reduce-overhead")
+                    embedding_compiled = True
+                    logger.info("Embedding 模型已启用 torch.compile (reduce-overhead)。")
+                logger.info(f"Embedding 模型 {EMBEDDING_MODEL_NAME} 加载完成并移至 {device}。")
+            except Exception as e:
+                logger.error(
+                    f"加载 Embedding 模型 {EMBEDDING_MODEL_NAME} 失败: {e}", exc_info=True
                 )
+                # 如果模型加载失败，后续任务可能无法执行，可以考虑抛出致命错误或设置一个标志
+                raise RuntimeError(
+                    f"无法加载 Embedding 模型: {EMBEDDING_MODEL_NAME}"
+                ) from e
+
+
+@lru_cache(maxsize=8)
+def _query_prefix_ids(task_description: str) -> tuple[int, ...]:
+    """
+    查询指令前缀 'Instruct: {task_description}\nQuery:' 的 token ID (不含特殊 token)，按指令缓存。
+    前缀在 ':' 处截断，查询文本以 ' ' 开头单独分词：Qwen 分词器的预分词会在这两者之间切分，
+    因此拼接结果与对整句分词一致。
+    """
+    return tuple(
+        tokenizer(f"Instruct: {task_description}\nQuery:", add_special_tokens=False)["input_ids"]
+    )
+
+
+def _embed_with_onnx(inputs) -> np.ndarray:
+    """用 ONNX Runtime 会话计算向量：左填充下直接取最后一个位置，并在 numpy 中做 L2 归一化。"""
+    input_names = {model_input.name for model_input in embedding_model_global.get_inputs()}
+    attention_mask = inputs["attention_mask"].numpy()
+    feeds = {"input_ids": inputs["input_ids"].numpy(), "attention_mask": attention_mask}
+    if "position_ids" in input_names:
+        feeds["position_ids"] = np.clip(attention_mask.cumsum(axis=1) - 1, 0, None)
+    feeds = {name: feeds[name].astype(np.int64) for name in input_names}
+
+    last_hidden_state = embedding_model_global.run(["last_hidden_state"], feeds)[0]
+    embeddings = last_hidden_state[:, -1].astype(np.float32)
+    embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+    return embeddings
+
+
+def _padding_kwargs(input_ids: list[list[int]]) -> dict:
+    """未编译时填充到批内最长；编译后填充到不小于批内最长的桶长度，限制重新编译的形状数量。"""
+    if not embedding_compiled:
+        return {"padding": True}
+    longest = max(len(ids) for ids in input_ids)
+    bucket = next((b for b in EMBED_COMPILE_BUCKETS if b >= longest), QWEN_MAX_LENGTH)
+    return {"padding": "max_length", "max_length": bucket}
+
+
+def _forward_compiled(inputs: dict[str, Tensor]) -> Tensor:
+    """
+    编译模式前向：按批大小桶切分并补齐行数，使批维度也只出现固定的几种形状；
+    持锁重放，并在锁内把归一化后的结果拷回 CPU，避免输出缓冲区被下一次重放覆盖。
+    """
+    max_batch = EMBED_COMPILE_BATCH_BUCKETS[-1]
+    results = []
+    for start in range(0, inputs["input_ids"].shape[0], max_batch):
+        chunk = {k: v[start:start + max_batch] for k, v in inputs.items()}
+        rows = chunk["input_ids"].shape[0]
+        batch_bucket = next(b for b in EMBED_COMPILE_BATCH_BUCKETS if b >= rows)
+        if batch_bucket > rows:
+            # 用第一行的副本补齐行数；attention_mask 全零的填充行会让注意力 softmax 得到 NaN
+            chunk = {k: torch.cat([v, v[:1].expand(batch_bucket - rows, -1)]) for k, v in chunk.items()}
+        with _embedding_compiled_lock:
+            outputs = embedding_model_global(**chunk)
+            embeddings = last_token_pool(outputs[0][:rows], chunk["attention_mask"][:rows])
+            results.append(F.normalize(embeddings.float(), p=2, dim=1).cpu())
+    return torch.cat(results)
+
+
+def warmup_embedding_buckets(max_bucket: int = 2048) -> None:
+    """
+    编译模式下对每个 (批大小桶, 长度桶) 组合各跑一次前向，把编译和 CUDA Graph 捕获开销挪到启动阶段。
+    文本块受 CHUNK_SIZE 限制，默认只预热到 2048，更长的桶在首次遇到时再编译。
+    """
+    if not embedding_compiled:
+        return
+    with torch.inference_mode(), _embedding_compiled_lock:
+        for bucket in EMBED_COMPILE_BUCKETS:
+            if bucket > max_bucket:
+                break
+            for batch_bucket in EMBED_COMPILE_BATCH_BUCKETS:
+                input_ids = torch.full((batch_bucket, bucket), tokenizer.pad_token_id, device=device)
+                embedding_model_global(input_ids=input_ids, attention_mask=torch.ones_like(input_ids))
+    logger.info(
+        f"Embedding 编译预热完成 (桶长度 <= {max_bucket}，批大小桶 {EMBED_COMPILE_BATCH_BUCKETS})。"
+    )
 
-            embedding_model_global.eval() # 切换至评估模式,# 设置为评估模式，关闭 dropout 等训练特有层
-            logger.info(f"Embedding 模型 {EMBEDDING_MODEL_NAME} 加载完成并移至 {device}。")
-        except Exception as e:
-            logger.error(
-                f"加载 Embedding 模型 {EMBEDDING_MODEL_NAME} 失败: {e}", exc_info=True
-            )
-            # 如果模型加载失败，后续任务可能无法执行，可以考虑抛出致命错误或设置一个标志
-            raise RuntimeError(
-                f"无法加载 Embedding 模型: {EMBEDDING_MODEL_NAME}"
-            ) from e
 
 # 在 Worker 启动时或首次调用任务时，可以预先调用 _load_embedding_model()
 # 或者在 get_embeddings 函数中按需加载。为简单起见，我们可以在 get_embeddings 中检查和加载。
 
-def get_embeddings(texts: list[str], task_description: str, is_query: bool) -> list[list[float]]:
+def get_embeddings(texts: list[str], task_description: str, is_query: bool) -> np.ndarray:
     """
     使用 Qwen3-Embedding 模型为文本列表生成向量嵌入。
     Args:
@@ -133,44 +305,72 @@ def get_embeddings(texts: list[str], task_description: str, is_query: bool) -> l
         task_description (str): 描述任务的指令，例如 "为这个句子生成表示以用于检索相关文章"。
         is_query (bool): 指示输入是查询（True）还是文档（False）。
                          查询文本前会添加指令，文档则不会。
+    Returns:
+        形状 (B, H) 的 float32 ndarray，已在设备上完成 L2 归一化 (唯一一次归一化)，调用方与 ChromaDB (cosine) 都无需再归一化。
+        不再逐个元素构造 Python float 列表；ChromaDB 客户端可直接接收 ndarray，确需列表的调用方自行 .tolist()。
     """
     _load_embedding_model()  # 确保模型已加载
 
     if not texts:
-        return []
+        return np.empty((0, 0), dtype=np.float32)
 
     # --- 4. 修改输入文本的格式化方式 ---
-    # 根据 is_query 参数决定是否添加指令
-    if is_query:
-        # Qwen 的指令格式为 'Instruct: {task_description}\nQuery: {text}'
-        instructed_texts = [
-            f"Instruct: {task_description}\nQuery: {s}" for s in texts
-        ]
-    else:
-        # 文档（documents）不需要指令
-        instructed_texts = texts
     try:
         # Tokenize
-        inputs = tokenizer(
-            instructed_texts,
-            padding=True,
-            truncation=True,
-            return_tensors="pt",
-            max_length=QWEN_MAX_LENGTH,  # 使用新模型的最大长度
-        )
-        inputs = {k: v.to(device) for k, v in inputs.items()}
+        if is_query:
+            # Qwen 的指令格式为 'Instruct: {task_description}\nQuery: {text}'
+            # 指令前缀对同一任务是常量，只分词一次并缓存，每条查询只对自身文本分词后在 token 层拼接
+            prefix_ids = _query_prefix_ids(task_description)
+            text_ids = tokenizer(
+                [f" {s}" for s in texts],
+                truncation=True,
+                max_length=QWEN_MAX_LENGTH - len(prefix_ids),
+            )["input_ids"]
+            query_ids = [list(prefix_ids) + ids for ids in text_ids]
+            inputs = tokenizer.pad({"input_ids": query_ids}, return_tensors="pt", **_padding_kwargs(query_ids))
+        elif embedding_compiled:
+            # 文档（documents）不需要指令；编译模式下先分词再按桶长度填充
+            doc_ids = tokenizer(texts, truncation=True, max_length=QWEN_MAX_LENGTH)["input_ids"]
+            inputs = tokenizer.pad({"input_ids": doc_ids}, return_tensors="pt", **_padding_kwargs(doc_ids))
+        else:
+            # 文档（documents）不需要指令
+            inputs = tokenizer(
+                texts,
+                padding=True,
+                truncation=True,
+                return_tensors="pt",
+                max_length=QWEN_MAX_LENGTH,  # 使用新模型的最大长度
+            )
+        if settings.EMBEDDING_BACKEND == "onnx":
+            return _embed_with_onnx(inputs)
+        if device.type == "cuda":
+            # 锁页内存 + 非阻塞拷贝：H2D 传输以 DMA 异步进行，不阻塞调用线程
+            inputs = {k: v.pin_memory().to(device, non_blocking=True) for k, v in inputs.items()}
+        else:
+            inputs = {k: v.to(device) for k, v in inputs.items()}
 
         # Get embeddings
-        with torch.no_grad():  # 在推理时不需要计算梯度
-            outputs = embedding_model_global(**inputs, return_dict=True)
+        with torch.inference_mode():  # 推理模式：不计算梯度，也省去版本计数等 autograd 记录
+            if embedding_compiled:
+                return _forward_compiled(inputs).numpy()
+            outputs = embedding_model_global(**inputs)
             # --- 5. 使用 last_token_pool 提取向量 ---
-            embeddings = last_token_pool(
-                outputs.last_hidden_state, inputs["attention_mask"]
-            )
-            # L2 归一化
-            normalized_embeddings = F.normalize(embeddings, p=2, dim=1)
+            # outputs[0] 即 last_hidden_state
+            embeddings = last_token_pool(outputs[0], inputs["attention_mask"])
+            # L2 归一化：先上转为 float32，避免在 bf16/fp16 下做归约带来的精度误差
+            normalized_embeddings = F.normalize(embeddings.float(), p=2, dim=1)
 
-        return normalized_embeddings.cpu().tolist()  # 移回 CPU 并转为 Python 列表
+        return normalized_embeddings.cpu().numpy()  # 一次拷贝移回 CPU，保持连续的 float32 数组
     except Exception as e:
         logger.error(f"生成文本嵌入时发生错误: {e}", exc_info=True)
         raise  # 重新抛出异常，让 Celery 任务捕获
+
+
+async def aget_embeddings(texts: list[str], task_description: str, is_query: bool) -> np.ndarray:
+    """
+    get_embeddings 的异步版本：分词和前向都放到模型推理专用线程池中执行，不阻塞事件循环。
+    参数与返回值同 get_embeddings。
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        GPU_POOL, partial(get_embeddings, texts, task_description=task_description, is_query=is_query)
+    )
@@ -14,26 +14,34 @@ class NotFoundException(HTTPException):
     """
     404 未找到异常
     """
+    _STATUS = status.HTTP_404_NOT_FOUND
+
     def __init__(self, detail: str = "未找到资源"):
-        super().__init__(status_code=status.HTTP_404_NOT_FOUND, detail=detail)
+        super().__init__(status_code=self._STATUS, detail=detail)
 
 class AlreadyExistsException(HTTPException):
     """
     409 已存在异常
     """
+    _STATUS = status.HTTP_409_CONFLICT
+
     def __init__(self, detail: str = "资源已存在"):
-        super().__init__(status_code=status.HTTP_409_CONFLICT, detail=detail)
+        super().__init__(status_code=self._STATUS, detail=detail)
 
 class UnauthorizedException(HTTPException):
     """
     401 未授权异常
     """
+    _STATUS = status.HTTP_401_UNAUTHORIZED
+
     def __init__(self, detail: str = "未授权访问"):
-        super().__init__(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+        super().__init__(status_code=self._STATUS, detail=detail)
 
 class ForbiddenException(HTTPException):
     """
     403 禁止异常
     """
+    _STATUS = status.HTTP_403_FORBIDDEN
+
     def __init__(self, detail: str = "禁止访问"):
-        super().__init__(status_code=status.HTTP_403_FORBIDDEN, detail=detail)
+        super().__init__(status_code=self._STATUS, detail=detail)
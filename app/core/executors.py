@@ -0,0 +1,24 @@
+# -*- coding: UTF-8 -*-
+"""
+@File ：executors.py
+@IDE ：PyCharm
+@Author ：zhanzhicai
+@Date ：2025/11/25 9:40
+@DOC: 专用线程池：模型推理与 ChromaDB 查询各用一个有界线程池，不与默认线程池中的其他阻塞 I/O 混用
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from app.core.config import settings
+
+# 模型推理 (嵌入、精排) 线程池：线程数即同时提交到 GPU 的推理数，与 Reranker 的 CUDA 流池大小对应，
+# 默认线程池 (min(32, cpu+4) 个线程) 在高并发下会让过多请求同时占用显存
+GPU_POOL = ThreadPoolExecutor(max_workers=settings.GPU_POOL_SIZE, thread_name_prefix="gpu")
+
+# ChromaDB 查询线程池：同步 HTTP 客户端调用，主要是等待网络
+CHROMA_POOL = ThreadPoolExecutor(max_workers=settings.CHROMA_POOL_SIZE, thread_name_prefix="chroma")
+
+
+def shutdown_executors() -> None:
+    """应用关闭时调用 (会阻塞，异步代码中应放到线程中执行)：取消排队中的任务，等待正在执行的任务完成后回收线程。"""
+    GPU_POOL.shutdown(wait=True, cancel_futures=True)
+    CHROMA_POOL.shutdown(wait=True, cancel_futures=True)
@@ -6,66 +6,373 @@
 @Date ：2025/11/7 16:22
 @DOC: 
 """
+import asyncio
+import copy
+import os
+import threading
+from functools import lru_cache
+
 from loguru import logger
-from llama_cpp import Llama  # 从 llama_cpp 导入 Llama 类
+from llama_cpp import Llama, LlamaRAMCache  # 从 llama_cpp 导入 Llama 类
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from openai import OpenAI
+from transformers import (
+    AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer,
+)
 
 from app.core.config import settings
 
 # --- 全局变量，用于存储加载后的模型和分词器 ---
 llm_model: Optional[AutoModelForCausalLM] = None
 llm_tokenizer: Optional[AutoTokenizer] = None
+# 加载锁：防止多个线程同时首次调用时重复加载模型
+_llm_load_lock = threading.Lock()
+# OpenAI 兼容推理服务的客户端 (LLM_BACKEND=openai 时使用)，内部复用 HTTP 连接池
+llm_api_client: Optional[OpenAI] = None
+# llama.cpp 加载的 GGUF 量化模型 (LLM_BACKEND=llama_cpp 时使用)
+llm_gguf_model: Optional[Llama] = None
+# llama.cpp 的 Llama 实例共享同一份上下文状态，不能多线程同时生成
+_llm_gguf_generate_lock = threading.Lock()
 
 # ---源代码 需要到modelscope魔塔社区下载模型配置 modelscope download --model Qwen/Qwen2.5-1.5B-Instruct---
 LLM_MODEL_NAME = "Qwen/Qwen2.5-1.5B-Instruct"
 LLM_MODEL_PATH = "app/llm_models/Qwen/Qwen2.5-1.5B-Instruct"
+# 默认系统提示词
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant."
+# 缓存系统提示词前缀 KV 的条数 (不同的系统提示词各占一条)
+LLM_PREFIX_CACHE_SIZE = 8
 
 # --- 模型配置 ---
 # LLM_MODEL_NAME = "qwen3:4b"
 # LLM_MODEL_PATH = "http://localhost:11434/v1/chat/completions"
 
+def _quantize_llm_model(model: AutoModelForCausalLM) -> None:
+    """
+    按配置对 LLM 做权重量化 (原地修改)。
+    解码阶段受权重读取带宽限制，INT8 仅权重量化 (W8A16) 使每步读取的权重字节减半，精度损失很小。
+    """
+    if settings.LLM_QUANTIZATION == "none":
+        return
+    if settings.LLM_QUANTIZATION != "int8_weight_only":
+        logger.warning(f"不支持的 LLM 量化方式: {settings.LLM_QUANTIZATION}，将使用原始权重。")
+        return
+    try:
+        from torchao.quantization import int8_weight_only, quantize_
+    except ImportError:
+        logger.warning("未安装 torchao，跳过 LLM INT8 权重量化。")
+        return
+    quantize_(model, int8_weight_only())
+    logger.info("LLM 已启用 INT8 仅权重量化 (torchao)。")
+
+
 def _load_llm_model() -> None:
     """
     使用 transformers 库加载 Qwen2.5 模型。
     这个函数将在 FastAPI 启动时被调用一次。
     """
     global llm_model, llm_tokenizer
-    if llm_model is None or llm_tokenizer is None:
-        # 加载 LLM 模型
-        logger.info(f"首次加载 LLM 模型: {LLM_MODEL_NAME} ...")
+    # 双重检查：llm_tokenizer 在加载流程中最后赋值，非空即表示全部就绪
+    if llm_tokenizer is not None:
+        return
+    with _llm_load_lock:
+        if llm_tokenizer is None:
+            # 加载 LLM 模型
+            logger.info(f"首次加载 LLM 模型: {LLM_MODEL_NAME} ...")
+            try:
+                model_path = Path(LLM_MODEL_PATH)
+                if not model_path.exists():
+                    raise FileNotFoundError(f"模型路径不存在: {model_path.absolute()}")
+                # 2. 强制使用 CPU 来避免 MPS 上的 BFloat16 兼容性问题
+                llm_model = AutoModelForCausalLM.from_pretrained(
+                    model_path,
+                    torch_dtype=torch.float32,  # 使用 float32 在 CPU 上更稳定
+                    device_map="cpu",  # 强制使用 CPU
+                )
+                # 将模型设置为评估模式
+                llm_model.eval()
+                _quantize_llm_model(llm_model)
+                llm_tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_PATH)
+                device = next(llm_model.parameters()).device
+                logger.info(f"LLM 模型 {LLM_MODEL_NAME} 加载成功。设备: {device}")
+            except Exception as e:
+                logger.error(f"加载 LLM 模型 {LLM_MODEL_NAME} 失败: {e}", exc_info=True)
+                raise RuntimeError(f"无法加载 LLM 模型: {LLM_MODEL_NAME}") from e
+
+
+def _load_llm_gguf_model() -> None:
+    """
+    使用 llama.cpp 加载 GGUF 量化模型 (如 Q4_K_M)。
+    4-bit 权重使解码每步读取的字节约为 FP32 的 1/8，且 llama.cpp 使用 AVX2/AVX-512/NEON 优化的矩阵乘，CPU 上生成速度远高于 FP32 transformers。
+    """
+    global llm_gguf_model
+    if llm_gguf_model is not None:
+        return
+    with _llm_load_lock:
+        if llm_gguf_model is None:
+            logger.info(f"首次加载 GGUF LLM 模型: {settings.LLM_GGUF_PATH} ...")
+            try:
+                model_path = Path(settings.LLM_GGUF_PATH)
+                if not model_path.exists():
+                    raise FileNotFoundError(f"模型路径不存在: {model_path.absolute()}")
+                n_threads = settings.LLM_N_THREADS or max(1, (os.cpu_count() or 2) // 2)
+                llm_gguf_model = Llama(
+                    model_path=str(model_path),
+                    n_ctx=settings.LLM_N_CTX,
+                    n_batch=settings.LLM_N_BATCH,
+                    n_threads=n_threads,
+                    n_gpu_layers=settings.LLM_N_GPU_LAYERS,
+                    verbose=False,
+                )
+                if settings.LLM_PROMPT_CACHE_BYTES > 0:
+                    # 按 token 前缀缓存上下文状态，请求共享系统提示词等前缀时直接恢复状态，跳过这部分预填充
+                    llm_gguf_model.set_cache(LlamaRAMCache(capacity_bytes=settings.LLM_PROMPT_CACHE_BYTES))
+                logger.info(
+                    f"GGUF LLM 模型加载成功。线程数: {n_threads}，GPU 卸载层数: {settings.LLM_N_GPU_LAYERS}"
+                )
+            except Exception as e:
+                logger.error(f"加载 GGUF LLM 模型失败: {e}", exc_info=True)
+                raise RuntimeError(f"无法加载 GGUF LLM 模型: {settings.LLM_GGUF_PATH}") from e
+
+
+@lru_cache(maxsize=LLM_PREFIX_CACHE_SIZE)
+def _encode_system_prefix(system_prompt: str) -> tuple[list[int], DynamicCache]:
+    """
+    对聊天模板中系统消息部分做一次前向并缓存其 KV。
+    同一系统提示词的请求复用这份 KV，只需预填充用户消息部分。
+    :return: (前缀 token id 列表, 前缀 KV 缓存)，使用时需 deepcopy，generate 会原地追加
+    """
+    prefix_text = llm_tokenizer.apply_chat_template(
+        [{"role": "system", "content": system_prompt}], tokenize=False
+    )
+    prefix_ids = llm_tokenizer(prefix_text, return_tensors="pt").input_ids.to(llm_model.device)
+    prefix_cache = DynamicCache()
+    with torch.inference_mode():
+        llm_model(input_ids=prefix_ids, past_key_values=prefix_cache, use_cache=True)
+    return prefix_ids[0].tolist(), prefix_cache
+
+
+def _stream_text_via_llama_cpp(
+        messages: list[dict], max_new_tokens: int, temperature: float, top_p: float
+) -> Iterator[str]:
+    """使用 llama.cpp 加载的 GGUF 模型流式生成文本，聊天模板由 GGUF 元数据中的模板提供。"""
+    _load_llm_gguf_model()
+    with _llm_gguf_generate_lock:
+        for chunk in llm_gguf_model.create_chat_completion(
+                messages=messages,
+                max_tokens=max_new_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                stream=True,
+        ):
+            content = chunk["choices"][0]["delta"].get("content")
+            if content:
+                yield content
+
+
+def _get_llm_api_client() -> OpenAI:
+    """延迟创建 OpenAI 兼容推理服务 (vLLM / TGI 等) 的客户端。"""
+    global llm_api_client
+    if llm_api_client is None:
+        with _llm_load_lock:
+            if llm_api_client is None:
+                llm_api_client = OpenAI(base_url=settings.LLM_API_BASE, api_key=settings.LLM_API_KEY)
+                logger.info(f"LLM 使用 OpenAI 兼容推理服务: {settings.LLM_API_BASE} ({settings.LLM_API_MODEL})")
+    return llm_api_client
+
+
+def _ensure_llm_api_server() -> None:
+    """
+    确认 OpenAI 兼容推理服务已就绪且已注册 LLM_API_MODEL，在启动预加载时调用。
+    服务端负责连续批处理和 KV 缓存复用，例如:
+        llama-server -m <gguf> --port 8001 --parallel 8 --cont-batching
+        vllm serve Qwen/Qwen2.5-1.5B-Instruct --port 8001
+    """
+    model_ids = [model.id for model in _get_llm_api_client().with_options(timeout=5.0).models.list()]
+    if settings.LLM_API_MODEL not in model_ids:
+        logger.warning(f"推理服务未注册模型 {settings.LLM_API_MODEL}，可用模型: {model_ids}")
+    else:
+        logger.info(f"LLM 推理服务已就绪: {settings.LLM_API_BASE}")
+
+
+def _stream_text_via_api(
+        messages: list[dict], max_new_tokens: int, temperature: float, top_p: float
+) -> Iterator[str]:
+    """
+    通过 OpenAI 兼容接口调用独立部署的推理服务流式生成文本。
+    vLLM/TGI 提供连续批处理、分页 KV 缓存和前缀缓存，并发请求不再逐条串行执行。
+    """
+    stream = _get_llm_api_client().chat.completions.create(
+        model=settings.LLM_API_MODEL,
+        messages=messages,
+        max_tokens=max_new_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()  # 调用方提前结束时关闭 HTTP 流，推理服务随之中止该请求的生成
+
+
+class _StopEventCriteria(StoppingCriteria):
+    """stop_event 被设置后，generate 在下一个解码步结束生成。"""
+
+    def __init__(self, stop_event: threading.Event):
+        self.stop_event = stop_event
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full(
+            (input_ids.shape[0],), self.stop_event.is_set(), dtype=torch.bool, device=input_ids.device
+        )
+
+
+def _stream_text_via_transformers(
+        messages: list[dict], max_new_tokens: int, temperature: float, top_p: float,
+        stop_event: Optional[threading.Event] = None,
+) -> Iterator[str]:
+    """
+    使用进程内 transformers 模型流式生成文本。
+    generate 在后台线程中执行，TextIteratorStreamer 每解码出一段文本就交给调用方。
+    调用方设置 stop_event 或提前关闭本生成器时，generate 在下一个解码步停止，不再解码到 max_new_tokens。
+    """
+    # 确保 LLM 模型已加载
+    _load_llm_model()
+
+    if llm_model is None or llm_tokenizer is None:  # 再次检查，理论上 _load_llm_model 会抛错如果失败
+        raise RuntimeError("LLM 模型实例未成功加载。")
+
+    text = llm_tokenizer.apply_chat_template(
+        messages, tokenize=False, add_generation_prompt=True
+    )
+    # 将格式化后的文本 tokenize
+    model_inputs = llm_tokenizer([text], return_tensors="pt").to(llm_model.device)
+    generate_kwargs = {}
+    prefix_ids, prefix_cache = _encode_system_prefix(messages[0]["content"])
+    input_ids = model_inputs.input_ids[0]
+    # 前缀 token 与本次输入完全一致时才复用 (分词边界不同时退回完整预填充)
+    if len(input_ids) > len(prefix_ids) and input_ids[:len(prefix_ids)].tolist() == prefix_ids:
+        generate_kwargs["past_key_values"] = copy.deepcopy(prefix_cache)
+    # skip_prompt=True：只输出新生成的部分
+    streamer = TextIteratorStreamer(llm_tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop_event = stop_event or threading.Event()
+    generate_errors: list[BaseException] = []
+
+    def _generate() -> None:
         try:
-            model_path = Path(LLM_MODEL_PATH)
-            if not model_path.exists():
-                raise FileNotFoundError(f"模型路径不存在: {model_path.absolute()}")
-            # 2. 强制使用 CPU 来避免 MPS 上的 BFloat16 兼容性问题
-            llm_model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                torch_dtype=torch.float32,  # 使用 float32 在 CPU 上更稳定
-                device_map="cpu",  # 强制使用 CPU
-            )
-            llm_tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL_PATH)
-            # 将模型设置为评估模式
-            llm_model.eval()
-            device = next(llm_model.parameters()).device
-            logger.info(f"LLM 模型 {LLM_MODEL_NAME} 加载成功。设备: {device}")
+            with torch.inference_mode():  # 推理模式：比 no_grad 更省，不维护版本计数和视图追踪
+                llm_model.generate(
+                    **model_inputs,
+                    max_new_tokens=max_new_tokens,
+                    do_sample=True,
+                    temperature=temperature,
+                    top_p=top_p,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopEventCriteria(stop_event)]),
+                    **generate_kwargs,
+                )
+        except BaseException as e:
+            generate_errors.append(e)
+            streamer.end()  # 结束迭代，避免调用方一直等待
+
+    generate_thread = threading.Thread(target=_generate, daemon=True)
+    generate_thread.start()
+    try:
+        for new_text in streamer:
+            if new_text:
+                yield new_text
+    finally:
+        # 正常结束时无影响；调用方中途退出时通知 generate 停止，并等待后台线程释放 GPU
+        stop_event.set()
+        generate_thread.join()
+    if generate_errors:
+        raise generate_errors[0]
+
+
+def iter_text_from_llm(
+        prompt: str,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop_event: Optional[threading.Event] = None,
+) -> Iterator[str]:
+    """
+    按 LLM_BACKEND 选择后端，同步地逐段产出生成的文本。参数含义同 generate_text_from_llm。
+    :param stop_event: 设置后 transformers 后端在下一个解码步停止生成；其他后端在关闭返回的迭代器时停止
+    """
+    logger.debug(f"向 LLM 发送的 Prompt (部分内容):\n{prompt[:100]}")
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+    if settings.LLM_BACKEND == "openai":
+        return _stream_text_via_api(messages, max_new_tokens, temperature, top_p)
+    if settings.LLM_BACKEND == "llama_cpp":
+        return _stream_text_via_llama_cpp(messages, max_new_tokens, temperature, top_p)
+    return _stream_text_via_transformers(messages, max_new_tokens, temperature, top_p, stop_event)
+
+
+async def generate_text_stream(
+        prompt: str,
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,
+        max_new_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+) -> AsyncIterator[str]:
+    """
+    异步流式生成文本，供 FastAPI StreamingResponse 使用，首个片段解码出来即可返回给用户。
+    生成在工作线程中执行，片段经 asyncio.Queue 交给事件循环；调用方提前结束迭代 (如客户端断开) 时
+    通知工作线程停止，模型的解码也随之中止，不再占用 CPU/GPU 解码到 max_new_tokens。
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop_event = threading.Event()
+    end_of_stream = object()
+
+    def _produce() -> None:
+        pieces = iter_text_from_llm(prompt, system_prompt, max_new_tokens, temperature, top_p, stop_event)
+        try:
+            for new_text in pieces:
+                if stop_event.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, new_text)
         except Exception as e:
-            logger.error(f"加载 LLM 模型 {LLM_MODEL_NAME} 失败: {e}", exc_info=True)
-            raise RuntimeError(f"无法加载 LLM 模型: {LLM_MODEL_NAME}") from e
+            logger.error(f"从 LLM 流式生成文本时出错: {e}", exc_info=True)
+            loop.call_soon_threadsafe(queue.put_nowait, RuntimeError(f"从 LLM 生成文本时出错: {e}"))
+        finally:
+            # 立即关闭后端生成器，不等垃圾回收：transformers 停止 generate，llama.cpp 释放生成锁，HTTP 流被关闭
+            pieces.close()
+            loop.call_soon_threadsafe(queue.put_nowait, end_of_stream)
+
+    producer = asyncio.create_task(asyncio.to_thread(_produce))
+    try:
+        while True:
+            item = await queue.get()
+            if item is end_of_stream:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        await producer
 
 
 # --- 生成文本函数 ---
 def generate_text_from_llm(
         prompt: str,
-        system_prompt: str = "You are a helpful assistant.",  # 可选的系统提示词
+        system_prompt: str = DEFAULT_SYSTEM_PROMPT,  # 可选的系统提示词
         max_new_tokens: int = 512,  # LLM 生成响应的最大 token 数
         temperature: float = 0.7,  # 控制生成文本的随机性，值越低越确定，默认值为 0.7
         top_p: float = 0.9,  # 控制核心采样的概率阈值，默认值为 0.9
 ) -> str:
     """
-    使用加载的 Qwen 模型根据给定的提示生成文本。
+    使用加载的 Qwen 模型根据给定的提示生成文本 (一次性返回完整文本，内部拼接流式输出)。
 
     :param max_new_tokens: LLM 生成响应的最大 token 数，默认值为 512。
     :param system_prompt: 系统提示词，用于引导 LLM 生成响应，默认值为 "You are a helpful assistant."。
@@ -74,49 +381,10 @@ def generate_text_from_llm(
     :param top_p: 控制核心采样的概率阈值，默认值为 0.9。
     :return: 由 LLM 生成的文本响应。
     """
-    # 确保 LLM 模型已加载
-    _load_llm_model()
-
-    if llm_model is None or llm_tokenizer is None:  # 再次检查，理论上 _load_llm_model 会抛错如果失败
-        raise RuntimeError("LLM 模型实例未成功加载。")
-
-    logger.debug(f"向 LLM 发送的 Prompt (部分内容):\n{prompt[:100]}")
-
     try:
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ]
-        text = llm_tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-
-        # 将格式化后的文本 tokenize
-        model_inputs = llm_tokenizer([text], return_tensors="pt").to(llm_model.device)
-
-        # 使用模型生成文本
-        with torch.no_grad():
-            # 3. 根据官方文档，使用 **model_inputs 解包方式传递参数
-            generated_ids = llm_model.generate(
-                **model_inputs,
-                max_new_tokens=max_new_tokens,
-                do_sample=True,
-                temperature=temperature,
-                top_p=top_p,
-            )
-            # 4. 根据官方文档，使用更健壮的方式来分离生成的部分
-            generated_ids = [
-                output_ids[len(input_ids):]
-                for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-            ]
-
-            # 解码生成的 token
-            response = llm_tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[
-                0
-            ]
-
-            logger.info(f"LLM 生成的文本 (前100字符): {response[:100]}...")
-            return response
+        response = "".join(iter_text_from_llm(prompt, system_prompt, max_new_tokens, temperature, top_p))
+        logger.info(f"LLM 生成的文本 (前100字符): {response[:100]}...")
+        return response
     except Exception as e:
         logger.error(f"从 LLM 生成文本时出错: {e}", exc_info=True)
         # 可以考虑返回一个特定的错误信息或重新抛出
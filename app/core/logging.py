@@ -12,9 +12,36 @@
 
 import sys
 import os
+import inspect
+import logging
 from pathlib import Path
 from loguru import logger
 
+# setup_logging 是否已执行
+_logging_configured = False
+
+
+class InterceptHandler(logging.Handler):
+    """
+    把标准库 logging 的日志转发给 loguru。
+    SQLAlchemy、uvicorn 等第三方库使用标准库 logging，转发后统一经过 loguru 的异步 sink 输出。
+    """
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # 尽量映射到 loguru 的同名级别
+        try:
+            level = logger.level(record.levelname).name
+        except ValueError:
+            level = record.levelno
+
+        # 回溯到真正发出日志的调用方，使 loguru 记录的 {name}:{function}:{line} 正确
+        frame, depth = inspect.currentframe(), 0
+        while frame and (depth == 0 or frame.f_code.co_filename == logging.__file__):
+            frame = frame.f_back
+            depth += 1
+
+        logger.opt(depth=depth, exception=record.exc_info).log(level, record.getMessage())
+
 def setup_logging():
     """
     配置 loguru 日志系统
@@ -24,52 +51,75 @@ def setup_logging():
     2. 添加彩色控制台输出
     3. 添加文件日志输出（按日期轮转）
     4. 根据环境设置不同的日志级别
+    重复调用时直接返回。
     """
-    # 移除默认处理器
-    logger.remove()
+    global _logging_configured
+    # 幂等：FastAPI 启动、Celery worker 启动等多处调用时只配置一次，避免重复添加 sink
+    if _logging_configured:
+        return
+    _logging_configured = True
 
     # 确保日志目录存在
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
 
-    # 添加控制台处理器（彩色输出）
-    logger.add(
-        sys.stdout,
-        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        level="INFO",  # 默认INFO级别，生产环境可以调整为WARNING
-        colorize=True,
-        backtrace=True,
-        diagnose=True
-    )
+    # 文件日志不着色，格式中不使用颜色标记
+    file_format = "{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}"
 
-    # 添加文件处理器（按日期轮转）
-    logger.add(
-        log_dir / "app.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        level="DEBUG",  # 文件记录DEBUG级别及以上
-        rotation="1 day",  # 每天轮转
-        retention="30 days",  # 保留30天
-        compression="zip",  # 压缩旧日志
-        backtrace=True,
-        diagnose=True,
-        encoding="utf-8"
+    # logger.configure 会先移除默认处理器，再一次性安装全部 sink
+    logger.configure(
+        handlers=[
+            # 控制台处理器（彩色输出）
+            dict(
+                sink=sys.stdout,
+                format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+                level="INFO",  # 默认INFO级别，生产环境可以调整为WARNING
+                colorize=True,
+                backtrace=True,
+                diagnose=True,
+                enqueue=True,  # 由后台线程写控制台，请求线程只负责入队，不在热路径上做同步 IO
+            ),
+            # 文件处理器（按日期轮转）
+            dict(
+                sink=log_dir / "app.log",
+                format=file_format,
+                level="DEBUG",  # 文件记录DEBUG级别及以上
+                rotation="1 day",  # 每天轮转
+                retention="30 days",  # 保留30天
+                compression="zip",  # 压缩旧日志
+                colorize=False,
+                serialize=False,
+                backtrace=True,
+                diagnose=True,
+                encoding="utf-8",
+                enqueue=True,  # 由后台线程写文件
+            ),
+            # 错误日志文件（单独记录错误和异常）
+            dict(
+                sink=log_dir / "error.log",
+                format=file_format,
+                level="ERROR",  # 只记录ERROR级别
+                rotation="1 day",
+                retention="30 days",
+                compression="zip",
+                colorize=False,
+                serialize=False,
+                backtrace=True,
+                diagnose=True,
+                encoding="utf-8",
+                enqueue=True,  # 由后台线程写文件
+            ),
+        ]
     )
 
-    # 添加错误日志文件（单独记录错误和异常）
-    logger.add(
-        log_dir / "error.log",
-        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function}:{line} - {message}",
-        level="ERROR",  # 只记录ERROR级别
-        rotation="1 day",
-        retention="30 days",
-        compression="zip",
-        backtrace=True,
-        diagnose=True,
-        encoding="utf-8"
-    )
+    # 标准库 logging 统一转发到 loguru
+    logging.basicConfig(handlers=[InterceptHandler()], level=logging.INFO, force=True)
+    # SQLAlchemy 在 INFO 级别会输出每条 SQL，httpx 会输出每个 ChromaDB 请求，只保留警告及以上
+    for name in ("sqlalchemy.engine", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        # uvicorn 自带处理器，清空后交由根 logger (InterceptHandler) 处理，避免重复输出
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
 
     logger.info("日志系统配置完成")
-
-def get_logger():
-    """获取配置好的logger实例"""
-    return logger
@@ -0,0 +1,91 @@
+# -*- coding: UTF-8 -*-
+"""
+@File ：model_preload.py
+@IDE ：PyCharm
+@Author ：zhanzhicai
+@Date ：2025/11/20 15:40
+@DOC: 模型预加载与预热，在 FastAPI 启动和 Celery worker 启动时调用
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import torch
+from loguru import logger
+
+from app.core.chromadb_client import get_chroma_collection
+from app.core.config import settings
+from app.core.embedding_qwen import _load_embedding_model, get_embeddings, warmup_embedding_buckets
+from app.core.llm_service import (
+    DEFAULT_SYSTEM_PROMPT, _encode_system_prefix, _ensure_llm_api_server, _load_llm_gguf_model, _load_llm_model,
+)
+from app.core.reranker_qwen import _load_reranker_model, rerank_documents, warmup_reranker_buckets
+from app.schemas.schemas import TextChunkResponse
+
+# 预热时使用的占位文本
+WARMUP_TEXT = "预热"
+
+
+def _warmup_models() -> None:
+    """
+    用占位数据跑一次 Embedding 和 Reranker 前向，
+    把首次调用的 kernel 选择、torch.compile 编译等开销挪到启动阶段。
+    """
+    warmup_embedding_buckets()
+    warmup_reranker_buckets()
+    get_embeddings([WARMUP_TEXT], task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL, is_query=True)
+
+    now = datetime.now(timezone.utc)
+    dummy_chunks = [
+        TextChunkResponse(
+            id=i, source_document_id=0, sequence_in_document=i, chunk_text=WARMUP_TEXT,
+            created_at=now, updated_at=now,
+        )
+        for i in range(2)
+    ]
+    rerank_documents(WARMUP_TEXT, dummy_chunks, settings.RERANKER_INSTRUCTION)
+
+
+def _configure_cuda_allocator() -> None:
+    """
+    在任何模型占用显存之前限制本进程可用的显存比例。
+    分配器参数 (CUDA_ALLOC_CONF) 已在 app.core.config 中写入 PYTORCH_CUDA_ALLOC_CONF 环境变量，不使用 torch 的私有接口。
+    """
+    if not torch.cuda.is_available():
+        return
+    if settings.CUDA_MEMORY_FRACTION:
+        for device_index in range(torch.cuda.device_count()):
+            torch.cuda.set_per_process_memory_fraction(settings.CUDA_MEMORY_FRACTION, device_index)
+
+
+def preload_models(include_llm: bool = True) -> None:
+    """
+    并行加载 Embedding、Reranker、(可选) LLM 模型和 ChromaDB 客户端，全部完成后预热。
+    各加载函数内部有锁保护，与并发的首次请求同时发生时也不会重复加载。
+    :param include_llm: 是否加载 LLM，Celery worker 不做生成，可以跳过
+    """
+    logger.info("开始预加载模型...")
+    loaders = [_load_embedding_model, _load_reranker_model, get_chroma_collection]
+    if include_llm and settings.LLM_BACKEND == "transformers":
+        # 加载后预先计算默认系统提示词的 KV 缓存
+        loaders.append(lambda: (_load_llm_model(), _encode_system_prefix(DEFAULT_SYSTEM_PROMPT)))
+    elif include_llm and settings.LLM_BACKEND == "llama_cpp":
+        loaders.append(_load_llm_gguf_model)
+    elif include_llm and settings.LLM_BACKEND == "openai":
+        # 使用外部推理服务时进程内无需加载 LLM，只确认服务可用
+        loaders.append(_ensure_llm_api_server)
+
+    try:
+        _configure_cuda_allocator()
+        # 读权重文件和拷贝到设备大多在 GIL 之外完成，并行加载时总耗时接近最慢的一个而不是各项之和
+        with ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="model-preload") as executor:
+            futures = [executor.submit(loader) for loader in loaders]
+            for future in futures:
+                future.result()
+
+        _warmup_models()
+    except Exception:
+        # 预加载失败不阻止服务启动，首次请求时各加载函数会再次尝试；
+        # 记录完整堆栈，模型路径错误等问题在启动日志中即可发现，而不是等到第一个用户请求
+        logger.exception("模型预加载失败，将在首次请求时按需加载")
+        return
+    logger.info("模型预加载与预热完成。")
@@ -6,12 +6,22 @@
 @Date ：2025/11/6 02:09
 @DOC:
 """
+import asyncio
+import contextlib
+import copy
+import importlib.util
+import itertools
+import queue
+import threading
+from functools import lru_cache
 from pathlib import Path
 
 import torch
 from  loguru import logger
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
 
+from app.core.config import settings
+from app.core.executors import GPU_POOL
 from app.schemas.schemas import TextChunkResponse
 
 
@@ -19,6 +29,8 @@ from app.schemas.schemas import TextChunkResponse
 RERANKER_MODEL_NAME = "Qwen/Qwen3-Reranker-0.6B"
 RERANKER_MODEL_PATH = "app/embeddings/Qwen/Qwen3-Reranker-0.6B"
 QWEN_RERANKER_MAX_LENGTH = 8192
+# 共享前缀 (system + instruct + query) KV 缓存的条目数，重复查询可直接复用
+RERANKER_PREFIX_CACHE_SIZE = 32
 
 """ 下载新模型命令
     uv run huggingface-cli download Qwen/Qwen3-Reranker-0.6B /
@@ -29,6 +41,13 @@ QWEN_RERANKER_MAX_LENGTH = 8192
 reranker_tokenizer = None
 reranker_model_global = None
 reranker_device = None
+reranker_base_model = None  # 打分用的基座模型 (不含 lm_head)，启用编译时为编译后的模块
+reranker_compiled = False  # 基座模型是否已经过 torch.compile 编译
+# Reranker 在 GPU 上使用的 CUDA 流池：每个并发请求占用一条独立的流，
+# 不同请求的拷贝、kernel 启动与 Python 前后处理可以互相重叠，与 Embedding 共卡时也不挤占默认流
+reranker_stream_pool: queue.SimpleQueue | None = None
+# 加载锁：防止多个线程同时首次调用时重复加载模型
+_reranker_load_lock = threading.Lock()
 
 # Qwen Reranker 的特定提示词（Prompt）结构
 # 这些是固定的，只需要定义一次
@@ -41,10 +60,85 @@ PREFIX = (
 SUFFIX = "<|im_end|>\n<|im_start|>assistant\n<think>\n\n</think>\n\n"
 
 # 这些变量将在模型加载时被初始化
-prefix_tokens = None
-suffix_tokens = None
 token_true_id = None
 token_false_id = None
+# SUFFIX 的 token id，加载时编码一次，追加到每个文档部分的末尾 (不参与截断)
+suffix_token_ids: list[int] = []
+# lm_head 中 "yes" 行减去 "no" 行的权重差，形状 [hidden]，加载时预先计算
+yes_no_diff_weight = None
+
+
+def _select_reranker_device() -> torch.device:
+    """
+    按 settings.RERANKER_DEVICE 选择设备。
+    auto 时：多 GPU 放到 cuda:1 与 Embedding (cuda:0) 真正并行；单 GPU 用 cuda:0；
+    非 CUDA 环境强制使用 CPU 来避免 MPS 上的内存问题。
+    """
+    if settings.RERANKER_DEVICE != "auto":
+        return torch.device(settings.RERANKER_DEVICE)
+    if torch.cuda.is_available():
+        return torch.device("cuda:1" if torch.cuda.device_count() > 1 else "cuda:0")
+    return torch.device("cpu")
+
+
+def _select_reranker_cpu_dtype() -> torch.dtype:
+    """
+    按 settings.RERANKER_CPU_DTYPE 选择 CPU 上的权重精度。
+    bfloat16 在支持原生 BF16 (AVX512-BF16 / AMX) 的 CPU 上权重内存减半、矩阵乘吞吐翻倍，
+    没有原生支持时反而更慢，因此由部署方按机器显式开启，默认 float32。
+    """
+    if settings.RERANKER_CPU_DTYPE == "bfloat16":
+        return torch.bfloat16
+    if settings.RERANKER_CPU_DTYPE != "float32":
+        logger.warning(f"不支持的 Reranker CPU 精度: {settings.RERANKER_CPU_DTYPE}，将使用 float32。")
+    return torch.float32
+
+
+def _reranker_quantization_kwargs() -> dict:
+    """
+    按 settings.RERANKER_QUANT 构造 bitsandbytes 量化参数 (仅 CUDA)。
+    int8 权重显存约为 bf16 的一半，int4 (NF4) 约为四分之一，便于与 Embedding、LLM 共用小显存 GPU。
+    lm_head 默认不量化，yes/no 两行权重仍可直接切出。
+    """
+    if settings.RERANKER_QUANT == "none":
+        return {}
+    if settings.RERANKER_QUANT not in ("int8", "int4"):
+        logger.warning(f"不支持的 Reranker 量化方式: {settings.RERANKER_QUANT}，将使用 bfloat16 权重。")
+        return {}
+    if importlib.util.find_spec("bitsandbytes") is None:
+        logger.warning("未安装 bitsandbytes，跳过 Reranker 量化。")
+        return {}
+    if settings.RERANKER_QUANT == "int8":
+        quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+    else:
+        quantization_config = BitsAndBytesConfig(
+            load_in_4bit=True, bnb_4bit_compute_dtype=torch.bfloat16, bnb_4bit_quant_type="nf4"
+        )
+    logger.info(f"Reranker 将以 {settings.RERANKER_QUANT} (bitsandbytes) 量化加载。")
+    return {"quantization_config": quantization_config}
+
+
+def _load_reranker_model_on_cuda(cuda_device: torch.device) -> AutoModelForCausalLM:
+    """在 CUDA 上以 bfloat16 加载 Reranker，优先使用 Flash Attention 2，失败时使用标准模式。"""
+    # bfloat16 的数值范围与 float32 相同，softmax 比 float16 更稳定
+    quantization_kwargs = _reranker_quantization_kwargs()
+    try:
+        model = AutoModelForCausalLM.from_pretrained(
+            RERANKER_MODEL_PATH,
+            attn_implementation="flash_attention_2",
+            torch_dtype=torch.bfloat16,
+            device_map={"": cuda_device},
+            **quantization_kwargs,
+        )
+        logger.info("Reranker 已启用 Flash Attention 2 和 bfloat16 加速。")
+        return model
+    except torch.cuda.OutOfMemoryError:
+        raise
+    except Exception as e:
+        logger.warning(f"Reranker 加载 Flash Attention 2 失败: {e}，将使用标准模式。")
+        return AutoModelForCausalLM.from_pretrained(
+            RERANKER_MODEL_PATH, torch_dtype=torch.bfloat16, device_map={"": cuda_device}, **quantization_kwargs
+        )
 
 
 # 加载 Reranker 模型
@@ -66,47 +160,259 @@ def _load_reranker_model():
     global reranker_tokenizer  # 全局变量，用于存储分词器
     global reranker_model_global  # 全局变量，用于存储模型
     global reranker_device  # 全局变量，用于存储模型运行设备（如GPU）
+    global reranker_base_model  # 全局变量，用于存储打分用的基座模型
+    global reranker_stream_pool  # 全局变量，用于存储 Reranker 专用的 CUDA 流池
+    global reranker_compiled  # 全局变量，标记基座模型是否已编译
+
+    global token_true_id, token_false_id # 全局变量，用于存储 "yes"/"no" 的 token ID
+    global suffix_token_ids # 全局变量，用于存储 SUFFIX 的 token ID
+    global yes_no_diff_weight # 全局变量，用于存储 "yes"/"no" 两行 lm_head 权重之差
+
+    # 双重检查：reranker_base_model 是加载流程中最后赋值的变量，非空即表示全部就绪
+    if reranker_base_model is not None:
+        return
+    with _reranker_load_lock:
+        if reranker_base_model is None:
+            logger.info(f"首次加载 Reranker 模型: {RERANKER_MODEL_NAME}...")
+            try:
+                model_path = Path(RERANKER_MODEL_PATH) # 模型路径
+                if not model_path.exists():
+                    raise FileNotFoundError(f"模型路径不存在: {model_path.absolute()}")
+                logger.info(f"从本地加载 Embedding 模型: {model_path}...")
+
+                # --- 3. 修改 Tokenizer 和模型加载方式 ---
+                reranker_tokenizer = AutoTokenizer.from_pretrained(
+                    RERANKER_MODEL_PATH, padding_side='left'
+                )
+
+                # 初始化 "yes"/"no" 的 token ID
+                # 这些只需要计算一次，所以放在加载函数里
+                token_true_id = reranker_tokenizer.convert_tokens_to_ids("yes")
+                token_false_id = reranker_tokenizer.convert_tokens_to_ids("no")
+                suffix_token_ids = reranker_tokenizer.encode(SUFFIX, add_special_tokens=False)
+
+                # 通过 device_map 让权重直接加载到目标设备，省去先落到 CPU 再整体 .to(device) 的拷贝
+                reranker_device = _select_reranker_device()
+                if reranker_device.type == "cuda":
+                    logger.info(f"Reranker 模型将使用 GPU: {reranker_device} (bfloat16)。")
+                    # 不预先按显存容量判断能否放下，直接尝试加载，以 OOM 作为信号回退到 CPU
+                    try:
+                        reranker_model_global = _load_reranker_model_on_cuda(reranker_device)
+                    except torch.cuda.OutOfMemoryError as e:
+                        logger.warning(f"GPU 显存不足，Reranker 模型回退到 CPU: {e}")
+                        torch.cuda.empty_cache()
+                        reranker_device = torch.device("cpu")
+
+                if reranker_device.type != "cuda":
+                    cpu_dtype = _select_reranker_cpu_dtype()
+                    logger.info(f"Reranker 模型将使用 {reranker_device} ({cpu_dtype})。")
+                    reranker_model_global = AutoModelForCausalLM.from_pretrained(
+                        RERANKER_MODEL_PATH,
+                        torch_dtype=cpu_dtype,
+                        device_map={"": reranker_device},
+                    )
+
+                reranker_model_global.eval() # 设置模型为评估模式
+                # 打分只需要 yes/no 的 logit 差：h·w_yes - h·w_no = h·(w_yes - w_no)，
+                # 预先在 float32 下求差再转回模型精度，打分时只做一次 [B, H] x [H] 的矩阵-向量乘
+                lm_head_weight = reranker_model_global.lm_head.weight.detach()
+                yes_no_diff_weight = (
+                    lm_head_weight[token_true_id].float() - lm_head_weight[token_false_id].float()
+                ).to(lm_head_weight.dtype).contiguous()
+
+                if reranker_device.type == "cuda":
+                    # 独立的 CUDA 流：与 Embedding 共用一块 GPU 时，两者的 kernel 可以交错执行
+                    reranker_stream_pool = queue.SimpleQueue()
+                    for _ in range(settings.RERANKER_STREAM_POOL_SIZE):
+                        reranker_stream_pool.put(torch.cuda.Stream(device=reranker_device))
+
+                reranker_base_model = reranker_model_global.model
+                # bitsandbytes 量化层不支持 torch.compile，量化时跳过编译
+                quantized = getattr(reranker_model_global, "is_quantized", False)
+                if settings.RERANKER_USE_COMPILE and reranker_device.type == "cuda" and not quantized:
+                    # 只编译文档打分的前向：每次打分都运行同一张图，只有输入形状不同；编译后消除逐算子的 Python 与调度开销。
+                    # 共享前缀由 _encode_shared_prefix 在未编译的 reranker_model_global.model 上计算
+                    reranker_base_model = torch.compile(
+                        reranker_base_model, mode="reduce-overhead", fullgraph=False, dynamic=True
+                    )
+                    reranker_compiled = True
+                    logger.info("Reranker 已启用 torch.compile (reduce-overhead)。")
+                logger.info(f"Reranker 模型加载完成: {RERANKER_MODEL_NAME}并移至 {reranker_device}。")
+            except Exception as e:
+                logger.error(f"加载 Reranker 模型失败: {e}")
+                raise RuntimeError(f"无法加载 Reranker 模型: {RERANKER_MODEL_PATH}") from e
+
+
+@lru_cache(maxsize=RERANKER_PREFIX_CACHE_SIZE)
+def _encode_shared_prefix(prefix_text: str) -> tuple[int, torch.Tensor, object]:
+    """
+    对所有候选文档共享的前缀只做一次前向计算，缓存其 past_key_values。
+
+    同一查询 (和指令) 下的每个候选文档前缀完全相同，缓存后各文档只需计算自身部分，
+    共享前缀的计算量从 O(N_docs · L_prefix) 降为 O(L_prefix)。
+
+    Returns:
+        tuple[int, torch.Tensor, object]: (前缀的实际 token 长度, 前缀的 attention_mask [1, P], 前缀的 KV 缓存)，
+        KV 缓存在调用方使用前须先复制
+    """
+    prefix_ids = reranker_tokenizer(
+        prefix_text, add_special_tokens=False, return_tensors="pt"
+    ).input_ids
+    return _encode_prefix_ids(prefix_ids)
+
+
+def _encode_prefix_ids(prefix_ids: torch.Tensor) -> tuple[int, torch.Tensor, object]:
+    """
+    计算一段前缀 token (形状 [1, L]，位于 CPU) 的 KV 缓存，返回值同 _encode_shared_prefix。
+    编译模式下前缀左填充到 RERANKER_PAD_MULTIPLE 的整数倍：打分时 KV 的长度也落在少数几个桶里，
+    编译后的打分图不会因每个查询的前缀长度不同而重新捕获；填充位置由 attention_mask 屏蔽。
+    """
+    prefix_len = prefix_ids.shape[1]
+    prefix_mask = torch.ones_like(prefix_ids)
+    pad_multiple = settings.RERANKER_PAD_MULTIPLE
+    if reranker_compiled and pad_multiple:
+        pad = -(-prefix_len // pad_multiple) * pad_multiple - prefix_len
+        prefix_ids = torch.cat([prefix_ids.new_full((1, pad), reranker_tokenizer.pad_token_id), prefix_ids], dim=1)
+        prefix_mask = torch.cat([prefix_mask.new_zeros((1, pad)), prefix_mask], dim=1)
+    prefix_ids = prefix_ids.to(reranker_device)
+    prefix_mask = prefix_mask.to(reranker_device)
+    with torch.inference_mode(), _reranker_autocast_context():
+        # 前缀始终用未编译的基座模型计算：编译 (reduce-overhead) 模式下输出位于 CUDA Graph 的静态缓冲区，
+        # 下一次重放就会被覆盖，不能放进跨请求、跨线程复用的缓存
+        outputs = reranker_model_global.model(
+            input_ids=prefix_ids,
+            attention_mask=prefix_mask,
+            position_ids=(prefix_mask.cumsum(dim=1) - 1).clamp(min=0),  # 位置从第一个真实 token 开始计数
+            use_cache=True,
+        )
+    if reranker_device.type == "cuda":
+        # 缓存条目会被其他请求在各自的流上读取，返回前确保前缀计算已在当前流上完成
+        torch.cuda.current_stream(reranker_device).synchronize()
+    return prefix_len, prefix_mask, outputs.past_key_values
+
+
+def _format_shared_prefix(query: str, task_instruction: str | None) -> str:
+    """
+    构造所有文档共享的输入前缀。
+    前缀在 "<Document>:" 处截断：Qwen 分词器会把标点与后面的 " 单词" 切成不同的预分词单元，
+    因此分开分词与整体分词的结果一致。
+    """
+    # 如果没有提供任务指令，使用默认值
+    if task_instruction is None:
+        task_instruction = 'Given a web search query, retrieve relevant passages that answer the query'
+    return f"{PREFIX}<Instruct>: {task_instruction}\n<Query>: {query}\n<Document>:"
+
 
-    global prefix_tokens, suffix_tokens, token_true_id, token_false_id # 全局变量，用于存储提示词的 token ID
+def _reranker_autocast_context():
+    """
+    CPU 上权重为 bfloat16 时启用 autocast：矩阵乘统一走 bf16 kernel，
+    softmax、归一化等对精度敏感的算子按 autocast 规则自动上转 float32；其他情况不做任何事。
+    """
+    if reranker_device.type == "cpu" and reranker_model_global.dtype == torch.bfloat16:
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+@contextlib.contextmanager
+def _reranker_stream_context():
+    """从流池中借用一条 CUDA 流并设为当前流，结束后归还；CPU 上不做任何事。"""
+    if reranker_stream_pool is None:
+        yield
+        return
+    stream = reranker_stream_pool.get()  # 流池为空时阻塞等待，并发度即流池大小
+    try:
+        with torch.cuda.stream(stream):
+            yield
+    finally:
+        reranker_stream_pool.put(stream)
 
-    # 检查模型文件是否存在
-    if reranker_tokenizer is None or reranker_model_global is None:
-        logger.info(f"首次加载 Reranker 模型: {RERANKER_MODEL_NAME}...")
-        try:
-            model_path = Path(RERANKER_MODEL_PATH) # 模型路径
-            if not model_path.exists():
-                raise FileNotFoundError(f"模型路径不存在: {model_path.absolute()}")
-            logger.info(f"从本地加载 Embedding 模型: {model_path}...")
 
-            # --- 3. 修改 Tokenizer 和模型加载方式 ---
-            reranker_tokenizer = AutoTokenizer.from_pretrained(
-                RERANKER_MODEL_PATH, padding_side='left'
+def _score_doc_batch(doc_ids: list[list[int]], prefix_len: int, prefix_mask: torch.Tensor,
+                     prefix_kv) -> torch.Tensor:
+    """
+    对一个微批次的文档部分打分 (需在 inference_mode 下调用)。
+    :param doc_ids: 各文档部分 (" {chunk}" 的 token id + SUFFIX 的 token id) 的列表，未填充
+    :param prefix_len: 共享前缀的实际 token 长度 (不含填充)
+    :param prefix_mask: 共享前缀的 attention_mask，形状 [1, P]，P 为前缀 KV 的长度 (编译模式下含左填充)
+    :param prefix_kv: 共享前缀的 KV 缓存 (不会被修改)
+    :return: 形状 [len(doc_ids)] 的 "yes" 与 "no" 的 logit 差 (float32)，位于 reranker_device 上
+    """
+    # 直接构造左填充的张量，代替 tokenizer.pad 对每行做的 Python 处理：
+    # 掩码中每行右侧 len(ids) 个位置为 True，按行优先顺序一次写入所有 token
+    batch_size = len(doc_ids)
+    lengths = torch.tensor([len(ids) for ids in doc_ids])
+    padded_len = int(lengths.max())
+    if settings.RERANKER_PAD_MULTIPLE:
+        # 填充到固定倍数：输入形状落在少数几个桶里，编译图可复用，GEMM/注意力 kernel 也更易对齐分块
+        padded_len = -(-padded_len // settings.RERANKER_PAD_MULTIPLE) * settings.RERANKER_PAD_MULTIPLE
+    token_mask = torch.arange(padded_len) >= (padded_len - lengths).unsqueeze(1)
+    input_ids = torch.full((batch_size, padded_len), reranker_tokenizer.pad_token_id, dtype=torch.long)
+    input_ids[token_mask] = torch.tensor(list(itertools.chain.from_iterable(doc_ids)), dtype=torch.long)
+
+    doc_mask = token_mask.long()
+    if reranker_device.type == "cuda":
+        # 锁页内存 + non_blocking：H2D 拷贝在当前流上异步执行，Python 线程不必等待拷贝完成，
+        # 锁页缓冲由 PyTorch 的主机端缓存分配器管理，在拷贝完成前不会被复用
+        input_ids = input_ids.pin_memory()
+        doc_mask = doc_mask.pin_memory()
+    input_ids = input_ids.to(reranker_device, non_blocking=True)
+    doc_mask = doc_mask.to(reranker_device, non_blocking=True)
+
+    # 缓存条目会被后续调用复用，先复制再沿 batch 维展开
+    past_key_values = copy.deepcopy(prefix_kv)
+    past_key_values.batch_repeat_interleave(batch_size)
+    # 前缀的左填充和文档的左填充 (位于前缀与文档之间) 都由 attention_mask 屏蔽；位置编码紧接前缀的实际长度连续递增
+    attention_mask = torch.cat(
+        [prefix_mask.expand(batch_size, -1), doc_mask], dim=1
+    )
+    position_ids = (prefix_len + doc_mask.cumsum(dim=1) - 1).clamp(min=prefix_len)
+
+    # 只做 prefill 打分，不走解码
+    # 只运行基座模型拿到最后一个位置的隐藏状态，避免 lm_head 对整个词表
+    # (约 15 万) 做投影并物化 [batch, seq_len, vocab] 的 logits
+    hidden = reranker_base_model(
+        input_ids=input_ids,
+        attention_mask=attention_mask,
+        position_ids=position_ids,
+        past_key_values=past_key_values,  # 文档部分的 KV 会追加到这份副本，用完即弃
+        use_cache=True,
+    ).last_hidden_state[:, -1, :]
+
+    # 直接得到 yes/no 的 logit 差：[B, H] x [H] 代替 [B, H] x [H, vocab]
+    # 排序只需要单调的分数：logit 差代替二分类 softmax，
+    # sigmoid(yes - no) 与 softmax 得到的 "yes" 概率完全相同，只需对最终选出的 top_n 计算
+    return (hidden @ yes_no_diff_weight).float()
+
+
+def warmup_reranker_buckets(max_length: int = 1024, max_prefix_length: int = 256) -> None:
+    """
+    编译模式下对前缀和文档的各个填充长度 (RERANKER_PAD_MULTIPLE 的整数倍) 的组合，
+    以单条和满微批两种批大小各跑一次打分，把 torch.compile 编译和 CUDA Graph 捕获开销挪到启动阶段。
+    文本块受 CHUNK_SIZE 限制，默认只预热到 1024 个 token；前缀 (指令 + 查询) 默认预热到 256 个 token，
+    更长的形状在首次遇到时再编译。
+    """
+    if not reranker_compiled or not settings.RERANKER_PAD_MULTIPLE:
+        return
+    pad_multiple = settings.RERANKER_PAD_MULTIPLE
+    with torch.inference_mode(), _reranker_stream_context(), _reranker_autocast_context():
+        for prefix_bucket in range(pad_multiple, max_prefix_length + 1, pad_multiple):
+            # 长度恰为桶长的前缀不再填充，KV 长度即为该桶
+            prefix_len, prefix_mask, prefix_kv = _encode_prefix_ids(
+                torch.full((1, prefix_bucket), reranker_tokenizer.pad_token_id, dtype=torch.long)
             )
+            for length in range(pad_multiple, max_length + 1, pad_multiple):
+                for batch_size in {1, settings.RERANKER_BATCH_SIZE}:
+                    _score_doc_batch(
+                        [[reranker_tokenizer.pad_token_id] * length] * batch_size, prefix_len, prefix_mask, prefix_kv
+                    )
+        if reranker_device.type == "cuda":
+            torch.cuda.current_stream(reranker_device).synchronize()
+    logger.info(f"Reranker 编译预热完成 (前缀长度 <= {max_prefix_length}，文档长度 <= {max_length})。")
 
-            # 初始化提示词的 token
-            # 这些只需要计算一次，所以放在加载函数里
-            prefix_tokens = reranker_tokenizer.encode(PREFIX, add_special_tokens=False)
-            suffix_tokens = reranker_tokenizer.encode(SUFFIX, add_special_tokens=False)
-            token_true_id = reranker_tokenizer.convert_tokens_to_ids("yes")
-            token_false_id = reranker_tokenizer.convert_tokens_to_ids("no")
-
-            # 强制使用 CPU 来避免 MPS 上的内存问题
-            reranker_device = torch.device("cpu") # 设置模型运行设备（如CPU）
-            logger.info("Reranker 模型将强制使用 CPU 以避免内存问题。")
-            reranker_model_global = AutoModelForCausalLM.from_pretrained(
-                RERANKER_MODEL_PATH,
-                torch_dtype=torch.float32  # 使用 float32 在 CPU 上更稳定
-            ).to(reranker_device)
-
-            reranker_model_global.eval() # 设置模型为评估模式
-            logger.info(f"Reranker 模型加载完成: {RERANKER_MODEL_NAME}并移至 {reranker_device}。")
-        except Exception as e:
-            logger.error(f"加载 Reranker 模型失败: {e}")
-            raise RuntimeError(f"无法加载 Reranker 模型: {RERANKER_MODEL_PATH}") from e
 
 # 对文档进行排序
-def rerank_documents(query: str, documents: list[TextChunkResponse],task_instruction: str = None) \
-        -> list[tuple[TextChunkResponse, float]]:
+def rerank_documents(query: str, documents: list[TextChunkResponse],task_instruction: str = None,
+                     top_n: int | None = None, batch_size: int | None = None) -> list[tuple[TextChunkResponse, float]]:
     """
     使用 Qwen3-Reranker-4B 模型对初步检索到的文档块列表进行重排序。
 
@@ -115,13 +421,15 @@ def rerank_documents(query: str, documents: list[TextChunkResponse],task_instruc
         documents (list[TextChunkResponse]): 包含多个文档字符串的列表
 
     Returns:
-        list[float]: 每个文档的排序分数列表，分数越高表示越相关
+        list[tuple[TextChunkResponse, float]]: 按分数降序排列的 (文档, 分数) 列表，分数越高表示越相关
 
     Note:
         该函数依赖于已加载的 Reranker 模型和分词器。
         :param documents:
         :param query:
         :param task_instruction:  Reranker 模型的指令，用于指定排序任务，默认值为 RERANKER_INSTRUCTION
+        :param top_n: 只返回得分最高的前 N 个文档 (按分数降序)，为 None 时返回全部
+        :param batch_size: 每次前向的文档数 (微批次)，限制峰值显存；为 None 时使用 settings.RERANKER_BATCH_SIZE
     """
 
     try:
@@ -129,61 +437,98 @@ def rerank_documents(query: str, documents: list[TextChunkResponse],task_instruc
     except RuntimeError as e:
         logger.warning(f"Reranker 模型不可用，使用原始顺序: {e}")
         # 返回原始文档顺序，分数为1.0
-        return [(doc, 1.0) for doc in documents]
+        return [(doc, 1.0) for doc in documents[:top_n]]
 
     if not query or not documents:
         return []
 
     # --- 4. 完全重写评分逻辑以适配 Qwen Reranker ---
     # 4.1 格式化输入
-    # 如果没有提供任务指令，使用默认值
-    if task_instruction is None:
-        task_instruction = 'Given a web search query, retrieve relevant passages that answer the query'
-
-    pairs = [
-        f"<Instruct>: {task_instruction}\n<Query>: {query}\n<Document>: {doc.chunk_text}"
-        for doc in documents
-    ]
+    shared_prefix = _format_shared_prefix(query, task_instruction)
+    doc_parts = [f" {doc.chunk_text}" for doc in documents]
     try:
-        with torch.no_grad():
-            # 4.2 自定义 Tokenization 过程
-            # 先对核心文本进行 tokenize，不填充，不加特殊符号
-            inputs = reranker_tokenizer(
-                pairs, padding=False, truncation='longest_first',
-                return_attention_mask=False,
-                max_length=QWEN_RERANKER_MAX_LENGTH - len(prefix_tokens) - len(suffix_tokens)
-            )
-            # 手动为每个序列加上前后缀
-            for i in range(len(inputs['input_ids'])):
-                inputs['input_ids'][i] = prefix_tokens + inputs['input_ids'][i] + suffix_tokens
-
-            # 对整个批次进行填充
-            inputs = reranker_tokenizer.pad(inputs, padding=True, return_tensors="pt")
-            inputs = {k: v.to(reranker_device) for k, v in inputs.items()}
-            # 4.3 计算分数
-            # 获取模型在最后一个 token 位置上的 logits
-            last_token_logits = reranker_model_global(**inputs).logits[:, -1, :]
-
-            # 提取 "yes" 和 "no" 两个词的 logits
-            true_vector = last_token_logits[:, token_true_id]
-            false_vector = last_token_logits[:, token_false_id]
-
-            # 计算 LogSoftmax 并转换为概率
-            batch_scores = torch.stack([false_vector, true_vector], dim=1)
-            batch_scores = torch.nn.functional.log_softmax(batch_scores, dim=1)
-            # 取出 "yes" 的概率作为最终得分
-            scores = batch_scores[:, 1].exp().cpu().tolist()
-
-        # 4.4 关联分数并排序
-        scored_documents = sorted(
-            zip(documents, scores),
-            key=lambda x: x[1],
-            reverse=True
+        # 在借用的 Reranker 专用流上完成拷贝、前向和结果回传 (.cpu() 只同步该流)
+        with torch.inference_mode(), _reranker_stream_context(), _reranker_autocast_context():
+            # 4.2 Tokenization
+            # 共享前缀只计算一次 (按前缀文本 LRU 缓存)，每个文档只对自身部分分词
+            prefix_len, prefix_mask, prefix_kv = _encode_shared_prefix(shared_prefix)
+            # 文本块大小由 CHUNK_SIZE 控制，远小于模型上限，正常情况下不会触发截断；
+            # 只对文档正文分词并为 SUFFIX 预留长度，截断时从正文右侧截去，
+            # 末尾的 SUFFIX 始终完整，最后一个位置的 yes/no logit 才有意义
+            doc_ids = [
+                ids + suffix_token_ids
+                for ids in reranker_tokenizer(
+                    doc_parts,
+                    truncation=True,
+                    max_length=QWEN_RERANKER_MAX_LENGTH - prefix_len - len(suffix_token_ids),
+                    add_special_tokens=False,
+                )["input_ids"]
+            ]
+
+            # 4.3 按微批次计算分数：峰值激活显存只取决于 batch_size，与候选文档总数无关
+            # 先按 token 长度排序再切分微批次，同一批内长度相近，按批内最长填充时浪费最少
+            batch_size = batch_size or settings.RERANKER_BATCH_SIZE
+            order = sorted(range(len(doc_ids)), key=lambda i: len(doc_ids[i]))
+            sorted_ids = [doc_ids[i] for i in order]
+            sorted_logits = torch.cat([
+                _score_doc_batch(sorted_ids[i:i + batch_size], prefix_len, prefix_mask, prefix_kv)
+                for i in range(0, len(sorted_ids), batch_size)
+            ])
+            # 按排序前的位置写回，恢复与 documents 一致的顺序
+            logits = torch.empty_like(sorted_logits)
+            logits[torch.tensor(order, device=sorted_logits.device)] = sorted_logits
+
+            # 4.4 在设备上选出 top_n (结果已按分数降序)，只做一次设备到主机的同步
+            k = len(documents) if top_n is None else min(top_n, len(documents))
+            top_logits, top_indices = torch.topk(logits, k=k)
+            # 只对选出的 k 个结果换算成 "yes" 的概率，对外的分数含义不变
+            top_scores = torch.sigmoid(top_logits)
+            top_scores, top_indices = top_scores.cpu().tolist(), top_indices.cpu().tolist()
+
+        scored_documents = [
+            (documents[idx], score) for idx, score in zip(top_indices, top_scores)
+        ]
+
+        # 热路径日志降为 DEBUG 并延迟格式化：没有 sink 接收 DEBUG 时不会构造字符串
+        logger.opt(lazy=True).debug(
+            "对 {} 个文档块进行了 Rerank，查询: '{}...'", lambda: len(documents), lambda: query[:50]
         )
-
-        logger.info(f"对 {len(documents)} 个文档块进行了 Rerank，查询: '{query[:50]}...'")
         return scored_documents
     except Exception as e:
         logger.error(f"使用 Reranker 对文档块进行重排序时发生错误: {e}", exc_info=True)
         raise  # 重新抛出异常
 
+
+def prepare_rerank_query(query: str, task_instruction: str = None) -> None:
+    """
+    提前计算查询的共享前缀 KV 缓存 (写入 _encode_shared_prefix 的 LRU 缓存)。
+    在候选文档还未取回时调用，随后的 rerank_documents 只需计算文档部分。
+    """
+    if not query:
+        return
+    try:
+        _load_reranker_model()
+    except RuntimeError:
+        return  # 模型不可用时由 rerank_documents 负责降级
+    with torch.inference_mode(), _reranker_stream_context(), _reranker_autocast_context():
+        _encode_shared_prefix(_format_shared_prefix(query, task_instruction))
+
+
+async def prepare_rerank_query_async(query: str, task_instruction: str = None) -> None:
+    """prepare_rerank_query 的异步版本，在模型推理线程池中执行；只是预取，失败时记录警告而不抛出。"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(GPU_POOL, prepare_rerank_query, query, task_instruction)
+    except Exception as e:
+        logger.warning(f"预先计算 Reranker 查询前缀失败，将在精排时重新计算: {e}")
+
+
+async def rerank_documents_async(query: str, documents: list[TextChunkResponse], task_instruction: str = None,
+                                 top_n: int | None = None, batch_size: int | None = None
+                                 ) -> list[tuple[TextChunkResponse, float]]:
+    """
+    rerank_documents 的异步版本：在模型推理线程池中执行，每个并发请求从流池借用独立的 CUDA 流，
+    事件循环不被阻塞，多个请求的 GPU 工作可以重叠。参数与返回值同 rerank_documents。
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        GPU_POOL, rerank_documents, query, documents, task_instruction, top_n, batch_size
+    )
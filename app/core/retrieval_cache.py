@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+"""
+@File ：retrieval_cache.py
+@IDE ：PyCharm
+@Author ：zhanzhicai
+@Date ：2025/11/24 10:20
+@DOC: 检索结果缓存：进程内带 TTL 的 LRU，重复或近似重复的查询不再经过向量检索、数据库和精排
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+from app.core.config import settings
+from app.schemas.schemas import TextChunkResponse
+
+
+class RetrievalCache:
+    """
+    检索结果缓存，两种查找方式：
+    - get: 按 (查询摘要, top_k) 精确匹配，命中时连查询向量化也可以跳过；
+    - get_similar: 按查询向量匹配，与某个已缓存查询的余弦相似度不低于阈值即视为同一问题。
+
+    查询向量按槽位存放在一个预分配的矩阵中，语义查找只需一次矩阵-向量乘，不必每次重新堆叠。
+    文档变为可检索或被删除时调用 invalidate() 使代数加一并清空缓存。
+    代数只在本进程内有效，其他进程 (如 Celery worker) 中的文档变化最迟在 TTL 后可见。
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: int, similarity_threshold: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._generation = 0
+        # (查询摘要, top_k) -> 槽位，按最近使用顺序排列
+        self._entries: OrderedDict[tuple[bytes, int], int] = OrderedDict()
+        self._free_slots = list(range(max_size))
+        # 各槽位的数据
+        self._slot_keys: list[tuple[bytes, int] | None] = [None] * max_size
+        self._slot_chunks: list[list[TextChunkResponse] | None] = [None] * max_size
+        self._slot_expires = np.zeros(max_size, dtype=np.float64)
+        self._slot_top_k = np.full(max_size, -1, dtype=np.int64)  # -1 表示空槽位
+        self._slot_has_embedding = np.zeros(max_size, dtype=bool)
+        self._embeddings: np.ndarray | None = None  # 形状 (max_size, H)，首次写入查询向量时分配
+
+    @property
+    def generation(self) -> int:
+        """当前代数。检索开始前读取，写回时传给 put，检索期间发生失效的结果不会被缓存。"""
+        return self._generation
+
+    @staticmethod
+    def _key(query_text: str, top_k: int) -> tuple[bytes, int]:
+        return hashlib.blake2b(query_text.encode("utf-8"), digest_size=16).digest(), top_k
+
+    def _free(self, slot: int) -> None:
+        """释放槽位 (需持有锁)。"""
+        self._slot_keys[slot] = None
+        self._slot_chunks[slot] = None
+        self._slot_top_k[slot] = -1
+        self._slot_has_embedding[slot] = False
+        self._free_slots.append(slot)
+
+    def _hit(self, slot: int) -> list[TextChunkResponse]:
+        """标记槽位为最近使用并返回结果的副本 (需持有锁)，调用方修改列表不影响缓存。"""
+        self._entries.move_to_end(self._slot_keys[slot])
+        return list(self._slot_chunks[slot])
+
+    def get(self, query_text: str, top_k: int) -> list[TextChunkResponse] | None:
+        """按查询文本精确查找。"""
+        if not settings.RETRIEVAL_CACHE_ENABLED:
+            return None
+        key = self._key(query_text, top_k)
+        with self._lock:
+            slot = self._entries.get(key)
+            if slot is None:
+                return None
+            if self._slot_expires[slot] < time.monotonic():
+                del self._entries[key]
+                self._free(slot)
+                return None
+            return self._hit(slot)
+
+    def get_similar(self, query_embedding: np.ndarray, top_k: int) -> list[TextChunkResponse] | None:
+        """
+        按查询向量查找：取 top_k 相同、未过期的条目中余弦相似度最高的一个，不低于阈值时命中。
+        :param query_embedding: L2 归一化后的查询向量，点积即余弦相似度
+        """
+        if not settings.RETRIEVAL_CACHE_ENABLED or self.similarity_threshold <= 0:
+            return None
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != query_embedding.shape[-1]:
+                return None
+            candidates = (
+                self._slot_has_embedding
+                & (self._slot_top_k == top_k)
+                & (self._slot_expires >= time.monotonic())
+            )
+            if not candidates.any():
+                return None
+            similarities = self._embeddings @ query_embedding.astype(np.float32, copy=False)
+            similarities[~candidates] = -np.inf
+            slot = int(similarities.argmax())
+            if similarities[slot] < self.similarity_threshold:
+                return None
+            logger.debug(f"检索结果缓存语义命中，相似度 {similarities[slot]:.4f}")
+            return self._hit(slot)
+
+    def put(self, query_text: str, top_k: int, chunks: list[TextChunkResponse], generation: int,
+            query_embedding: np.ndarray | None = None) -> None:
+        """
+        写入一条检索结果。
+        :param generation: 检索开始前读取的代数，与当前代数不同时说明检索期间知识库发生了变化，结果不写入
+        :param query_embedding: L2 归一化后的查询向量，提供时该条目也参与语义查找
+        """
+        if not settings.RETRIEVAL_CACHE_ENABLED:
+            return
+        key = self._key(query_text, top_k)
+        with self._lock:
+            if generation != self._generation:
+                return
+            slot = self._entries.pop(key, None)
+            if slot is None:
+                if not self._free_slots:
+                    # 淘汰最久未使用的条目
+                    _, evicted_slot = self._entries.popitem(last=False)
+                    self._free(evicted_slot)
+                slot = self._free_slots.pop()
+            self._entries[key] = slot
+            self._slot_keys[slot] = key
+            self._slot_chunks[slot] = list(chunks)
+            self._slot_expires[slot] = time.monotonic() + self.ttl_seconds
+            self._slot_top_k[slot] = top_k
+            self._slot_has_embedding[slot] = False
+            if query_embedding is not None:
+                if self._embeddings is None or self._embeddings.shape[1] != query_embedding.shape[-1]:
+                    # 首次写入 (或模型维度变化) 时按向量维度分配矩阵
+                    self._embeddings = np.zeros((self.max_size, query_embedding.shape[-1]), dtype=np.float32)
+                    self._slot_has_embedding[:] = False
+                self._embeddings[slot] = query_embedding
+                self._slot_has_embedding[slot] = True
+
+    def invalidate(self) -> None:
+        """知识库内容变化时调用，使所有已缓存的检索结果失效。"""
+        with self._lock:
+            self._generation += 1
+            for slot in self._entries.values():
+                self._free(slot)
+            self._entries.clear()
+        logger.debug("检索结果缓存已失效")
+
+
+# 全局检索结果缓存实例
+retrieval_cache = RetrievalCache(
+    max_size=settings.RETRIEVAL_CACHE_SIZE,
+    ttl_seconds=settings.RETRIEVAL_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.RETRIEVAL_CACHE_SIMILARITY,
+)
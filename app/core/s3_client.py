@@ -11,6 +11,8 @@
 MinIO是一个与Amazon S3 API兼容的对象存储服务。
 """
 
+import threading
+
 from botocore.exceptions import ClientError # 导入MinIO客户端异常类，用于处理S3操作中的错误
 # 导入boto3库，AWS SDK for Python，用于操作MinIO
 import boto3
@@ -25,8 +27,11 @@ from botocore.client import Config
 
 
 
+# 全局 boto3 会话，共享凭证与配置；由会话创建的客户端各自维护线程安全的 HTTP 连接池
+s3_session = boto3.session.Session()
+
 # 创建全局S3客户端实例，用于MinIO对象存储操作
-s3_client = boto3.client(
+s3_client = s3_session.client(
     's3',  # 指定服务类型为S3
     # 构建MinIO服务端点URL，根据SSL配置选择HTTP或HTTPS协议
     endpoint_url=f"{'https' if settings.MINIO_USE_SSL else 'http'}://{settings.MINIO_ENDPOINT}",
@@ -34,18 +39,71 @@ s3_client = boto3.client(
     aws_access_key_id=settings.MINIO_ACCESS_KEY,
     # AWS秘密访问密钥，用于身份验证
     aws_secret_access_key=settings.MINIO_SECRET_KEY,
-    # 配置S3签名版本，使用AWS签名版本4
-    config=Config(signature_version='s3v4'),
+    # 配置S3签名版本 (AWS签名版本4) 与连接池
+    config=Config(
+        signature_version='s3v4',
+        # 默认连接池只有 10 个连接，并发上传/下载超出后会反复新建连接
+        max_pool_connections=64,
+        tcp_keepalive=True,  # 保持空闲连接，避免被中间网络设备断开后重连
+        retries={'max_attempts': 3, 'mode': 'adaptive'},  # 自适应重试，被限流时客户端自动降速
+        connect_timeout=3,
+        read_timeout=30,
+    ),
     # 设置AWS区域，MinIO通常使用us-east-1
     region_name='us-east-1'
 )
 
+# 已知存在的存储桶名称集合，首次调用 ensure_minio_bucket_exists 时通过 list_buckets 填充
+_bucket_cache: set[str] | None = None
+# list_buckets 需要 ListAllMyBuckets 权限；被拒绝时改为逐个 head_bucket 检查
+_list_buckets_denied = False
+# 保护 _bucket_cache 的锁，启动时多个线程可能同时检查存储桶
+_bucket_lock = threading.Lock()
+
+
+def _error_code(e: ClientError) -> str:
+    """获取 ClientError 响应中的错误代码"""
+    return e.response.get('Error', {}).get('Code', 'UnknownError')
+
+
+def _bucket_exists(bucket_name: str) -> bool:
+    """检查存储桶是否存在，调用方需持有 _bucket_lock"""
+    global _bucket_cache, _list_buckets_denied
+    if _bucket_cache is None:
+        _bucket_cache = set()
+        try:
+            # 一次请求拿到全部存储桶，代替每个存储桶一次 head_bucket
+            response = s3_client.list_buckets()
+            _bucket_cache.update(bucket["Name"] for bucket in response.get("Buckets", []))
+        except ClientError as e:
+            if _error_code(e) not in ("403", "AccessDenied"):
+                _bucket_cache = None
+                raise
+            # 只授予了存储桶级权限的凭证无法列出存储桶，退回 head_bucket
+            logger.info("No permission to list buckets, falling back to head_bucket")
+            _list_buckets_denied = True
+    if bucket_name in _bucket_cache:
+        return True
+    if not _list_buckets_denied:
+        return False
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+    except ClientError as e:
+        if _error_code(e) in ("404", "NoSuchBucket", "NotFound"):
+            return False
+        raise
+    _bucket_cache.add(bucket_name)
+    return True
+
+
 def ensure_minio_bucket_exists(bucket_name: str):
     """
     确保指定的MinIO存储桶存在
 
     检查存储桶是否存在，如果不存在则创建该存储桶。
     通常在应用启动时调用，确保必要的存储桶已经创建。
+    存储桶列表只在首次调用时通过一次 list_buckets 获取，之后在内存中检查；
+    凭证没有 ListAllMyBuckets 权限时退回逐个 head_bucket 检查。
 
     Args:
         bucket_name (str): 存储桶名称
@@ -65,41 +123,44 @@ def ensure_minio_bucket_exists(bucket_name: str):
         - MINIO_USE_SSL: 是否使用SSL
     """
     # 实现存储桶检查和创建逻辑的具体步骤：
-    # 1. 尝试检查存储桶是否存在
-    # 2. 根据错误类型进行相应处理
-    # 3. 如果不存在则创建存储桶
+    # 1. 首次调用时用一次 list_buckets 获取全部存储桶并缓存（无权限时改用 head_bucket）
+    # 2. 在缓存中检查存储桶是否存在
+    # 3. 如果不存在则创建存储桶并加入缓存
     # 4. 处理权限和其他异常情况
-    try:
-        # 尝试获取存储桶头部信息，检查存储桶是否存在
-        s3_client.head_bucket(Bucket=bucket_name)
-        # 存储桶存在，记录信息日志
-        logger.info(f"Bucket {bucket_name} exists")
-    except ClientError as e:
-        # 获取错误响应中的错误代码，用于判断具体的错误类型
-        err_code = e.response.get('Error', {}).get('Code','UnknownError')
-        # 使用模式匹配处理不同的错误代码
-        match err_code:
-            case "404":
-                # 错误代码404表示存储桶不存在
-                logger.info(f"Bucket {bucket_name} does not exist")
-                try:
-                    # 尝试创建新的存储桶
-                    s3_client.create_bucket(Bucket=bucket_name)
-                    # 存储桶创建成功，记录信息日志
-                    logger.info(f"Bucket {bucket_name} created")
-                except ClientError as create_error:
-                    # 创建存储桶时发生错误，记录错误日志并重新抛出异常
-                    logger.error(f"Failed to create bucket '{bucket_name}': {str(create_error)}")
-                    raise  # 重新抛出创建异常
-            case "403":
-                # 错误代码403表示权限不足，无法访问存储桶
-                logger.info(f"Bucket {bucket_name} does not exist")
-                # 抛出自定义的权限异常
-                raise ForbiddenException("Permission denied to upload file")
-            case _:
-                # 处理其他未预期的错误代码
-                logger.error(f"Unexpected error checking bucket '{bucket_name}': {str(e)}")
-                raise  # 重新抛出未预期的异常
+    with _bucket_lock:
+        try:
+            if _bucket_exists(bucket_name):
+                # 存储桶存在，记录信息日志
+                logger.info(f"Bucket {bucket_name} exists")
+                return
+            # 存储桶不存在
+            logger.info(f"Bucket {bucket_name} does not exist")
+            s3_client.create_bucket(Bucket=bucket_name)
+            # 存储桶创建成功，记录信息日志
+            logger.info(f"Bucket {bucket_name} created")
+            _bucket_cache.add(bucket_name)
+        except ClientError as e:
+            # 获取错误响应中的错误代码，用于判断具体的错误类型
+            err_code = _error_code(e)
+            # 使用模式匹配处理不同的错误代码
+            match err_code:
+                case "BucketAlreadyOwnedByYou":
+                    # 自己的其他进程已抢先创建，视为存在
+                    logger.info(f"Bucket {bucket_name} exists")
+                    _bucket_cache.add(bucket_name)
+                case "BucketAlreadyExists":
+                    # 存储桶名称已被其他账号占用，本应用无法使用
+                    logger.error(f"Bucket name '{bucket_name}' is already taken by another owner: {str(e)}")
+                    raise
+                case "403" | "AccessDenied":
+                    # 权限不足，无法访问存储桶
+                    logger.error(f"Permission denied for bucket '{bucket_name}': {str(e)}")
+                    # 抛出自定义的权限异常
+                    raise ForbiddenException("Permission denied to upload file")
+                case _:
+                    # 处理其他未预期的错误代码
+                    logger.error(f"Unexpected error ensuring bucket '{bucket_name}': {str(e)}")
+                    raise  # 重新抛出未预期的异常
 
 
 class S3Client(object):
@@ -6,20 +6,22 @@
 @Date ：2025/10/29 17:31
 @DOC: 
 """
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 import asyncio
 import uvicorn
-import gradio as gr
 from fastapi import FastAPI,Response
 from starlette.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
 from app.core.database import initialize_database_for_fastapi, close_database_for_fastapi
 from app.core.s3_client import ensure_minio_bucket_exists
+from app.core.model_preload import preload_models
+from app.core.executors import shutdown_executors
 from app.utils.migrations import run_migrations
 from app.source_doc.routes import router as source_doc_router
 from app.query.routes import router as query_router
-from app.ui.gradio_interface import rag_demo_ui
+from app.query.service import QueryService
 from app.core.celery_app import celery_app  # 导入Celery应用
 from app.celery.routes import router as celery_router  # 导入Celery监控路由
 
@@ -29,34 +31,49 @@ from app.core.logging import setup_logging
 # 配置日志系统
 setup_logging()
 logger.info("Logging configured completed.")
-run_migrations()
+# 数据库迁移由部署步骤 (scripts/migrate.py) 执行；仅在开发环境需要时于启动阶段自动迁移
+if settings.AUTO_CREATE_TABLES:
+    run_migrations()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # --- 应用启动阶段 ---
-    print("应用启动，开始并行加载所有资源...")
+    logger.info("应用启动，开始并行加载所有资源...")
     # 将所有同步的、耗时的启动任务都封装成一个可在事件循环中等待的对象
     # 这样可以防止它们阻塞主线程
-    startup_tasks = [
-        asyncio.to_thread(initialize_database_for_fastapi),
-        asyncio.to_thread(ensure_minio_bucket_exists, bucket_name=settings.MINIO_BUCKET),
-        # asyncio.to_thread(_load_embedding_model),
-        # asyncio.to_thread(_load_reranker_model),
-        # asyncio.to_thread(_load_llm_model)
-    ]
-
-    # 使用 asyncio.gather 来【并行】执行所有启动任务
-    # 这会比一个一个顺序执行要快得多
-    await asyncio.gather(*startup_tasks)
-
-    print("所有资源加载完毕，应用准备就绪。🚀")
+    # 启动任务使用独立的小线程池，不占用之后请求处理所用的线程池，启动完成即回收
+    loop = asyncio.get_running_loop()
+    startup_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup")
+    try:
+        startup_tasks = [
+            loop.run_in_executor(startup_executor, initialize_database_for_fastapi),
+            loop.run_in_executor(startup_executor, ensure_minio_bucket_exists, settings.MINIO_BUCKET),
+        ]
+        if settings.PRELOAD_MODELS_ON_STARTUP:
+            # 模型并行加载后预热 (内部加锁，避免与首次请求并发时重复加载)，首个用户请求不再承担加载和编译开销
+            startup_tasks.append(loop.run_in_executor(startup_executor, preload_models))
+
+        # 使用 asyncio.gather 来【并行】执行所有启动任务
+        # 这会比一个一个顺序执行要快得多
+        await asyncio.gather(*startup_tasks)
+    finally:
+        # 不用 with 语句：退出时的 shutdown(wait=True) 会在事件循环线程里阻塞等待，
+        # 某个启动任务失败时其余任务 (如模型加载) 可能仍在运行，放到线程中等待它们结束
+        await asyncio.to_thread(startup_executor.shutdown)
+
+    # 查询服务不持有请求级状态，创建一次供所有请求复用
+    app.state.query_service = QueryService()
+
+    logger.info("所有资源加载完毕，应用准备就绪。🚀")
     yield
     # --- 应用关闭阶段 ---
-    print("应用关闭，开始释放所有资源...")
+    logger.info("应用关闭，开始释放所有资源...")
     # 这里可以添加释放资源的代码，例如关闭数据库连接、释放模型内存等
     # 确保所有资源都被正确释放，防止内存泄漏
     await close_database_for_fastapi()
-    print("所有资源已释放，应用关闭。")
+    # 等待线程池中正在执行的推理完成可能需要数秒，放到线程中执行，不阻塞事件循环
+    await asyncio.to_thread(shutdown_executors)
+    logger.info("所有资源已释放，应用关闭。")
 
 # ... 你的 lifespan 和 FastAPI 实例定义 ...
 app = FastAPI(title=settings.app_name, version="0.1.0", lifespan=lifespan)
@@ -75,7 +92,12 @@ app.include_router(celery_router)  # 添加Celery监控路由
 # 挂载 Gradio 界面
 # vvv 关键的一行：将 Gradio 应用挂载到 FastAPI vvv
 # 这会在您的应用下创建一个 /gradio 路径，用于展示 UI 界面
-app = gr.mount_gradio_app(app, rag_demo_ui, path="/gradio")
+if settings.ENABLE_GRADIO_UI:
+    # 只在启用时导入 Gradio，关闭后不承担其导入开销
+    import gradio as gr
+    from app.ui.gradio_interface import rag_demo_ui
+
+    app = gr.mount_gradio_app(app, rag_demo_ui, path="/gradio")
 
 
 
@@ -17,15 +17,21 @@
 - MessageAuthor: 消息作者枚举，区分用户和AI消息
 """
 
-# 导入日期时间相关模块：datetime用于时间戳，timezone用于时区处理
-from datetime import datetime, timezone
+# 导入日期时间模块：datetime用于时间戳字段的类型注解
+from datetime import datetime
 # 导入Optional类型注解，用于可空字段
 from typing import Optional, List
 # 导入enum模块，用于创建枚举类
 import enum
 
-# 导入SQLAlchemy列类型：ForeignKey外键，Integer整数，String字符串，DateTime日期时间，Boolean布尔值，Text长文本，JSON JSON数据
-from sqlalchemy import ForeignKey, Integer, String, DateTime, Boolean, Text, JSON
+# 导入SQLAlchemy列类型：ForeignKey外键，Integer整数，String字符串，DateTime日期时间，Boolean布尔值，Text长文本
+from sqlalchemy import ForeignKey, Integer, String, DateTime, Boolean, Text
+# 导入SQLAlchemy索引类型，用于定义复合索引
+from sqlalchemy import Index
+# 导入SQL函数生成器，用于数据库端默认值 (如 now())
+from sqlalchemy import func
+# 导入PostgreSQL专用类型：JSONB二进制JSON（可建索引，读取时无需重新解析），ARRAY原生数组
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 # 导入SQLAlchemy枚举类型，用于数据库中的枚举字段
 from sqlalchemy import Enum as SQLAlchemyEnum
 # 导入SQLAlchemy ORM相关：Mapped类型注解，mapped_column列定义，relationship关系定义，DeclarativeBase声明基类
@@ -40,20 +46,30 @@ class Base(DeclarativeBase):
 
 # 日期时间混入类：为所有继承的模型提供统一的时间戳字段
 class DateTimeMixin:
+    # 时间戳由数据库生成，插入/更新后通过 RETURNING 取回，不必再额外 SELECT 刷新
+    __mapper_args__ = {"eager_defaults": True}
+
     # 创建时间字段：记录记录创建时的UTC时间
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),    # 指定时区为UTC的日期时间类型
         index=True,                 # 创建索引以提高按创建时间查询的性能
-        default=lambda: datetime.now(timezone.utc)  # 默认值为当前UTC时间
+        server_default=func.now()   # 由数据库填充当前时间，批量插入时不必在 Python 中逐行生成
     )
     # 更新时间字段：记录记录最后一次更新的UTC时间
     updated_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),    # 指定时区为UTC的日期时间类型
         index=True,                 # 创建索引以提高按更新时间查询的性能
-        default=lambda: datetime.now(timezone.utc),  # 默认值为当前UTC时间
-        onupdate=lambda: datetime.now(timezone.utc), # 更新记录时自动设置为当前UTC时间
+        server_default=func.now(),  # 由数据库填充当前时间
+        onupdate=func.now(),        # 更新记录时由数据库设置为当前时间
     )
 
+# 文档处理状态枚举：标识文档在RAG流程中的处理阶段
+class DocStatus(str, enum.Enum):
+    UPLOADED = "uploaded"      # 已上传
+    PROCESSING = "processing"  # 处理中
+    READY = "ready"            # 就绪
+    ERROR = "error"            # 错误
+
 # 源文档模型：存储上传到MinIO的文档信息
 class SourceDocument(Base, DateTimeMixin):
     __tablename__ = "source_documents"  # 指定数据库表名
@@ -63,7 +79,7 @@ class SourceDocument(Base, DateTimeMixin):
 
     # MinIO对象名称：在存储桶中的唯一标识符
     object_name: Mapped[str] = mapped_column(
-        String(512),        # 字符串类型，最大长度512（足够存储复杂的对象路径）
+        String(128),        # 字符串类型，最大长度128（documents/UUID.扩展名，唯一索引的键更短）
         nullable=False,     # 不允许为空
         unique=True,        # 唯一约束，确保对象名不重复
         index=True          # 创建索引以提高查询性能
@@ -96,9 +112,10 @@ class SourceDocument(Base, DateTimeMixin):
     # RAG 相关字段：
 
     # 文档处理状态：标识文档在RAG流程中的处理阶段
-    status: Mapped[str] = mapped_column(
-        String(50),         # 字符串类型，最大长度50
-        default="uploaded", # 默认值为"uploaded"（已上传）
+    status: Mapped[DocStatus] = mapped_column(
+        # PostgreSQL 原生枚举类型，每个值占 4 字节，索引键更小；库中存储小写的枚举值
+        SQLAlchemyEnum(DocStatus, name="doc_status", values_callable=lambda e: [m.value for m in e]),
+        default=DocStatus.UPLOADED,  # 默认值为"uploaded"（已上传）
         index=True          # 创建索引以提高按状态查询的性能
     )  # 可能的状态：uploaded（已上传）、processing（处理中）、ready（就绪）、error（错误）
 
@@ -128,6 +145,11 @@ class SourceDocument(Base, DateTimeMixin):
 # 文本块模型：存储文档分块后的文本内容，用于向量化存储和检索
 class TextChunk(Base, DateTimeMixin):
     __tablename__ = "text_chunks"  # 指定数据库表名
+    __table_args__ = (
+        # 复合索引：按文档过滤并按序号排序时可直接有序扫描索引，
+        # 最左列 source_document_id 同时覆盖单独按文档查询，无需再单独建索引
+        Index("ix_textchunk_doc_seq", "source_document_id", "sequence_in_document"),
+    )
 
     # 文本块ID：主键，自增整数
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -136,13 +158,22 @@ class TextChunk(Base, DateTimeMixin):
     source_document_id: Mapped[int] = mapped_column(
         ForeignKey("source_documents.id", ondelete="CASCADE"),  # 外键约束，文档删除时级联删除文本块
         nullable=False,     # 不允许为空（每个文本块必须属于一个文档）
-        index=True,         # 创建索引以提高按文档查询文本块的性能
-    )
+    )  # 按文档查询由复合索引 ix_textchunk_doc_seq 覆盖
 
     # 关系映射：文本块与源文档的多对一关系
     source_document: Mapped["SourceDocument"] = relationship(
         "SourceDocument",   # 关联的模型类名
-        back_populates="text_chunks"  # 反向关系属性名
+        back_populates="text_chunks",  # 反向关系属性名
+        # 禁止隐式懒加载：批量读取文本块时逐个访问会产生 N+1 查询 (异步会话下也无法懒加载)，
+        # 需要源文档信息时在查询中显式使用 selectinload(TextChunk.source_document)
+        lazy="raise",
+    )
+
+    # 源文档原始文件名：入库时从源文档冗余复制，展示引用来源时无需再关联 source_documents 表
+    source_original_filename: Mapped[str] = mapped_column(
+        String(255),        # 与 SourceDocument.original_filename 长度一致
+        nullable=False,     # 不允许为空
+        server_default="",  # 已有数据迁移时填充为空字符串
     )
 
     # 文本块内容：实际的文本内容，用于向量化
@@ -164,7 +195,7 @@ class TextChunk(Base, DateTimeMixin):
 
     # 其他元数据：可选的JSON格式元数据，存储额外的结构化信息
     metadata_json: Mapped[Optional[dict]] = mapped_column(
-        JSON,               # JSON类型，存储字典数据
+        JSONB,              # JSONB类型，存储字典数据，可按键建表达式索引 (如 metadata_json->>'section')
         nullable=True       # 允许为空（可选字段）
     )  # 例如：{'page': 5, 'section': 'Introduction', 'paragraph': 2}
 
@@ -179,6 +210,10 @@ class MessageAuthor(str, enum.Enum):
 # 消息模型：存储对话中的用户和AI消息
 class Message(Base, DateTimeMixin):
     __tablename__ = "messages"  # 指定数据库表名
+    __table_args__ = (
+        # GIN 索引：支持 "哪些回答引用了文本块 X" 的包含查询 (@> / && / ANY)，无需全表扫描
+        Index("ix_msg_retrieved_chunks_gin", "retrieved_chunk_ids", postgresql_using="gin"),
+    )
 
     # 消息ID：主键，自增整数
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
@@ -205,5 +240,5 @@ class Message(Base, DateTimeMixin):
     )  # 用于区分是用户输入还是AI回答
     content: Mapped[str] = mapped_column(Text, nullable=False)
     # 存储用于生成答案的上下文信息 (仅对 bot 消息有意义)
-    retrieved_chunk_ids: Mapped[Optional[List[int]]] = mapped_column(JSON, nullable=True)
+    retrieved_chunk_ids: Mapped[Optional[List[int]]] = mapped_column(ARRAY(Integer), nullable=True)
 
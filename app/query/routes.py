@@ -7,34 +7,57 @@
 @DOC: 
 """
 
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
+from typing import AsyncIterator
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database import get_db
 from loguru import logger
 from app.query.service import QueryService
 from app.schemas.schemas import TextChunkResponse
-from app.text_chunk.repository import TextChunkRepository
-from app.text_chunk.service import TextChunkService
 
-router = APIRouter(prefix="/query", tags=["Query & RAG"])
+# 路由默认使用 orjson 序列化响应
+router = APIRouter(prefix="/query", tags=["Query & RAG"], default_response_class=ORJSONResponse)
 
 
-# 依赖注入 QueryService
-def get_query_service(db: AsyncSession = Depends(get_db)) -> QueryService:
-    text_chunk_repo = TextChunkRepository(db)  # 初始化文本块仓库
-    text_chunk_service_instance = TextChunkService(text_chunk_repo)  # 初始化文本块服务
-    return QueryService(text_chunk_service=text_chunk_service_instance)  # 返回查询服务实例
+# 依赖注入 QueryService：返回应用启动时创建的单例，数据库会话通过 get_db 按请求注入
+def get_query_service(request: Request) -> QueryService:
+    return request.app.state.query_service
 
 
 class QueryRequest(BaseModel):
+    # 拒绝未知字段和超长查询，请求体不可变
+    model_config = ConfigDict(extra="forbid", frozen=True, str_max_length=4096)
+
     query: str
-    top_k: int = 5
+    top_k: int = Field(5, ge=1, le=100)  # 限制上限，避免一次请求拉取过多向量检索结果
+
+    @field_validator("query")
+    @classmethod
+    def _strip_query(cls, v: str) -> str:
+        # 空白查询直接返回 422，不进入向量化、向量检索和数据库查询
+        v = v.strip()
+        if not v:
+            raise ValueError("查询内容不能为空")
+        return v
 
 
 class AskQueryRequest(BaseModel):  # 用于接收问答请求
+    model_config = ConfigDict(extra="forbid", frozen=True, str_max_length=4096)
+
     query: str
+
+    @field_validator("query")
+    @classmethod
+    def _strip_query(cls, v: str) -> str:
+        v = v.strip()
+        if not v:
+            raise ValueError("查询内容不能为空")
+        return v
     # 可以添加 LLM 调用参数的可选字段，如果希望用户能控制
     # max_tokens: Optional[int] = 512
     # temperature: Optional[float] = 0.7
@@ -49,31 +72,37 @@ class AskQueryResponse(BaseModel):  # 用于返回问答结果
 @router.post("/retrieve-chunks", response_model=list[TextChunkResponse])
 async def retrieve_chunks_for_query(
         request_data: QueryRequest,  # 使用请求体,
-        query_service: QueryService = Depends(get_query_service), ):
+        query_service: QueryService = Depends(get_query_service),
+        db: AsyncSession = Depends(get_db), ):
     """
     根据用户查询，检索相关的文本块 (用于测试检索效果)。
     """
     try:
         relevant_chunks = await query_service.retrieve_relevant_chunks(
+            db,
             query_text=request_data.query,  # 用户查询文本
             top_k_final_reranked=request_data.top_k)  # 检索 top_k 个相关文本块
         if not relevant_chunks:
             # 可以返回空列表，或者根据业务需求抛出 404
             # raise HTTPException(status_code=404, detail="No relevant chunks found.")
-            logger.warning("未检索到相关文本块")
-            return []
-        return relevant_chunks
+            # 查询文本作为结构化字段绑定，不拼接进消息字符串
+            logger.bind(query=request_data.query[:64]).warning("未检索到相关文本块")
+            return ORJSONResponse(content=[])
+        # 直接返回 ORJSONResponse：跳过 FastAPI 按 response_model 对每一项的再次校验，并用 orjson 序列化
+        return ORJSONResponse(content=[chunk.model_dump(mode="json") for chunk in relevant_chunks])
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        logger.error(f"查询相关文本块时出错: {e}")
+        # 延迟格式化：只有日志真正被某个 sink 接收时才计算 repr(e)
+        logger.opt(lazy=True).error("查询相关文本块时出错: {}", lambda: repr(e))
         raise HTTPException(status_code=500, detail="Internal server error.")
 
 
 @router.post("/ask", response_model=AskQueryResponse)
 async def ask_llm_question(
         request_data: AskQueryRequest,
-        query_service: QueryService = Depends(get_query_service)
+        query_service: QueryService = Depends(get_query_service),
+        db: AsyncSession = Depends(get_db),
 ):
     """
     接收用户查询，执行 RAG 流程（检索上下文 + LLM 生成答案），并返回结果。
@@ -81,6 +110,7 @@ async def ask_llm_question(
     try:
         # 调用 QueryService 中新的问答方法
         result_dict = await query_service.generate_answer_from_query(
+            db,
             query_text=request_data.query
             # 如果 AskQueryRequest 中定义了llm参数，可以在这里传递
             # llm_max_tokens=request_data.max_tokens or 512,
@@ -93,12 +123,51 @@ async def ask_llm_question(
         return AskQueryResponse(**result_dict)
 
     except ValueError as ve:  # 例如向量化失败等在 service 中抛出的 ValueError
-        logger.error(f"处理问答请求时发生参数或逻辑错误: {ve}", exc_info=True)
+        # loguru 不识别 exc_info 参数，异常堆栈需通过 opt(exception=...) 附加
+        logger.opt(exception=ve).error("处理问答请求时发生参数或逻辑错误: {}", ve)
         raise HTTPException(status_code=400, detail=str(ve))
     except RuntimeError as re:  # 例如模型加载失败等在 service 中抛出的 RuntimeError
-        logger.error(f"处理问答请求时发生运行时错误: {re}", exc_info=True)
+        logger.opt(exception=re).error("处理问答请求时发生运行时错误: {}", re)
         raise HTTPException(status_code=500, detail=str(re))
 
     except Exception as e:  # 其他未知错误
-        logger.error(f"查询相关文本块时出错: {e}")
+        logger.opt(lazy=True).error("处理问答请求时出错: {}", lambda: repr(e))
+        raise HTTPException(status_code=500, detail="Internal server error.")
+
+
+async def _sse_events(pieces: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """把答案片段编码为 Server-Sent Events：每个片段一条 data 事件，结束时发送 done，出错时发送 error。"""
+    try:
+        async for piece in pieces:
+            yield b"data: " + orjson.dumps({"delta": piece}) + b"\n\n"
+    except Exception as e:
+        # 响应头已经发出，无法再改为 HTTP 错误码，以 error 事件通知客户端
+        logger.opt(lazy=True).error("流式生成答案时出错: {}", lambda: repr(e))
+        yield b"event: error\ndata: " + orjson.dumps({"detail": "Internal server error."}) + b"\n\n"
+        return
+    yield b"event: done\ndata: {}\n\n"
+
+
+@router.post("/ask/stream", response_class=StreamingResponse)
+async def ask_llm_question_stream(
+        request_data: AskQueryRequest,
+        query_service: QueryService = Depends(get_query_service),
+        db: AsyncSession = Depends(get_db),
+):
+    """
+    与 /ask 相同的 RAG 流程，但以 Server-Sent Events 逐段返回 LLM 生成的答案。
+    检索在响应开始前完成，检索阶段的错误仍以 HTTP 错误码返回。
+    """
+    try:
+        pieces = await query_service.stream_answer_from_query(db, query_text=request_data.query)
+    except ValueError as ve:
+        logger.opt(exception=ve).error("处理流式问答请求时发生参数或逻辑错误: {}", ve)
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        logger.opt(lazy=True).error("处理流式问答请求时出错: {}", lambda: repr(e))
         raise HTTPException(status_code=500, detail="Internal server error.")
+    return StreamingResponse(
+        _sse_events(pieces),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # 禁止代理缓冲，片段立即到达客户端
+    )
@@ -7,67 +7,98 @@
 @DOC: 
 """
 import asyncio
-from typing import Any
+import threading
+from typing import Any, AsyncIterator
 
+import numpy as np
 from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.core.chromadb_client import get_chroma_collection
-from app.core.embedding_qwen import get_embeddings
-from app.core.llm_service import generate_text_from_llm
-from app.core.reranker_qwen import rerank_documents
+from app.core.embedding_batcher import query_embedding_batcher
+from app.core.executors import CHROMA_POOL
+from app.core.llm_service import generate_text_stream
+from app.core.reranker_qwen import prepare_rerank_query_async, rerank_documents_async
+from app.core.retrieval_cache import retrieval_cache
 from app.schemas.schemas import TextChunkResponse
+from app.text_chunk.repository import TextChunkRepository
 from app.text_chunk.service import TextChunkService
 
 
+# 知识库中没有相关上下文时的固定回答，此时不调用 LLM
+NO_CONTEXT_ANSWER = "抱歉，我们的知识库中没有找到与您问题直接相关的信息。"
+
+# Prompt 模板的固定片段：导入时构建一次 (行首不带缩进)，每次请求只需一次 join 拼接上下文和问题
+_PROMPT_TMPL = (
+    "【指令】根据下面提供的上下文信息来回答用户提出的问题。\n"
+    "如果上下文中没有足够的信息来回答问题，请明确说明你无法从已知信息中找到答案，不要编造。\n"
+    "请使用中文回答。\n",
+    "【上下文】\n",
+    "\n【用户问题】\n",
+    "\n【回答】\n",
+)
+
+
 class QueryService:
-    def __init__(self, text_chunk_service: TextChunkService):
+    def __init__(self):
         """
         查询服务层，负责处理 RAG 检索逻辑。
-        :param text_chunk_service: 用于从 PostgreSQL 获取文本块的服务实例。
+        服务本身不持有请求级状态，在应用启动时创建一次并被所有请求复用；
+        数据库会话按请求传入各方法。
         """
-        self.text_chunk_service = text_chunk_service
+        # Embedding 模型通过导入的辅助函数按需加载；ChromaDB 集合句柄在首次检索时获取并保存在实例上
+        self._chroma_collection = None
+        self._chroma_collection_lock = threading.Lock()
 
-        # Embedding 模型和 ChromaDB 集合通过导入的辅助函数按需加载/获取
+    @property
+    def chroma_collection(self):
+        """ChromaDB 集合句柄，首次访问时获取，之后的检索直接复用，热路径上不再经过模块锁。"""
+        if self._chroma_collection is None:
+            with self._chroma_collection_lock:
+                if self._chroma_collection is None:
+                    self._chroma_collection = get_chroma_collection()
+        return self._chroma_collection
 
-    async def _embed_query_async(self, query_text: str) -> list[float]:
+    async def _embed_query_async(self, query_text: str) -> np.ndarray:
         """
-        异步包裹查询文本的向量化过程。
-        get_embeddings 是一个同步的、计算密集型函数。
-        :return: 查询文本的向量表示。
+        异步获取查询文本的向量表示。
+        并发到达的查询由 query_embedding_batcher 合并成一个批次，只做一次前向计算。
+        :return: 查询文本的向量表示 (float32 ndarray，直接交给 ChromaDB，不再转换为 Python 列表)。
         """
         logger.debug(f"开始为查询文本生成向量嵌入: '{query_text[:50]}...'")
         try:
-            # get_embeddings 期望一个文本列表和指令
-            # 它内部处理模型的加载、设备选择、分词、推理和归一化
-            embeddings_list = await asyncio.to_thread(
-                get_embeddings,  # 同步函数
-                [query_text],  # 作为单元素列表传入
-                task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
-                is_query=True,
-            )
-            if not embeddings_list:
+            # 批处理器内部在线程中调用 get_embeddings (检索指令 + is_query=True)，
+            # 模型的加载、设备选择、分词、推理和归一化都在其中完成
+            embedding = await query_embedding_batcher.submit(query_text)
+            if embedding is None or embedding.size == 0:
                 logger.error(f"查询文本 '{query_text}' 的向量化结果为空。")
                 raise ValueError("未能为查询生成向量嵌入。")
             logger.debug("查询文本向量嵌入生成完毕。")
-            return embeddings_list[0]  # 因为输入是单元素列表，返回也是单元素
+            # 统一为连续的一维 float32 数组：ChromaDB 客户端直接序列化，检索结果缓存的矩阵-向量乘也无需再拷贝转换
+            return np.ascontiguousarray(embedding, dtype=np.float32).reshape(-1)
         except Exception as e:
             logger.error(f"查询向量化失败: {e}", exc_info=True)
             # 可以选择重新抛出特定类型的异常或通用异常
             raise ValueError(f"查询向量化失败: {e}")
 
-    async def _search_vector_db_async(self, query_embedding: list[float], top_k: int) -> list[int]:
+    async def _search_vector_db_async(self, query_embedding: np.ndarray, top_k: int) -> list[TextChunkResponse]:
         """
-        异步包裹 ChromaDB 向量检索过程。返回检索到的文本块在 PostgreSQL 中的主键 ID 列表。
+        异步包裹 ChromaDB 向量检索过程。ChromaDB 中同时存有文本块内容和来源元数据，
+        直接用返回结果构造精排所需的候选文本块，不必为全部候选再查询一次 PostgreSQL。
+        候选只包含精排和展示需要的字段，完整记录在精排后由 _fetch_final_chunks 从数据库读取；
+        入库时未存储文本的旧向量，其候选的 chunk_text 为 None，由调用方从 PostgreSQL 补齐。
         :param query_embedding: 查询文本的向量表示。
         :param top_k: 返回的顶部 K 个结果。
-        :return: 与查询最相关的文本块 ID 列表。
+        :return: 按向量相似度排序的候选文本块列表。
         """
+        if top_k <= 0:
+            return []
         logger.debug(f"开始在 ChromaDB 中检索与查询向量最相关的 {top_k} 个文本块。")
 
         def _query_chroma_sync():
-            # get_chroma_collection 内部处理客户端和集合的获取/创建
+            # 集合句柄在服务实例上复用，首次访问时由 get_chroma_collection 处理客户端和集合的获取/创建
             # 并且已经配置了使用 'cosine' 相似度
-            chroma_collection = get_chroma_collection()
+            chroma_collection = self.chroma_collection
 
             # 执行查询
             # 我们期望 ChromaDB 中的 ID 就是 PostgreSQL 中 TextChunk 的 ID (字符串形式)
@@ -75,51 +106,135 @@ class QueryService:
                 query_embeddings=[query_embedding],  # 查询向量
                 n_results=top_k,
                 include=[
+                    "documents",
                     "metadatas",
                     "distances"
-                ]  # metadatas 可能包含 text_chunk_db_id，distances 用于调试或排序
+                ]  # documents 为文本块内容，metadatas 包含来源文档信息，distances 用于调试或排序
             )
             return results
 
         try:
-            results = await asyncio.to_thread(_query_chroma_sync)
-            retrieved_pg_ids: list[int] = []
+            results = await asyncio.get_running_loop().run_in_executor(CHROMA_POOL, _query_chroma_sync)
+            candidates: list[TextChunkResponse] = []
             if results and results.get("ids") and results["ids"][0]:
-                # results["ids"] 是一个列表的列表, 例如: [['id1', 'id2'], ...]
-                # 对于单个查询向量，我们关心 results["ids"][0]
+                # results 中每个字段都是列表的列表，对于单个查询向量，我们关心第 0 个
                 chroma_ids_str_list = results["ids"][0]
-                for str_id in chroma_ids_str_list:
-                    try:
-                        retrieved_pg_ids.append(int(str_id))
-                    except ValueError:
-                        logger.warning(f"无法将 ChromaDB 中检索到的 ID '{str_id}' 转换为整数。已跳过。")
-
-                # 你也可以选择从 metadatas 中提取 text_chunk_db_id (如果你存储了这个字段)
-                # 例如:
-                # if results.get("metadatas") and results["metadatas"][0]:
-                #     for metadata_item in results["metadatas"][0]:
-                #         db_id = metadata_item.get("text_chunk_db_id")
-                #         if db_id is not None:
-                #             retrieved_pg_ids.append(int(db_id))
-                # else:
-                #     logger.warning("ChromaDB 查询结果中未找到 metadatas 或 metadatas 为空。")
-
-            logger.info(f"从 ChromaDB 初步召回 |检索到 {len(retrieved_pg_ids)} 个文本块 ID: {retrieved_pg_ids}")
-            return retrieved_pg_ids
+                documents = (results.get("documents") or [None])[0] or [None] * len(chroma_ids_str_list)
+                metadatas = (results.get("metadatas") or [None])[0] or [None] * len(chroma_ids_str_list)
+                try:
+                    # 常见情况下所有 ID 都是合法整数，一次批量转换，不必逐个 try/except
+                    chunk_ids: list[int | None] = list(map(int, chroma_ids_str_list))
+                except ValueError:
+                    chunk_ids = [self._parse_chunk_id(str_id) for str_id in chroma_ids_str_list]
+                for chunk_id, document, metadata in zip(chunk_ids, documents, metadatas):
+                    if chunk_id is None:
+                        continue
+                    metadata = metadata or {}
+                    # 数据来自入库流程写入的向量库，跳过校验直接构造
+                    candidates.append(TextChunkResponse.model_construct(
+                        id=chunk_id,
+                        chunk_text=document,
+                        source_document_id=metadata.get("source_document_id"),
+                        source_original_filename=metadata.get("original_filename", ""),
+                        sequence_in_document=metadata.get("sequence", 0),
+                        metadata_json=None,
+                    ))
+
+            logger.opt(lazy=True).info(
+                "从 ChromaDB 初步召回 |检索到 {} 个文本块 ID: {}",
+                lambda: len(candidates), lambda: [c.id for c in candidates],
+            )
+            return candidates
         except Exception as e:
             logger.error(f"ChromaDB 向量检索失败: {e}", exc_info=True)
             raise ValueError(f"ChromaDB 向量检索失败: {e}")
 
+    @staticmethod
+    def _parse_chunk_id(str_id: str) -> int | None:
+        """将 ChromaDB ID 转换为 PostgreSQL 主键，无法转换时记录警告并返回 None。"""
+        try:
+            return int(str_id)
+        except ValueError:
+            logger.warning(f"无法将 ChromaDB 中检索到的 ID '{str_id}' 转换为整数。已跳过。")
+            return None
+
+    @staticmethod
+    async def _fill_missing_texts(
+            text_chunk_service: TextChunkService, candidates: list[TextChunkResponse]
+    ) -> list[TextChunkResponse]:
+        """为 ChromaDB 中没有存储文本的候选 (旧数据) 从 PostgreSQL 读取完整记录，数据库中已不存在的候选被丢弃。"""
+        missing_ids = [c.id for c in candidates if c.chunk_text is None]
+        if not missing_ids:
+            return candidates
+        logger.debug(f"{len(missing_ids)} 个候选文本块未在 ChromaDB 中存储文本，从 PostgreSQL 补齐。")
+        fetched = {c.id: c for c in await text_chunk_service.get_chunks_by_ids(chunk_ids=missing_ids)}
+        return [
+            c if c.chunk_text is not None else fetched[c.id]
+            for c in candidates
+            if c.chunk_text is not None or c.id in fetched
+        ]
+
+    @staticmethod
+    async def _fetch_final_chunks(
+            text_chunk_service: TextChunkService, chunks: list[TextChunkResponse]
+    ) -> list[TextChunkResponse]:
+        """
+        从 PostgreSQL 读取最终选中文本块的完整记录 (元数据、时间戳)，保持精排顺序。
+        只查询最终的 top_n 个而不是全部初步召回的候选；向量库中残留但数据库中已删除的文本块被丢弃。
+        """
+        fetched = {c.id: c for c in await text_chunk_service.get_chunks_by_ids(chunk_ids=[c.id for c in chunks])}
+        return [fetched[c.id] for c in chunks if c.id in fetched]
+
+    async def _fetch_candidates(
+            self, text_chunk_service: TextChunkService, query_embedding: np.ndarray
+    ) -> list[TextChunkResponse]:
+        """
+        检索精排的候选文本块：向量召回，并为未在 ChromaDB 中存储文本的候选从 PostgreSQL 补齐内容。
+        检索失败或没有候选时返回空列表。
+        """
+        try:
+            # 使用配置中定义的较大 top_k进行初步召回
+            candidate_chunks = await self._search_vector_db_async(query_embedding,
+                                                                  top_k=settings.INITIAL_RETRIEVAL_TOP_K)
+        except ValueError as e:
+            logger.error(f"ChromaDB 向量检索失败: {e}")
+            return []
+
+        if not candidate_chunks:
+            logger.info("ChromaDB 未检索到相关文本块。")
+            return []
+
+        try:
+            candidate_chunks = await self._fill_missing_texts(text_chunk_service, candidate_chunks)
+        except Exception as e:
+            logger.error(
+                f"从 PostgreSQL 补齐候选文本块内容时发生错误: {e}", exc_info=True
+            )
+            return []
+
+        if not candidate_chunks:
+            logger.info("未能获取候选文本块内容，尽管已召回ID。")
+        return candidate_chunks
+
     async def retrieve_relevant_chunks(
-            self, query_text: str, top_k_final_reranked: int = 5  # 默认检索最相关的5个块
+            self, db: AsyncSession, query_text: str, top_k_final_reranked: int = 5  # 默认检索最相关的5个块
     ) -> list[TextChunkResponse]:
         """
         为给定查询检索最相关的文本块。
         步骤:
         1. 将查询文本向量化。
-        2. 在向量数据库 (ChromaDB) 中搜索相关文本块的ID。
-        3. 使用这些ID从 PostgreSQL 中获取完整的文本块详情。
+        2. 在向量数据库 (ChromaDB) 中检索候选文本块，文本和来源信息随检索结果一起返回。
+        3. 对候选文本块进行精排。
+        4. 只为最终选中的文本块从 PostgreSQL 获取完整详情。
+        重复的查询直接返回检索结果缓存中的精排结果；近似重复的查询 (向量相似度不低于阈值) 在向量化后命中。
+        :param db: 当前请求的数据库会话，只用于查询文本块详情
         """
+        cached_chunks = retrieval_cache.get(query_text, top_k_final_reranked)
+        if cached_chunks is not None:
+            logger.info(f"查询 '{query_text[:100]}...' 命中检索结果缓存")
+            return cached_chunks
+        cache_generation = retrieval_cache.generation
+
         logger.info(f"开始为查询 '{query_text[:100]}...' 检索并精排文本块")
 
         # 1. 将查询文本向量化
@@ -129,94 +244,161 @@ class QueryService:
             logger.error(f"无法为查询生成向量: {e}")
             return []  # 或者可以向上抛出 HTTPException
 
-        # 2. 在向量数据库中搜索相关文本块的ID
-        try:
-            # 使用配置中定义的较大 top_k进行初步召回
-            candidate_chunk_pg_ids = await self._search_vector_db_async(query_embedding,
-                                                                        top_k=settings.INITIAL_RETRIEVAL_TOP_K)
-        except ValueError as e:
-            logger.error(f"ChromaDB 向量检索失败: {e}")
-            return []  # 或者可以向上抛出 HTTPException
+        # 措辞不同但语义几乎相同的查询，复用已缓存的精排结果，跳过向量检索、数据库查询和精排
+        cached_chunks = retrieval_cache.get_similar(query_embedding, top_k_final_reranked)
+        if cached_chunks is not None:
+            logger.info(f"查询 '{query_text[:100]}...' 语义命中检索结果缓存")
+            return cached_chunks
 
-        if not candidate_chunk_pg_ids:
-            logger.info("ChromaDB 未检索到相关文本块 ID。")
-            return []  # 或者可以向上抛出 HTTPException
+        # 精排的共享前缀 (指令 + 查询) 只依赖查询文本：在后台线程中提前计算它的 KV 缓存，
+        # 与下面的 ChromaDB 检索重叠，精排时只需计算各文档部分
+        prefix_task = asyncio.create_task(
+            prepare_rerank_query_async(query_text, settings.RERANKER_INSTRUCTION)
+        )
 
-        # 3. 使用这些ID从 PostgreSQL 中获取完整的文本块详情
+        # 2. 在向量数据库中检索候选文本块
+        text_chunk_service = TextChunkService(TextChunkRepository(db))
         try:
-            # text_chunk_service.get_chunks_by_ids 返回 List[TextChunkResponse]
-            candidate_chunks: list[TextChunkResponse] = await self.text_chunk_service.get_chunks_by_ids(
-                chunk_ids=candidate_chunk_pg_ids)
-            logger.info(f"成功从 PostgreSQL 检索到 {len(candidate_chunks)} 个相关文本块。")
-        except Exception as e:
-            logger.error(
-                f"从 PostgreSQL 获取候选文本块详情时发生错误: {e}", exc_info=True
-            )
-            return []
-
+            candidate_chunks = await self._fetch_candidates(text_chunk_service, query_embedding)
+        except BaseException:
+            prefix_task.cancel()  # 包括请求被取消 (客户端断开) 的情况
+            raise
         if not candidate_chunks:
-            logger.info("未能从数据库获取候选文本块内容，尽管已召回ID。")
-            return []
+            # 不会再精排：取消尚未开始的前缀计算，不让它继续占用推理线程和 CUDA 流
+            prefix_task.cancel()
+            return []  # 或者可以向上抛出 HTTPException
+
+        # 3. 精排
+        reranked = False
         try:
+            await prefix_task  # 通常已在向量检索期间完成
             logger.debug(f"开始对 {len(candidate_chunks)} 个候选块进行 Rerank...")
-            # rerank_documents 是同步的，CPU/GPU密集型，也需要放入线程
+            # rerank_documents_async 在线程中执行，并为本次请求借用独立的 CUDA 流
             reranked_results: list[
                 tuple[TextChunkResponse, float]
-            ] = await asyncio.to_thread(
-                rerank_documents,
+            ] = await rerank_documents_async(
                 query_text,
                 candidate_chunks,
                 settings.RERANKER_INSTRUCTION,
+                top_k_final_reranked,
             )
 
-            # 提取最终的 top_n 个文档块
+            # rerank_documents 已在设备上选出最终的 top_n 个文档块
             final_top_n_chunks: list[TextChunkResponse] = [
-                doc_response
-                for doc_response, score in reranked_results[:top_k_final_reranked]
+                doc_response for doc_response, score in reranked_results
             ]
+            reranked = True
             logger.info(f"Rerank 完成，最终选取 {len(final_top_n_chunks)} 个文本块。")
-            return final_top_n_chunks
-
         except ValueError as e:
             logger.error(f"Reranking 过程中发生错误: {e}", exc_info=True)
             # 如果 Rerank 失败，使用初步召回的结果作为降级方案
             logger.warning(f"Reranker 失败，使用初步召回的 top {top_k_final_reranked} 个结果")
             final_top_n_chunks = candidate_chunks[:top_k_final_reranked]
+
+        # 4. 只为最终选中的文本块从 PostgreSQL 获取完整详情
+        try:
+            final_top_n_chunks = await self._fetch_final_chunks(text_chunk_service, final_top_n_chunks)
+            logger.info(f"成功从 PostgreSQL 获取 {len(final_top_n_chunks)} 个最终文本块的详情。")
+        except Exception as e:
+            logger.error(
+                f"从 PostgreSQL 获取最终文本块详情时发生错误: {e}", exc_info=True
+            )
+            return []
+
+        if reranked:
+            # 只缓存完整精排的结果，降级结果不缓存
+            retrieval_cache.put(
+                query_text, top_k_final_reranked, final_top_n_chunks, cache_generation, query_embedding
+            )
+        else:
             logger.info(f"降级方案完成，返回 {len(final_top_n_chunks)} 个文本块。")
-            return final_top_n_chunks
+        return final_top_n_chunks
+
+    async def _retrieve_and_format(
+            self, db: AsyncSession, query_text: str, top_k: int
+    ) -> tuple[list[TextChunkResponse], list[str]]:
+        """
+        执行一次检索 + 精排，同时返回文本块对象和对应的纯文本列表。
+        需要两种形式的调用方共用这一次检索结果，不必为另一种形式重复走向量检索和精排。
+        :param db: 当前请求的数据库会话
+        :param query_text: 用户输入的查询文本
+        :param top_k: 精排后保留的文本块数量
+        :return: (精排后的文本块列表, 各文本块的内容列表)，两者顺序一致
+        """
+        # retrieve_relevant_chunks 方法内部已经包含了向量召回和 Reranker 精排的完整流程
+        chunks = await self.retrieve_relevant_chunks(db, query_text=query_text, top_k_final_reranked=top_k)
+        if not chunks:
+            logger.warning("未能检索到或精排出任何相关的文本块作为 LLM 上下文。")
+            return [], []
+        context_texts = [chunk.chunk_text for chunk in chunks]
+        logger.info(f"已为 LLM 准备了 {len(context_texts)} 段上下文文本。")
+        return chunks, context_texts
 
-    async def get_context_for_llm(self, query_text: str) -> list[str]:
+    async def get_context_for_llm(self, db: AsyncSession, query_text: str) -> list[str]:
         """
         获取为 LLM 准备的最终上下文文本列表。
-        内部会调用 retrieve_relevant_chunks 并使用 settings.FINAL_CONTEXT_TOP_N。
+        内部会调用 _retrieve_and_format 并使用 settings.FINAL_CONTEXT_TOP_N。
         :param self:
+        :param db: 当前请求的数据库会话
         :param query_text:
         :return:
         """
         logger.info(f"正在为查询 '{query_text[:100]}...' 获取 LLM 上下文...")
-        # 调用 retrieve_relevant_chunks，并传入系统配置的最终上下文数量
-        # retrieve_relevant_chunks 方法内部已经包含了向量召回和 Reranker 精排的完整流程
-        final_reranked_chunk_responses: list[
-            TextChunkResponse
-        ] = await self.retrieve_relevant_chunks(
-            query_text=query_text,
-            top_k_final_reranked=settings.FINAL_CONTEXT_TOP_N,  # 使用配置中为LLM准备的块数量
+        # 使用配置中为LLM准备的块数量
+        _, context_texts = await self._retrieve_and_format(db, query_text, settings.FINAL_CONTEXT_TOP_N)
+        return context_texts
+
+    @staticmethod
+    def _build_prompt(context_strings: list[str], query_text: str) -> str:
+        """用检索到的上下文和用户问题构建发给 LLM 的 Prompt。"""
+        context_block = (
+            "\n---\n".join(context_strings)
+            if context_strings
+            else "没有额外的上下文信息。"
         )
-        if not final_reranked_chunk_responses:
-            logger.warning("未能检索到或精排出任何相关的文本块作为 LLM 上下文。")
-            return []
+        prompt = "".join((
+            _PROMPT_TMPL[0], _PROMPT_TMPL[1], context_block, _PROMPT_TMPL[2], query_text, _PROMPT_TMPL[3]
+        ))
+        # 延迟求值：只有 DEBUG 日志真正输出时才截取 Prompt
+        logger.opt(lazy=True).debug("构建的 Prompt (部分内容):\n{}...", lambda: prompt[:500])
+        return prompt
 
-        # 提取纯文本内容
-        context_texts: list[str] = [
-            chunk.chunk_text for chunk in final_reranked_chunk_responses
-        ]
+    # --- 用于流式生成答案 ---
+    async def stream_answer_from_query(
+            self,
+            db: AsyncSession,
+            query_text: str,
+            llm_max_tokens: int = 512,  # LLM 最大生成 token 数
+            llm_temperature: float = 0.7,  # LLM 温度参数，控制生成的随机性
+            llm_top_p: float = 0.9,  # LLM top_p 参数，用于 nucleus sampling
+    ) -> AsyncIterator[str]:
+        """
+        检索上下文后返回 LLM 答案的异步片段迭代器，首个片段解码出来即可发送给用户。
+        检索在返回迭代器之前完成：数据库会话只在本次 await 期间使用，检索阶段的错误也在开始流式响应之前抛出。
+        参数含义同 generate_answer_from_query。
+        :return: 逐段产出答案文本的异步迭代器
+        """
+        logger.info(f"开始为查询流式生成答案: '{query_text[:100]}...'")
+        _, context_strings = await self._retrieve_and_format(db, query_text, settings.FINAL_CONTEXT_TOP_N)
+        if not context_strings:
+            logger.warning(f"未能为查询 '{query_text[:100]}...' 获取到上下文。")
 
-        logger.info(f"已为 LLM 准备了 {len(context_texts)} 段上下文文本。")
-        return context_texts
+            async def _no_context() -> AsyncIterator[str]:
+                yield NO_CONTEXT_ANSWER
+
+            return _no_context()
+        # 生成在工作线程中进行，片段经队列交给事件循环，等待期间不占用事件循环
+        return generate_text_stream(
+            prompt=self._build_prompt(context_strings, query_text),
+            max_new_tokens=llm_max_tokens,
+            temperature=llm_temperature,
+            top_p=llm_top_p,
+        )
 
     # --- 用于生成最终答案 ---
     async def generate_answer_from_query(
             self,
+            db: AsyncSession,
             query_text: str,
             # 可以从 Pydantic 请求模型中获取这些参数，或者使用默认值
             llm_max_tokens: int = 512,  # LLM 最大生成 token 数
@@ -226,6 +408,7 @@ class QueryService:
         """
         处理用户查询，检索上下文，并调用LLM生成答案。
         这个版本优化了错误处理和返回路径，确保数据结构的一致性。
+        :param db: 当前请求的数据库会话
         :param query_text: 用户输入的查询文本
         :param llm_max_tokens: LLM 最大生成 token 数
         :param llm_temperature: LLM 温度参数，控制生成的随机性
@@ -236,16 +419,13 @@ class QueryService:
         context_strings = []  # 初始化为空列表，保证变量存在
         answer_text = "抱歉，处理您的问题时发生了未知错误。"  # 设置默认错误答案
         try:
-            # 1. 从查询文本中获取上下文文本
-            context_strings: list[str] = await self.get_context_for_llm(query_text)
-            # 2. 如果找不到上下文，直接返回提示信息，不再调用 LLM
-            if not context_strings:
-                logger.warning("未获取到任何上下文文本，无法生成答案。")
+            # 1. 从查询文本中获取上下文文本 (检索与精排只执行一次)
+            _, context_strings = await self._retrieve_and_format(db, query_text, settings.FINAL_CONTEXT_TOP_N)
 
             # 2. 如果找不到上下文，直接返回提示信息，不再调用 LLM
             if not context_strings:
                 logger.warning(f"未能为查询 '{query_text[:100]}...' 获取到上下文。")
-                answer_text = "抱歉，我们的知识库中没有找到与您问题直接相关的信息。"
+                answer_text = NO_CONTEXT_ANSWER
                 # 直接构建并返回结果，确保数据结构完整
                 return {
                     "query": query_text,
@@ -253,31 +433,16 @@ class QueryService:
                     "retrieved_context_texts": [],  # 明确返回空列表
                 }
             # 3. 构建 Prompt
-            # 你需要精心设计你的 Prompt 模板
-            context_block = (
-                "\n---\n".join(context_strings)
-                if context_strings
-                else "没有额外的上下文信息。"
-            )
-
-            prompt = f"""【指令】根据下面提供的上下文信息来回答用户提出的问题。
-            如果上下文中没有足够的信息来回答问题，请明确说明你无法从已知信息中找到答案，不要编造。
-            请使用中文回答。
-            【上下文】
-            {context_block}
-            【用户问题】
-            {query_text}
-            【回答】
-            """
-            logger.debug(f"构建的 Prompt (部分内容):\n{prompt[:500]}...")
-            # 4. 调用 LLM 生成文本 (这是一个同步阻塞操作)
-            answer_text = await asyncio.to_thread(
-                generate_text_from_llm,  # 调用你 llm_service 中的函数
-                prompt=prompt,
-                max_new_tokens=llm_max_tokens,
-                temperature=llm_temperature,
-                top_p=llm_top_p,
-            )
+            prompt = self._build_prompt(context_strings, query_text)
+            # 4. 调用 LLM 流式生成文本并拼接：解码在工作线程中进行，片段经队列交回事件循环
+            answer_text = "".join([
+                piece async for piece in generate_text_stream(
+                    prompt=prompt,
+                    max_new_tokens=llm_max_tokens,
+                    temperature=llm_temperature,
+                    top_p=llm_top_p,
+                )
+            ])
             logger.info(f"LLM 成功为查询 '{query_text[:50]}...' 生成答案。")
 
         except Exception as e:
@@ -220,6 +220,7 @@ class TextChunkCreate(TextChunkBase):
         来准备将要存入数据库的数据。
         """
     source_document_id: int = Field(..., description="关联的源文档ID")
+    source_original_filename: str = Field("", description="源文档的原始文件名 (冗余存储，用于展示引用来源)")
     # chunk_text, sequence_in_document, metadata_json 继承自 TextChunkBase
 # TextChunkUpdate Pydantic Model 文本块更新模型
 class TextChunkUpdate(BaseSchema):
@@ -239,6 +240,7 @@ class TextChunkResponse(TextChunkBase):
     """
     id: int = Field(..., description="文本块的唯一ID")
     source_document_id: int = Field(..., description="关联的源文档ID")
+    source_original_filename: str = Field("", description="源文档的原始文件名")
     created_at: datetime = Field(..., description="记录创建时间")
     updated_at: datetime = Field(..., description="记录最后更新时间")
     # 如果需要，可以在这里添加关联的 SourceDocument 的摘要信息 (需要嵌套 Pydantic 模型)
@@ -32,6 +32,7 @@ from datetime import datetime, timedelta, timezone  # 日期时间处理
 from loguru import logger  # 日志记录器
 from app.core.config import settings  # 应用配置
 from app.core.s3_client import s3_client  # MinIO S3客户端
+from app.core.retrieval_cache import retrieval_cache  # 检索结果缓存，知识库变化时失效
 from app.core.exceptions import NotFoundException, ForbiddenException  # 自定义异常
 
 # 导入数据访问层
@@ -93,7 +94,7 @@ class SourceDocumentService:
         # ===== 2. 生成唯一的 object_name 对象名称（使用 UUID + 文件扩展名） =====
         # 从文件名中提取文件扩展名
         file_extension = (
-            original_filename.rsplit(".", 1)[-1] if "." in original_filename else ""  # 从右分割一次取最后一部分
+            original_filename.rsplit(".", 1)[-1][:16] if "." in original_filename else ""  # 从右分割一次取最后一部分，限制长度以适配 object_name 列
         )
         # 生成唯一的对象名称：documents/UUID.扩展名
         object_name = f"documents/{uuid.uuid4()}.{file_extension}"  # 使用UUID确保唯一性
@@ -241,6 +242,7 @@ class SourceDocumentService:
         )
         # 从数据库删除记录
         await self.repository.delete(document.id)  # 调用仓库删除方法
+        retrieval_cache.invalidate()  # 文档已删除，缓存的检索结果可能引用了它的文本块
         # 记录删除日志
         logger.info(f"Deleted document record {document_id} from database")  # 记录删除操作
 
@@ -397,6 +399,8 @@ class SourceDocumentService:
             )
             # 记录成功更新的日志
             logger.info(f"成功更新文档 ID: {document_id} 的处理信息")  # 记录操作成功信息
+            if status == "ready":  # 文档变为可检索，缓存的检索结果可能已不完整
+                retrieval_cache.invalidate()
             # 验证并转换为响应对象
             return SourceDocumentResponse.model_validate(updated_document)  # 模型验证转换
 
@@ -1,7 +1,7 @@
 from loguru import logger
 from asgiref.sync import async_to_sync
-import asyncio
 from app.core.celery_app import celery_app
+from app.core.database import get_celery_event_loop
 from app.tasks.utils.doc_process import _execute_document_processing_async
 from app.tasks.utils.query_process import execute_query_processing_async
 from app.core.enhanced_doc_processor import process_document_enhanced
@@ -19,8 +19,8 @@ def process_document_task(self, document_id: int):  # bind=True后，第一个
     一个健壮的 Celery 任务，用于安全地执行异步代码。
 
     它遵循以下模式：
-    1. 为每个任务创建一个全新的、隔离的事件循环。
-    2. 使用 try...finally 结构确保事件循环总是被关闭，防止资源泄露。
+    1. 复用当前 Worker 线程的长期事件循环，线程内的数据库连接池随之跨任务复用。
+    2. 事件循环不在任务结束时关闭，避免每个任务都重新建立数据库连接。
     3. 在 try...except 中处理业务逻辑异常，并记录日志。
 
     :param self: Celery 任务实例，用于访问任务元数据 (如任务 ID)
@@ -32,9 +32,8 @@ def process_document_task(self, document_id: int):  # bind=True后，第一个
         f"{task_id_log_prefix} 接收到文档 ID: {document_id}。开始设置异步环境。"
     )
 
-    # 1. 创建全新的事件循环，并设置为当前线程的循环
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    # 1. 获取当前 Worker 线程复用的事件循环 (数据库连接池绑定在该循环上)
+    loop = get_celery_event_loop()
 
     try:
         # 2. 将您原来的业务逻辑和异常处理放在这个 try 块中
@@ -54,11 +53,6 @@ def process_document_task(self, document_id: int):  # bind=True后，第一个
         #    如果不抛出，Celery 会认为任务成功了。
 
         raise
-    finally:
-        # 5. 关键步骤：这个 finally 块中的代码保证【总是】会执行。
-        #    无论 try 块是成功返回、还是发生异常，都会执行这里。
-        logger.info(f"{task_id_log_prefix} 开始清理异步环境，关闭事件循环。")
-        loop.close()
 
 
 @celery_app.task(
@@ -78,9 +72,8 @@ def process_document_enhanced_task(self, document_id: int):
         f"{task_id_log_prefix} 接收到文档 ID: {document_id}。使用增强处理器处理。"
     )
 
-    # 1. 创建全新的事件循环，并设置为当前线程的循环
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    # 1. 获取当前 Worker 线程复用的事件循环 (数据库连接池绑定在该循环上)
+    loop = get_celery_event_loop()
 
     try:
         # 2. 使用增强的文档处理器
@@ -96,10 +89,6 @@ def process_document_enhanced_task(self, document_id: int):
         )
         # 重新抛出异常，这对于 Celery 至关重要
         raise
-    finally:
-        # 5. 关键步骤：这个 finally 块中的代码保证【总是】会执行
-        logger.info(f"{task_id_log_prefix} 开始清理异步环境，关闭事件循环。")
-        loop.close()
 
 
 @celery_app.task(name="app.tasks.document_task.process_query_task", bind=True)
@@ -109,8 +98,7 @@ def process_query_task(self, message: dict):
     query_text = message.get("query_text")
     top_k_final_reranked = message.get("top_k_final_reranked")
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    loop = get_celery_event_loop()
 
     logger.info(f"{task_id_log_prefix} (Sync Entry) 接收到查询请求: '{query_text}', top_k: {top_k_final_reranked}")
 
@@ -139,8 +127,3 @@ def process_query_task(self, message: dict):
             exc_info=True
         )
         raise
-    finally:
-        # 5. 关键步骤：这个 finally 块中的代码保证【总是】会执行。
-        #    无论 try 块是成功返回、还是发生异常，都会执行这里。
-        logger.info(f"{task_id_log_prefix} 开始清理异步环境，关闭事件循环。")
-        loop.close()
@@ -13,24 +13,24 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from app.core.config import settings
 from app.core.s3_client import s3_client
-from app.core.database import create_engine_and_session_for_celery
-from app.core.embedding_qwen import get_embeddings
+from app.core.database import get_celery_engine_and_session
+from app.core.embedding_cache import embedding_cache
 from app.core.chromadb_client import get_chroma_collection
 from app.source_doc.repository import SourceDocumentRepository
 from app.source_doc.service import SourceDocumentService
 from app.text_chunk.repository import TextChunkRepository
 from app.text_chunk.service import TextChunkService
 from app.models.models import TextChunk
-from app.schemas.schemas import SourceDocumentResponse, TextChunkCreate
+from app.schemas.schemas import SourceDocumentResponse
 from app.tasks.utils.doc_parser import parse_and_clean_document
 
 # --- 异步业务逻辑核心 ---
 async def _execute_document_processing_async(
         document_id: int, task_id_for_log: str
 ):
-    # 1. 延迟初始化：在函数开始时，为本次任务创建专属的数据库引擎和会话工厂
-    #    它们会自动绑定到由 Celery 任务创建的那个全新的事件循环上。
-    db_engine, SessionLocal = create_engine_and_session_for_celery()
+    # 1. 获取当前 Worker 线程复用的数据库会话工厂
+    #    引擎绑定在该线程的长期事件循环上，同一线程内的后续任务继续复用连接池。
+    _, SessionLocal = get_celery_engine_and_session()
 
     logger.info(
         f"{task_id_for_log} (Async Logic) 开始处理文档 ID: {document_id}"
@@ -182,9 +182,10 @@ async def _execute_document_processing_async(
             # ==================================================================
             created_chunk_db_objects: list[TextChunk] = []  # 用于存储返回的 ORM 对象
             if chunks_texts_list:
-                chunks_to_create: list[TextChunkCreate] = []
+                # 直接准备普通字典，交给仓库按批次多行 INSERT，省去逐条构造 Pydantic/ORM 对象
+                chunks_to_create: list[dict] = []
                 for i, chunk_text_content in enumerate(chunks_texts_list):
-                    # 准备 Pydantic 模型数据
+                    # 准备文本块数据
                     # 你可以在这里为 metadata_json 添加更多信息，例如如果解析时得到了页码
                     chunk_meta = {"parsed_by": "default_parser_v1"}
                     if (
@@ -194,12 +195,13 @@ async def _execute_document_processing_async(
                         pass
 
                     chunks_to_create.append(
-                        TextChunkCreate(
-                            source_document_id=document_response.id,
-                            chunk_text=chunk_text_content,
-                            sequence_in_document=i,
-                            metadata_json=chunk_meta,
-                        )
+                        {
+                            "source_document_id": document_response.id,
+                            "source_original_filename": document_response.original_filename,
+                            "chunk_text": chunk_text_content,
+                            "sequence_in_document": i,
+                            "metadata_json": chunk_meta,
+                        }
                     )
 
                 try:
@@ -256,14 +258,13 @@ async def _execute_document_processing_async(
                     )
 
                     try:
-                        # 将同步的 embedding 操作放到线程中执行，避免阻塞事件循环
-                        batch_embeddings = await asyncio.to_thread(
-                            get_embeddings,
+                        # 先查向量缓存，重复的文本块 (如重新处理同一文档) 不再进入模型
+                        batch_embeddings = await embedding_cache.get_or_compute(
                             batch_texts,
                             task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
                             is_query=False,  # 文档嵌入，不是查询嵌入
                         )
-                        all_embeddings.extend(batch_embeddings)
+                        all_embeddings.extend(batch_embeddings)  # 逐行 float32 ndarray，ChromaDB 客户端直接接收
 
                         logger.info(
                             f"{task_id_for_log} (Async Logic) 批次 {batch_num} 完成，生成 {len(batch_embeddings)} 个向量。"
@@ -306,8 +307,8 @@ async def _execute_document_processing_async(
                         }
                         for chunk in created_chunk_db_objects
                     ]
-                    # 有些向量数据库也允许存储文档本身，ChromaDB 也支持
-                    # chroma_documents_text = texts_to_embed
+                    # 同时存储文本块内容：在线检索时随向量一起返回，精排前不必再查询 PostgreSQL
+                    chroma_documents_text = texts_to_embed
 
                     try:
                         logger.info(
@@ -323,7 +324,7 @@ async def _execute_document_processing_async(
                             ids=chroma_chunk_ids,
                             embeddings=embeddings_list,
                             metadatas=chroma_metadatas,
-                            # documents=chroma_documents_text # 可选
+                            documents=chroma_documents_text,
                         )
                         logger.info(
                             f"{task_id_for_log} (Async Logic) 成功将 {len(chroma_chunk_ids)} 个向量存入 ChromaDB。"
@@ -390,9 +391,3 @@ async def _execute_document_processing_async(
                         exc_info=True,
                     )
         raise e  # 将异常向上抛给 asyncio.run()，再由同步任务的 except 块处理
-    finally:
-        # 最终清理
-        # 无论成功还是失败，最后都要关闭数据库引擎的连接池
-        logger.info(f"{task_id_for_log} (Async Logic) 关闭数据库连接池...")
-        await db_engine.dispose()
-        logger.info(f"{task_id_for_log} (Async Logic) 异步资源清理完毕。")
@@ -8,15 +8,17 @@
 """
 import asyncio
 
+import numpy as np
+
 from loguru import logger
 
 
 # --- 核心和工具类导入 ---
 from app.core.config import settings
-from app.core.embedding_qwen import get_embeddings
+from app.core.embedding_qwen import aget_embeddings
 from app.core.chromadb_client import get_chroma_collection
-from app.core.reranker_qwen import rerank_documents # 假设你已创建 reranker.py 并定义了此函数
-from app.core.database import create_engine_and_session_for_celery # 用于创建数据库会话
+from app.core.reranker_qwen import rerank_documents_async
+from app.core.database import get_celery_engine_and_session # 用于获取数据库会话
 # --- 服务和仓库层导入 ---
 from app.text_chunk.service import TextChunkService
 from app.text_chunk.repository import TextChunkRepository
@@ -27,7 +29,7 @@ from app.text_chunk.repository import TextChunkRepository
 from app.schemas.schemas import TextChunkResponse
 
 
-async def _embed_query_for_processing(query_text: str) -> list[float]:
+async def _embed_query_for_processing(query_text: str) -> np.ndarray:
     """
     (内部辅助函数) 向量化查询文本。
     logger_instance 是从 Celery 任务传递过来的 logger。
@@ -36,22 +38,22 @@ async def _embed_query_for_processing(query_text: str) -> list[float]:
     """
     logger.debug(f"查询处理工具：开始为查询文本生成向量嵌入: '{query_text[:50]}...'")
     try:
-        embeddings_list = await asyncio.to_thread(
-            get_embeddings,
+        embeddings = await aget_embeddings(
             [query_text],
             task_description=settings.EMBEDDING_INSTRUCTION_FOR_RETRIEVAL,
+            is_query=True,
         )
-        if not embeddings_list:
+        if len(embeddings) == 0:
             logger.error(f"查询处理工具：查询文本 '{query_text}' 的向量化结果为空。")
             raise ValueError("未能为查询生成向量嵌入。")
         logger.debug("查询处理工具：查询文本向量嵌入生成完毕。")
-        return embeddings_list[0]
+        return embeddings[0]
     except Exception as e:
         logger.error(f"查询处理工具：查询向量化失败: {e}", exc_info=True)
         raise ValueError(f"查询向量化失败: {e}")
 
 async def _search_vector_db_for_processing(
-    query_embedding: list[float], initial_top_k: int,
+    query_embedding: np.ndarray, initial_top_k: int,
 ) -> list[int]:
     """
     (内部辅助函数) 在 ChromaDB 中进行初步向量召回。
@@ -96,7 +98,7 @@ async def execute_query_processing_async(
     包含数据库会话管理、服务实例化、查询向量化、向量召回、
     获取文本块、Rerank精排，并返回最终的文本块列表。
     """
-    db_engine, SessionLocal = create_engine_and_session_for_celery()
+    _, SessionLocal = get_celery_engine_and_session()
     logger.info(
         f"{task_id_for_log} (Async Query Logic) 开始处理查询: '{query_text[:100]}...', 目标返回精排后 top {top_k_final_reranked} 条"
     )
@@ -156,15 +158,14 @@ async def execute_query_processing_async(
             logger.debug(
                 f"{task_id_for_log} (Async Query Logic) 开始对 {len(candidate_chunks)} 个候选块进行 Rerank...")
 
-            reranked_scored_results: list[tuple[TextChunkResponse, float]] = await asyncio.to_thread(
-                rerank_documents,  # 这是你 app.core.reranker 中的函数
+            reranked_scored_results: list[tuple[TextChunkResponse, float]] = await rerank_documents_async(
                 query_text,
-                candidate_chunks
+                candidate_chunks,
+                top_n=top_k_final_reranked,  # 根据传入的 top_k_final_reranked 参数，只返回最终的文本块
             )
 
-            # 根据传入的 top_k_final_reranked 参数，提取最终的文本块
             final_reranked_chunks = [
-                doc_response for doc_response, score in reranked_scored_results[:top_k_final_reranked]
+                doc_response for doc_response, score in reranked_scored_results
             ]
             logger.info(
                 f"{task_id_for_log} (Async Query Logic) Rerank 完成，最终选取 {len(final_reranked_chunks)} 个文本块。")
@@ -189,12 +190,6 @@ async def execute_query_processing_async(
         # 对于查询处理任务，通常没有像文档处理那样的“状态”可以更新到数据库来标记错误。
         # 主要依赖 Celery 将任务标记为失败，并记录异常信息。
         raise e  # 将异常向上抛给 async_to_sync，再由同步任务的 except 块处理
-    finally:
-        # 最终清理
-        # 无论成功还是失败，最后都要关闭数据库引擎的连接池
-        logger.info(f"{task_id_for_log} (Async Logic) 关闭数据库连接池...")
-        await db_engine.dispose()
-        logger.info(f"{task_id_for_log} (Async Logic) 异步资源清理完毕。")
 
 
 
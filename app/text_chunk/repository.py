@@ -6,14 +6,32 @@
 @Date ：2025/11/4 18:12
 @DOC: 
 """
+from typing import AsyncIterator
 
-from sqlalchemy import select, delete
+import asyncpg
+import orjson
+from sqlalchemy import Row, bindparam, select, delete, insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.core.config import settings
 from app.models.models import TextChunk
 from app.schemas.schemas import TextChunkCreate
 
+# 按 ID 列表查询的语句在模块加载时构造一次，ID 列表通过 expanding 绑定参数传入，
+# 每次调用不再重新构造语句对象，不同长度的 ID 列表共用同一条缓存的编译结果
+_GET_BY_IDS = select(TextChunk).where(TextChunk.id.in_(bindparam("ids", expanding=True)))
+_GET_SLIM_BY_IDS = select(
+    TextChunk.id,
+    TextChunk.source_document_id,
+    TextChunk.source_original_filename,
+    TextChunk.chunk_text,
+    TextChunk.sequence_in_document,
+    TextChunk.metadata_json,
+    TextChunk.created_at,
+    TextChunk.updated_at,
+).where(TextChunk.id.in_(bindparam("ids", expanding=True)))
+
 
 class TextChunkRepository:
     def __init__(self, session: AsyncSession):
@@ -25,6 +43,7 @@ class TextChunkRepository:
         """
         new_chunk = TextChunk(
             source_document_id=data.source_document_id,
+            source_original_filename=data.source_original_filename,
             chunk_text=data.chunk_text,
             sequence_in_document=data.sequence_in_document,
             metadata_json=data.metadata_json,
@@ -47,28 +66,31 @@ class TextChunkRepository:
             await self.session.rollback()
             raise e  # 重新抛出其他未知异常
 
-    async def create_bulk(self, chunks_data: list[TextChunkCreate]) -> list[TextChunk]:
+    async def bulk_create(self, chunks: list[dict], batch_size: int = 1000) -> list[TextChunk]:
         """
         批量创建文本块记录。
-        这比逐个创建效率高得多。
+        少量数据使用 ORM 批量 INSERT ... RETURNING：每批一条多行 INSERT，不经过逐对象的 unit-of-work；
+        数量达到 settings.DB_COPY_THRESHOLD 时改用 COPY 导入，绕过逐行的 SQL 解析与执行计划。
+        两种方式都按输入顺序返回带数据库生成 ID 的 ORM 对象 (后续写入向量数据库需要 ID)。
+        :param chunks: 普通字典列表，键为 source_document_id、source_original_filename、chunk_text、
+                       sequence_in_document、metadata_json
+        :param batch_size: 每条 INSERT 语句包含的最大行数
         """
-        if not chunks_data:
+        if not chunks:
             return []
 
-        new_chunks_orm = [TextChunk(**data.model_dump()) for data in chunks_data]
-
-        self.session.add_all(new_chunks_orm)
         try:
+            if settings.DB_COPY_THRESHOLD and len(chunks) >= settings.DB_COPY_THRESHOLD:
+                new_chunks_orm = await self._copy_chunks(chunks)
+            else:
+                stmt = insert(TextChunk).returning(TextChunk, sort_by_parameter_order=True)
+                new_chunks_orm = []
+                for start in range(0, len(chunks), batch_size):
+                    result = await self.session.scalars(stmt, chunks[start:start + batch_size])
+                    new_chunks_orm.extend(result.all())
             await self.session.commit()
-            # 批量 refresh 可能比较麻烦或效率不高，通常在批量创建后，
-            # 如果需要立即使用这些对象的数据库生成属性（如ID），
-            # 可以选择不 refresh，或者如果数量不多，可以逐个 refresh。
-            # 对于 RAG 流程，通常创建后会立即用于向量化，ID 是关键。
-            # SQLAlchemy 2.0 的 add_all 配合 commit 后，对象会自动填充 ID。
-            # 如果需要其他数据库默认值或触发器生成的值，才需要 refresh。
-            # 我们这里假设 ID 会被自动填充。
             return new_chunks_orm
-        except IntegrityError as e:
+        except (IntegrityError, asyncpg.IntegrityConstraintViolationError) as e:
             await self.session.rollback()
             raise ValueError(
                 f"批量创建 TextChunk 失败，可能由于无效的 source_document_id: {str(e)}"
@@ -77,11 +99,60 @@ class TextChunkRepository:
             await self.session.rollback()
             raise e
 
+    async def _copy_chunks(self, chunks: list[dict]) -> list[TextChunk]:
+        """
+        在当前会话的事务中用 COPY 导入文本块，再按 (文档ID, 序号) 查回生成的 ID，失败时随会话一起回滚。
+        created_at / updated_at 不在 COPY 列中，由数据库默认值填充。
+        """
+        connection = await self.session.connection()
+        # SQLAlchemy 的 asyncpg 适配器在第一条经由它执行的语句时才发送 BEGIN；
+        # COPY 直接调用底层 asyncpg 连接，若它是会话事务中的第一条语句，就会在事务之外自动提交，
+        # 出错后 bulk_create 的 rollback() 无法撤销已导入的行。先经适配器执行一条语句，确保事务已开启。
+        await connection.exec_driver_sql("SELECT 1")
+        raw_connection = await connection.get_raw_connection()
+        records = [
+            (
+                chunk["source_document_id"],
+                chunk.get("source_original_filename", ""),
+                chunk["chunk_text"],
+                chunk["sequence_in_document"],
+                # asyncpg 的 jsonb 编解码器接收 JSON 字符串
+                orjson.dumps(chunk["metadata_json"]).decode() if chunk.get("metadata_json") is not None else None,
+            )
+            for chunk in chunks
+        ]
+        await raw_connection.driver_connection.copy_records_to_table(
+            TextChunk.__tablename__,
+            records=records,
+            columns=[
+                "source_document_id", "source_original_filename", "chunk_text", "sequence_in_document", "metadata_json"
+            ],
+        )
+
+        # COPY 不能返回生成的 ID，按文档查回；同一文档重复处理时同一序号可能有旧记录，按 ID 升序覆盖后保留最新的一条
+        document_ids = {chunk["source_document_id"] for chunk in chunks}
+        result = await self.session.scalars(
+            select(TextChunk)
+            .where(TextChunk.source_document_id.in_(document_ids))
+            .order_by(TextChunk.id)
+        )
+        by_key = {(chunk.source_document_id, chunk.sequence_in_document): chunk for chunk in result}
+        return [by_key[(chunk["source_document_id"], chunk["sequence_in_document"])] for chunk in chunks]
+
     async def get_by_ids(self, chunk_ids: list[int]) -> list[TextChunk]:
         if not chunk_ids:
             return []
-        query = select(TextChunk).where(TextChunk.id.in_(chunk_ids))
-        result = await self.session.scalars(query)
+        result = await self.session.scalars(_GET_BY_IDS, {"ids": chunk_ids})
+        return list(result.all())
+
+    async def get_slim_by_ids(self, chunk_ids: list[int]) -> list[Row]:
+        """
+        只查询 TextChunkResponse 需要的列，返回 Row 而不是 ORM 对象，
+        省去身份映射、实例状态跟踪等 ORM 开销 (检索热路径只读，不需要可变对象)。
+        """
+        if not chunk_ids:
+            return []
+        result = await self.session.execute(_GET_SLIM_BY_IDS, {"ids": chunk_ids})
         return list(result.all())
 
     async def get_by_document_id(
@@ -101,6 +172,23 @@ class TextChunkRepository:
         result = await self.session.scalars(query)
         return list(result.all())
 
+    async def iter_by_document_id(
+        self, document_id: int, batch_size: int = 1000
+    ) -> AsyncIterator[TextChunk]:
+        """
+        按顺序逐个产出某个源文档的全部文本块 (例如重新向量化、统计)。
+        使用服务端游标按 batch_size 分批拉取，内存中同时只保留一批对象，而不是一次物化整个文档。
+        """
+        query = (
+            select(TextChunk)
+            .where(TextChunk.source_document_id == document_id)
+            .order_by(TextChunk.sequence_in_document)  # 复合索引 ix_textchunk_doc_seq 直接按序扫描
+            .execution_options(yield_per=batch_size)
+        )
+        result = await self.session.stream_scalars(query)
+        async for chunk in result:
+            yield chunk
+
     async def delete_chunks_by_document_id(self, document_id: int):
         """
         根据源文档 ID 删除其所有关联的文本块。
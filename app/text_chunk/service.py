@@ -23,16 +23,17 @@ class TextChunkService:
         return TextChunkResponse.model_validate(new_chunk)
 
     async def add_chunks_for_document(
-        self, chunks_data: list[TextChunkCreate]
+        self, chunks_data: list[dict]
     ) -> list[TextChunkResponse]:
-        new_chunks = await self.repository.create_bulk(chunks_data)
+        new_chunks = await self.repository.bulk_create(chunks_data)
         return [TextChunkResponse.model_validate(chunk) for chunk in new_chunks]
 
     async def get_chunks_by_ids(self, chunk_ids: list[int]) -> list[TextChunkResponse]:
         if not chunk_ids:
             return []
-        chunks = await self.repository.get_by_ids(chunk_ids)
-        return [TextChunkResponse.model_validate(chunk) for chunk in chunks]
+        rows = await self.repository.get_slim_by_ids(chunk_ids)
+        # 数据直接来自数据库，字段与类型已由表结构保证，跳过校验直接构造
+        return [TextChunkResponse.model_construct(**row._mapping) for row in rows]
 
     async def get_document_chunks_for_display(
         self, document_id: int, limit: int = 1000, offset: int = 0
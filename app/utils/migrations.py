@@ -75,23 +75,16 @@ def run_migrations() -> Optional[bool]:
 
         # 如果命令有标准输出，则打印和记录输出信息
         if result.stdout:
-            print("数据库迁移输出:", result.stdout)  # 控制台输出迁移信息
-            logger.info(f"数据库迁移输出: {result.stdout}")  # 记录到日志文件
+            logger.info(f"数据库迁移输出: {result.stdout}")  # 记录迁移信息
 
-        # 打印迁移完成信息
-        print("数据库迁移完成")  # 控制台输出
-        logger.info("数据库迁移完成")  # 记录到日志文件
+        logger.info("数据库迁移完成")
     # 捕获子进程执行错误异常，处理alembic命令执行失败的情况
     except subprocess.CalledProcessError as e:
-        print(f"数据库迁移失败:Error: {e}")  # 控制台输出错误信息
-        print(f"标准输出:", e.stdout)  # 输出命令的标准输出信息
-        print(f"标准错误输出:", e.stderr)  # 输出命令的错误信息
-        logger.error(f"数据库迁移失败: {e.stderr}")  # 记录错误到日志文件
+        logger.error(f"数据库迁移失败: {e}\n标准输出: {e.stdout}\n标准错误输出: {e.stderr}")
         raise  # 重新抛出异常，让上层调用者处理
 
     # 捕获AWS客户端错误异常，处理MinIO或其他AWS服务相关的错误
     except ClientError as e:
-        print(f"运行时发生错误: {e}")  # 控制台输出错误信息
         logger.error(f"运行时发生错误: {e}")  # 记录错误到日志文件
         raise  # 重新抛出异常，让上层调用者处理
 
@@ -0,0 +1,19 @@
+# -*- coding: UTF-8 -*-
+"""
+@File ：migrate.py
+@IDE ：PyCharm
+@Author ：zhanzhicai
+@Date ：2025/11/21 16:30
+@DOC: 数据库迁移脚本，部署时作为独立步骤执行，应用启动时不再自动执行 DDL
+
+用法: uv run python scripts/migrate.py
+"""
+from pathlib import Path
+
+from alembic.config import main
+
+# alembic.ini 位于项目根目录
+ALEMBIC_INI_PATH = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+if __name__ == "__main__":
+    main(argv=["-c", str(ALEMBIC_INI_PATH), "upgrade", "head"])